@@ -1,14 +1,6 @@
-import os
 import re
 
-from google import genai
-
-
-def _get_client():
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        return None
-    return genai.Client(api_key=api_key)
+from llm_gateway import generate_text
 
 
 def _condition_instruction(condition):
@@ -87,7 +79,14 @@ def _parse_question_lines(text):
     return questions
 
 
-def generate_adaptive_questions(patient_data):
+def generate_adaptive_questions(patient_data, pad_with_fallbacks=True):
+    """
+    Three adaptive questions from the LLM. By default missing questions are filled with
+    the condition fallback list and any LLM failure returns that list. With
+    pad_with_fallbacks=False only the model's own questions are returned (possibly
+    fewer than three, or none) and an LLM failure raises, so callers can tell the two
+    apart and use a fallback of their own.
+    """
     condition = (patient_data.get("condition") or "general").strip().lower()
     stress_score = patient_data.get("stress_score")
     energy_score = patient_data.get("energy_score")
@@ -141,17 +140,7 @@ STRICT RULES:
 """
 
     try:
-        client = _get_client()
-        if not client:
-            raise ValueError("GEMINI_API_KEY is not configured")
-
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=prompt,
-            config={"temperature": 0.9},
-        )
-
-        text = (response.text or "").strip()
+        text = generate_text("adaptive_questions", prompt, temperature=0.9)
         history_set = {
             str(h).strip().lower()
             for h in question_history
@@ -167,6 +156,9 @@ STRICT RULES:
                 continue
             cleaned.append(question)
 
+        if not pad_with_fallbacks:
+            return cleaned[:3]
+
         fallback_questions = get_condition_fallback_questions(condition)
         fallback_iter = [
             q for q in fallback_questions if q.strip().lower() not in history_set
@@ -182,4 +174,6 @@ STRICT RULES:
 
         return cleaned[:3]
     except Exception:
+        if not pad_with_fallbacks:
+            raise
         return get_condition_fallback_questions(condition)[:3]
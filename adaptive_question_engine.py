@@ -1,22 +1,43 @@
+import json
+import os
+import threading
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 
 from adherence_tracker import calculate_adherence_score
 from adaptive_question_api import generate_adaptive_questions
 from adaptive_risk_api import estimate_patient_risk
 from carebridge_engine import calculate_patient_risk
+from health_summary_engine import enqueue_patient_summary
+from jobs import enqueue, register_job_handler
 from models import (
-    add_assessment_history,
+    get_adaptive_question_set,
     get_assessment_history_entries,
     get_assessment_history_questions,
+    get_cached_patient_summary,
     get_patient_state_row,
-    get_question_bank_item,
+    get_question_bank_items,
     get_recent_patient_answers,
     get_user,
+    get_user_medicines,
     list_question_bank,
-    save_patient_answer,
+    list_users_missing_question_sets,
+    save_adaptive_question_set,
+    save_assessment_submission,
+    save_patient_risk,
     upsert_patient_state,
 )
 
+PATIENT_RISK_JOB = "patient_risk"
+ADAPTIVE_QUESTIONS_JOB = "adaptive_questions"
+
+# Question sets are prepared this far ahead of the assessment they are for.
+QUESTION_PRECOMPUTE_HOURS = float(os.environ.get("QUESTION_PRECOMPUTE_HOURS", "24"))
+
+# {(user_id, due_key): Future} for question sets being generated in this process.
+_flights = {}
+_flights_lock = threading.Lock()
+
 
 def _clamp_0_100(value):
     return max(0, min(100, int(round(value))))
@@ -80,24 +101,27 @@ def get_patient_state(user_id):
     return default_state
 
 
-def is_assessment_due(user_id):
-    state = get_patient_state(user_id)
+def _is_due(state):
     next_due = _parse_datetime(state.get("next_assessment_due"))
     if not next_due:
         return True
     return datetime.now() >= next_due
 
 
-def select_adaptive_questions(user_id):
+def is_assessment_due(user_id):
+    return _is_due(get_patient_state(user_id))
+
+
+def select_adaptive_questions(user_id, user=None, state=None):
     """
     Select 3-5 adaptive questions based on condition, state, previous answers, and trend.
     """
-    user = get_user(user_id)
+    user = user or get_user(user_id)
     if not user:
         return []
 
     condition = (user["condition"] or "general").strip().lower()
-    state = get_patient_state(user_id)
+    state = state or get_patient_state(user_id)
     recent_answers = get_recent_patient_answers(user_id)
 
     stress_avg = 0
@@ -225,12 +249,13 @@ def _normalize_fallback_monitoring_questions():
     return normalized
 
 
-def get_db_fallback_questions(user_id, history=None):
+def get_db_fallback_questions(user_id, history=None, user=None, state=None):
     history_set = {
         q.strip().lower() for q in (history or []) if q and str(q).strip()
     }
 
-    selected = _normalize_db_questions(select_adaptive_questions(user_id))
+    user = user or get_user(user_id)
+    selected = _normalize_db_questions(select_adaptive_questions(user_id, user, state))
     filtered = [
         q for q in selected if q["question_text"].strip().lower() not in history_set
     ]
@@ -238,7 +263,6 @@ def get_db_fallback_questions(user_id, history=None):
     if len(filtered) >= 3:
         return filtered[:5]
 
-    user = get_user(user_id)
     condition = (user["condition"] or "general").strip().lower() if user else "general"
     extra_pool = list_question_bank(condition=condition) + list_question_bank(condition="general")
 
@@ -263,28 +287,46 @@ def get_db_fallback_questions(user_id, history=None):
     return filtered if filtered else _normalize_fallback_monitoring_questions()
 
 
-def get_adaptive_questions(user_id):
-    user = get_user(user_id)
-    if not user:
-        return _normalize_fallback_monitoring_questions()
+def build_patient_context(user_id, user, state):
+    """
+    The patient_data dict generate_adaptive_questions expects: scores, trend and risk
+    from PatientState, medications with their adherence, recent assessment answers, the
+    stored health summary (never generated here) and the questions asked recently.
+    """
+    medicines = get_user_medicines(user_id)
+    taken = sum(medicine["taken_count"] for medicine in medicines)
+    total = sum(medicine["total_count"] for medicine in medicines)
+    cached_summary = get_cached_patient_summary(user_id)
 
-    if not is_assessment_due(user_id):
-        return "Next assessment available tomorrow"
+    return {
+        "condition": user["condition"],
+        "stress_score": state["stress_score"],
+        "energy_score": state["energy_score"],
+        "adherence_score": round(taken / total * 100, 2) if total > 0 else 0.0,
+        "trend": state["trend"],
+        "risk_level": state.get("risk_level") or "Unknown",
+        "medication_list": [
+            f"{medicine['name']} {medicine['dosage']} ({medicine['schedule']})".strip()
+            for medicine in medicines
+        ],
+        "adherence_history": [
+            f"{medicine['name']}: {medicine['taken_count']}/{medicine['total_count']} doses taken"
+            for medicine in medicines
+        ],
+        "assessment_history": get_assessment_history_entries(user_id, limit=10),
+        "health_summary": cached_summary["summary"] if cached_summary else None,
+        "question_history": get_question_history(user_id, limit=10),
+    }
 
-    state = get_patient_state(user_id)
-    adherence = calculate_adherence_score(user_id)
-    history = get_question_history(user_id, limit=10)
 
-    try:
-        ai_questions = generate_adaptive_questions(
-            condition=user["condition"],
-            stress_score=state["stress_score"],
-            energy_score=state["energy_score"],
-            trend=state["trend"],
-            adherence_score=adherence["percentage"],
-            history=history,
-        )
+def _generate_question_set(user_id, user, state):
+    patient_data = build_patient_context(user_id, user, state)
+    history = patient_data["question_history"]
 
+    try:
+        # Unpadded, so only the model's own questions come back and an unavailable LLM
+        # raises; the question bank below makes a better, weighted fallback.
+        ai_questions = generate_adaptive_questions(patient_data, pad_with_fallbacks=False)
         cleaned = [q for q in ai_questions if q and q.strip()]
         if cleaned:
             normalized = []
@@ -303,17 +345,115 @@ def get_adaptive_questions(user_id):
                     }
                 )
             if normalized:
+                if len(normalized) < 3:
+                    used = {q["question_text"].strip().lower() for q in normalized}
+                    for question in get_db_fallback_questions(user_id, history=history, user=user, state=state):
+                        if len(normalized) >= 3:
+                            break
+                        if question["question_text"].strip().lower() not in used:
+                            normalized.append(question)
+                            used.add(question["question_text"].strip().lower())
                 return normalized[:3]
     except Exception:
         pass
 
-    db_fallback = get_db_fallback_questions(user_id, history=history)
+    db_fallback = get_db_fallback_questions(user_id, history=history, user=user, state=state)
     if db_fallback:
         return db_fallback
 
     return _normalize_fallback_monitoring_questions()
 
 
+def _single_flight(key, fn):
+    """
+    Run fn once per key at a time in this process: callers arriving while it runs wait
+    for and share the first caller's result (or exception).
+    """
+    with _flights_lock:
+        future = _flights.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _flights[key] = future
+    if not leader:
+        return future.result()
+
+    try:
+        result = fn()
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+
+
+def _question_set_key(state):
+    return state.get("next_assessment_due") or ""
+
+
+def prepare_adaptive_questions(user_id, user=None, state=None):
+    """
+    The question set for the patient's upcoming assessment: the stored one when it
+    exists, otherwise generated now and stored so later requests get the same questions.
+    """
+    user = user or get_user(user_id)
+    if not user:
+        return _normalize_fallback_monitoring_questions()
+    state = state or get_patient_state(user_id)
+    due_key = _question_set_key(state)
+
+    stored = get_adaptive_question_set(user_id, due_key)
+    if stored is None:
+        stored = _single_flight(
+            (user_id, due_key),
+            lambda: save_adaptive_question_set(
+                user_id,
+                due_key,
+                json.dumps(_generate_question_set(user_id, user, state)),
+                datetime.now().isoformat(timespec="seconds"),
+            ),
+        )
+    return json.loads(stored["questions"])
+
+
+def get_adaptive_questions(user_id):
+    user = get_user(user_id)
+    if not user:
+        return _normalize_fallback_monitoring_questions()
+
+    state = get_patient_state(user_id)
+    if not _is_due(state):
+        return "Next assessment available tomorrow"
+
+    return prepare_adaptive_questions(user_id, user, state)
+
+
+def enqueue_adaptive_questions(user_id):
+    return enqueue(
+        ADAPTIVE_QUESTIONS_JOB,
+        {"user_id": user_id},
+        dedupe_key=f"{ADAPTIVE_QUESTIONS_JOB}:{user_id}",
+    )
+
+
+def precompute_adaptive_questions(hours=None):
+    """
+    Queue question generation for every patient whose next assessment falls due within
+    `hours` (QUESTION_PRECOMPUTE_HOURS by default) and has no stored set yet.
+    Returns the number of patients queued.
+    """
+    hours = QUESTION_PRECOMPUTE_HOURS if hours is None else hours
+    due_before = (datetime.now() + timedelta(hours=hours)).isoformat(timespec="seconds")
+    rows = list_users_missing_question_sets(due_before)
+    for row in rows:
+        enqueue_adaptive_questions(row["user_id"])
+    return len(rows)
+
+
 def update_patient_state(user_id, answers, question_context=None):
     """
     Update stress/energy scores and trend based on submitted adaptive answers.
@@ -330,34 +470,31 @@ def update_patient_state(user_id, answers, question_context=None):
 
     context = question_context or {}
 
+    question_bank = get_question_bank_items(
+        [int(question_key) for question_key in answers if str(question_key).isdigit()]
+    )
+    patient_answers = []
+    history_rows = []
+
     for question_key, answer_value in answers.items():
         value = int(answer_value)
 
         question = None
         if str(question_key).isdigit():
-            question = get_question_bank_item(int(question_key))
+            question = question_bank.get(int(question_key))
 
         if question:
             weight = int(question["weight"])
             category = question["category"]
             question_text = question["question_text"]
-            save_patient_answer(
-                user_id=user_id,
-                question_id=int(question_key),
-                answer_value=value,
-                timestamp=timestamp,
-            )
+            patient_answers.append((int(question_key), value))
         else:
             metadata = context.get(str(question_key), {})
             weight = int(metadata.get("weight", 6))
             category = metadata.get("category", "stress")
             question_text = metadata.get("question_text", "Adaptive assessment question")
 
-        add_assessment_history(
-            user_id=user_id,
-            question=question_text,
-            answer=value,
-        )
+        history_rows.append((question_text, value))
 
         weight_factor = float(weight) / 10.0
 
@@ -376,52 +513,25 @@ def update_patient_state(user_id, answers, question_context=None):
     else:
         trend = "stable"
 
-    user = get_user(user_id)
-    adherence = calculate_adherence_score(user_id)
-    history_entries = get_assessment_history_entries(user_id, limit=10)
-
-    try:
-        risk_result = estimate_patient_risk(
-            condition=(user["condition"] if user else "general"),
-            stress_score=new_stress,
-            energy_score=new_energy,
-            adherence_score=adherence["percentage"],
-            trend=trend,
-            history=history_entries,
-        )
-    except Exception:
-        fallback = calculate_patient_risk(user_id)
-        fallback_level = fallback["risk"]
-        fallback_probability = {
-            "LOW": 25,
-            "MODERATE": 60,
-            "HIGH": 85,
-        }.get(fallback_level, 60)
-        fallback_recommendation = {
-            "LOW": "Continue current treatment",
-            "MODERATE": "Schedule appointment soon",
-            "HIGH": "Immediate medical consultation required",
-        }.get(fallback_level, "Schedule appointment soon")
-        risk_result = {
-            "risk_level": fallback_level,
-            "risk_probability": fallback_probability,
-            "reason": "Fallback rule-based risk from adherence and health stability.",
-            "recommendation": fallback_recommendation,
-        }
-
-    upsert_patient_state(
+    save_assessment_submission(
         user_id=user_id,
+        patient_answers=patient_answers,
+        history_entries=history_rows,
+        answered_at=timestamp,
         stress_score=new_stress,
         energy_score=new_energy,
         trend=trend,
-        last_updated=timestamp,
-        last_assessment_at=timestamp,
         next_assessment_due=next_due_timestamp,
-        risk_level=risk_result["risk_level"],
-        risk_probability=risk_result["risk_probability"],
-        risk_reason=risk_result["reason"],
-        recommendation=risk_result["recommendation"],
+        risk_level=state["risk_level"],
+        risk_probability=state["risk_probability"],
+        risk_reason=state["risk_reason"],
+        recommendation=state["recommendation"],
     )
+    # The LLM risk estimate and the health summary are refreshed by the job worker;
+    # until then the previous risk stays on PatientState.
+    enqueue_patient_risk(user_id)
+    enqueue_patient_summary(user_id)
+    enqueue_adaptive_questions(user_id)
 
     return {
         "user_id": user_id,
@@ -431,8 +541,76 @@ def update_patient_state(user_id, answers, question_context=None):
         "last_updated": timestamp,
         "last_assessment_at": timestamp,
         "next_assessment_due": next_due_timestamp,
-        "risk_level": risk_result["risk_level"],
-        "risk_probability": risk_result["risk_probability"],
-        "risk_reason": risk_result["reason"],
-        "recommendation": risk_result["recommendation"],
+        "risk_level": state["risk_level"],
+        "risk_probability": state["risk_probability"],
+        "risk_reason": state["risk_reason"],
+        "recommendation": state["recommendation"],
+    }
+
+
+def _fallback_risk(user_id):
+    fallback_level = calculate_patient_risk(user_id)["risk"]
+    fallback_probability = {
+        "LOW": 25,
+        "MODERATE": 60,
+        "HIGH": 85,
+    }.get(fallback_level, 60)
+    fallback_recommendation = {
+        "LOW": "Continue current treatment",
+        "MODERATE": "Schedule appointment soon",
+        "HIGH": "Immediate medical consultation required",
+    }.get(fallback_level, "Schedule appointment soon")
+    return {
+        "risk_level": fallback_level,
+        "risk_probability": fallback_probability,
+        "reason": "Fallback rule-based risk from adherence and health stability.",
+        "recommendation": fallback_recommendation,
     }
+
+
+def refresh_patient_risk(user_id):
+    """
+    Estimate risk from the stored patient state and last 10 assessment answers, falling
+    back to the rule-based risk when the LLM is unavailable, and save it on PatientState.
+    """
+    state = get_patient_state_row(user_id)
+    if not state:
+        return None
+
+    user = get_user(user_id)
+    adherence = calculate_adherence_score(user_id)
+    try:
+        risk_result = estimate_patient_risk(
+            condition=(user["condition"] if user else "general"),
+            stress_score=state["stress_score"],
+            energy_score=state["energy_score"],
+            adherence_score=adherence["percentage"],
+            trend=state["trend"],
+            history=get_assessment_history_entries(user_id, limit=10),
+        )
+    except Exception:
+        risk_result = _fallback_risk(user_id)
+
+    save_patient_risk(
+        user_id,
+        risk_result["risk_level"],
+        risk_result["risk_probability"],
+        risk_result["reason"],
+        risk_result["recommendation"],
+    )
+    return risk_result
+
+
+def enqueue_patient_risk(user_id):
+    return enqueue(
+        PATIENT_RISK_JOB,
+        {"user_id": user_id},
+        dedupe_key=f"{PATIENT_RISK_JOB}:{user_id}",
+    )
+
+
+register_job_handler(PATIENT_RISK_JOB, lambda payload: refresh_patient_risk(payload["user_id"]))
+register_job_handler(
+    ADAPTIVE_QUESTIONS_JOB,
+    lambda payload: len(prepare_adaptive_questions(payload["user_id"])),
+)
@@ -1,14 +1,10 @@
 import json
 import os
 
-from google import genai
+from llm_gateway import generate_text
 
-
-def _get_client():
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        return None
-    return genai.Client(api_key=api_key)
+# Identical patient state and history give an identical prompt; 0 disables the cache.
+PATIENT_RISK_CACHE_TTL_SECONDS = float(os.environ.get("PATIENT_RISK_CACHE_TTL_SECONDS", "86400"))
 
 
 def parse_json_response(text):
@@ -68,15 +64,10 @@ Return STRICT JSON format:
 }}
 """
 
-    client = _get_client()
-    if not client:
-        raise ValueError("GEMINI_API_KEY is not configured")
-
-    response = client.models.generate_content(
-        model="gemini-1.5-flash",
-        contents=prompt,
-        config={"temperature": 0.3},
+    text = generate_text(
+        "patient_risk",
+        prompt,
+        temperature=0.3,
+        cache_ttl_seconds=PATIENT_RISK_CACHE_TTL_SECONDS,
     )
-
-    text = (response.text or "").strip()
     return parse_json_response(text)
@@ -17,7 +17,11 @@ def calculate_adherence_score(user_id):
     adherence_score = taken_count / total_count
     Returns percentage and ratio.
     """
-    medicines = get_user_medicines(user_id)
+    return summarize_adherence(get_user_medicines(user_id))
+
+
+def summarize_adherence(medicines):
+    """calculate_adherence_score over already loaded Medicine rows."""
     if not medicines:
         return {"ratio": 0.0, "percentage": 0.0, "taken": 0, "total": 0}
 
@@ -1,36 +1,57 @@
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 
-from flask import Flask, abort, redirect, render_template, send_file, request, session, url_for
+import click
+from flask import Flask, abort, jsonify, redirect, render_template, send_file, request, session, url_for
 from flask_cors import CORS
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from adherence_tracker import add_medicine, calculate_adherence_score, log_medicine_taken
+from adherence_tracker import (
+    add_medicine,
+    calculate_adherence_score,
+    log_medicine_taken,
+    summarize_adherence,
+)
 from adaptive_question_engine import (
     get_fallback_questions,
     get_adaptive_questions,
     get_patient_state,
     is_assessment_due,
+    precompute_adaptive_questions,
     select_adaptive_questions,
     update_patient_state,
 )
-from carebridge_engine import calculate_patient_risk, generate_doctor_recommendation
+import cache_store
+from carebridge_engine import (
+    calculate_patient_risk,
+    generate_doctor_recommendation,
+    patient_risk_from_data,
+)
 from config import BASE_URL
-from database import init_db
-from emergency_engine import recommend_emergency_hospital
+from database import LATEST_SCHEMA_VERSION, init_db, release_shared_connection
+from emergency_routing import (
+    recommend_emergency_route,
+    start_emergency_route_warmup,
+    warm_emergency_routes,
+)
 from explanation_engine import (
     generate_doctor_recommendation_explanation,
     generate_hospital_explanation,
 )
-from geolocation_service import geocode_location
+from gazetteer import import_geonames
+from geolocation_service import GEOCODE_CACHE_NAMESPACE, geocode_location
 from health_monitor import compute_health_stability
-from health_summary_engine import generate_patient_summary
-from hospital_service import fetch_nearest_hospitals_overpass
+from health_summary_engine import get_patient_summary
+from hospital_index import backfill_hospital_coordinates
+from hospital_service import fetch_nearest_hospitals_overpass, overpass_tile_version
+from jobs import enqueue_if_new, register_job_handler, run_worker, start_job_workers
 from models import (
     add_doctor_prescription,
     approve_doctor_patient_link,
     add_question,
     connect_patient_to_doctor,
+    count_answers_for_user,
     create_doctor_account,
     create_questionnaire,
     create_user,
@@ -42,7 +63,6 @@ from models import (
     get_doctor_by_email,
     get_doctors_by_hospital,
     get_emergency_contacts,
-    get_health_logs,
     get_health_summary,
     get_hospital,
     get_prescriptions,
@@ -54,22 +74,36 @@ from models import (
     get_questions_for_questionnaire,
     get_user,
     get_user_medicines,
+    get_health_log_series,
+    get_health_logs_page,
+    get_patient_dashboard_rows,
     get_patient_state_row,
     get_pending_links_for_doctor,
-    get_patient_prescriptions,
     get_portal_doctor,
     is_doctor_linked_to_patient,
     link_patient_doctor,
     list_hospitals,
+    list_unlocated_users,
+    rebuild_health_log_rollups,
     save_answer,
+    set_user_coordinates,
 )
 from qr_generator import generate_qr
 from scoring_engine import rank_hospitals_with_location
+from specialization_inference import SPECIALIZATION_CACHE_NAMESPACE
 
 app = Flask(__name__)
 CORS(app)
 app.secret_key = "carematch-hackathon-secret"
 
+HOSPITAL_RANK_CACHE_NAMESPACE = "hospital_rank"
+HOSPITAL_RANK_TTL_SECONDS = float(os.environ.get("HOSPITAL_RANK_TTL_SECONDS", "600"))
+HOSPITAL_RANK_JOB = "hospital_rank"
+# The dashboard lists only the newest few health logs; older ones load on demand.
+DASHBOARD_HEALTH_LOG_LIMIT = 5
+HEALTH_LOG_PAGE_MAX = 100
+HEALTH_LOG_SERIES_MAX_DAYS = 730
+
 
 def _is_patient_session():
     return session.get("role") == "patient" and session.get("user_id") is not None
@@ -96,9 +130,113 @@ def _resolve_qr_base_url(request_host_url):
     return BASE_URL
 
 
+# Schema bootstrap and cache warm-up run once per process at import time; the request
+# path never issues DDL. `flask --app app init-db` applies migrations ahead of a deploy;
+# importing the app has already run them by the time the command body executes, so it
+# reports what this process applied at import.
+_migrations_applied_at_import = init_db()
+cache_store.warm([GEOCODE_CACHE_NAMESPACE, SPECIALIZATION_CACHE_NAMESPACE, HOSPITAL_RANK_CACHE_NAMESPACE])
+release_shared_connection()
+
+# The emergency tile warm-up and the job worker threads start with the first request a
+# process serves, so CLI commands, scripts importing the app and the reloader's watcher
+# process never run jobs. START_BACKGROUND_WORK=0 leaves them off entirely.
+START_BACKGROUND_WORK = os.environ.get("START_BACKGROUND_WORK", "1") != "0"
+_background_started = False
+_background_lock = threading.Lock()
+
+
 @app.before_request
-def setup_database_once():
-    init_db()
+def start_background_work():
+    global _background_started
+    if _background_started or not START_BACKGROUND_WORK:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    start_emergency_route_warmup()
+    start_job_workers()
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Apply pending schema migrations."""
+    applied = _migrations_applied_at_import + init_db()
+    click.echo(f"Applied {applied} migration(s); schema is at version {LATEST_SCHEMA_VERSION}.")
+
+
+@app.cli.command("import-gazetteer")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--min-population", default=0, show_default=True, help="Skip smaller places.")
+@click.option("--country", "countries", multiple=True, help="ISO country code to keep; repeatable.")
+@click.option("--skip-alternate-names", is_flag=True, help="Index primary names only.")
+def import_gazetteer_command(path, min_population, countries, skip_alternate_names):
+    """Load a GeoNames-format TSV into the offline gazetteer."""
+    places, names = import_geonames(
+        path,
+        min_population=min_population,
+        countries=countries,
+        include_alternate_names=not skip_alternate_names,
+    )
+    # Cached misses and Nominatim answers may now resolve differently.
+    cache_store.clear(GEOCODE_CACHE_NAMESPACE)
+    click.echo(f"Imported {places} place(s) under {names} name(s).")
+
+
+@app.cli.command("locate-hospitals")
+def locate_hospitals_command():
+    """Geocode hospitals that have no coordinates so the spatial index can serve them."""
+    located, missing = backfill_hospital_coordinates()
+    click.echo(f"Located {located} hospital(s); {missing} could not be geocoded.")
+
+
+@app.cli.command("locate-users")
+def locate_users_command():
+    """Geocode patients that have no stored coordinates and precompute their emergency tiles."""
+    located = 0
+    missing = 0
+    for user in list_unlocated_users():
+        coords = geocode_location(user["location"])
+        if coords is None:
+            missing += 1
+            continue
+        set_user_coordinates(user["id"], coords[0], coords[1])
+        located += 1
+    tiles = warm_emergency_routes()
+    click.echo(f"Located {located} patient(s); {missing} could not be geocoded; {tiles} emergency tile(s).")
+
+
+@app.cli.command("backfill-health-rollups")
+@click.option("--user-id", type=int, default=None, help="Rebuild one patient only.")
+def backfill_health_rollups_command(user_id):
+    """Recompute daily and weekly health log rollups from the raw logs."""
+    rebuild_health_log_rollups(user_id)
+    click.echo("Rebuilt health log rollups" + (f" for patient {user_id}." if user_id else "."))
+
+
+@app.cli.command("run-jobs")
+@click.option("--once", is_flag=True, help="Exit once no job is due instead of polling.")
+def run_jobs_command(once):
+    """Run queued background jobs (risk estimates, health summaries) in this process."""
+    processed = run_worker(exit_when_idle=once)
+    click.echo(f"Ran {processed} job(s).")
+
+
+@app.cli.command("precompute-questions")
+@click.option("--hours", type=float, default=None, help="Look-ahead window; defaults to QUESTION_PRECOMPUTE_HOURS.")
+@click.option("--run", "run_now", is_flag=True, help="Generate the sets in this process instead of leaving them to the workers.")
+def precompute_questions_command(hours, run_now):
+    """Queue adaptive question sets for patients whose next assessment is coming up (run nightly)."""
+    queued = precompute_adaptive_questions(hours)
+    click.echo(f"Queued question sets for {queued} patient(s).")
+    if run_now:
+        click.echo(f"Ran {run_worker(exit_when_idle=True)} job(s).")
+
+
+@app.teardown_appcontext
+def release_db_connection(_exc):
+    release_shared_connection()
 
 
 def _get_current_user():
@@ -124,9 +262,19 @@ def _to_float_or_none(value):
         return None
 
 
+def _user_coordinates(user, allow_network=True):
+    """Stored (lat, lon) for the patient, geocoding and storing them on first use."""
+    if user.get("latitude") is not None and user.get("longitude") is not None:
+        return user["latitude"], user["longitude"]
+    coords = geocode_location(user.get("location"), allow_network=allow_network)
+    if coords:
+        set_user_coordinates(user["id"], coords[0], coords[1])
+    return coords
+
+
 def _rank_for_user(user, user_lat=None, user_lon=None):
     if user_lat is None or user_lon is None:
-        user_location_coords = geocode_location(user.get("location"))
+        user_location_coords = _user_coordinates(user)
         if user_location_coords:
             user_lat, user_lon = user_location_coords
 
@@ -166,6 +314,161 @@ def _rank_for_user(user, user_lat=None, user_lon=None):
     return ranked, overpass_used
 
 
+def _cached_rank_for_user(user, user_lat=None, user_lon=None, cache_only=False):
+    """
+    _rank_for_user behind the shared cache. Scores depend only on the patient's condition
+    and position, so results are shared per condition and ~100 m cell, and dropped when
+    the Overpass tile they were ranked from is fetched again. Empty rankings are not cached.
+    With cache_only nothing is fetched: a miss returns no ranking and queues a job that
+    ranks in the background for the next request, unless one for the same inputs is
+    already queued or recently finished.
+    """
+    if user_lat is None or user_lon is None:
+        user_location_coords = _user_coordinates(user, allow_network=not cache_only)
+        if user_location_coords:
+            user_lat, user_lon = user_location_coords
+    if user_lat is None or user_lon is None:
+        if cache_only:
+            _enqueue_hospital_rank(user)
+        return [], False
+
+    cell = f"{(user.get('condition') or 'general').strip().lower()}:{user_lat:.3f}:{user_lon:.3f}"
+    version = overpass_tile_version(user_lat, user_lon)
+    hit, cached = cache_store.lookup(HOSPITAL_RANK_CACHE_NAMESPACE, f"{cell}:{version}")
+    # Entries written before overpass_used was stored alongside are plain lists; rank again.
+    if hit and isinstance(cached, dict):
+        return cached["hospitals"], cached["overpass_used"]
+    if cache_only:
+        _enqueue_hospital_rank(user, user_lat, user_lon, version)
+        return [], False
+
+    ranked, overpass_used = _rank_for_user(user, user_lat=user_lat, user_lon=user_lon)
+    if ranked:
+        # Read the version after ranking: the Overpass fetch may just have stored the tile.
+        cache_store.store(
+            HOSPITAL_RANK_CACHE_NAMESPACE,
+            f"{cell}:{overpass_tile_version(user_lat, user_lon)}",
+            {"hospitals": ranked, "overpass_used": overpass_used},
+            HOSPITAL_RANK_TTL_SECONDS,
+        )
+    return ranked, overpass_used
+
+
+def _enqueue_hospital_rank(user, user_lat=None, user_lon=None, version=None):
+    # The location text and tile version are part of the inputs: a patient whose
+    # location could not be resolved is only re-ranked once it changes or the outcome
+    # expires, and a refetched tile is ranked again.
+    enqueue_if_new(
+        HOSPITAL_RANK_JOB,
+        {
+            "user_id": user["id"],
+            "location": user.get("location"),
+            "lat": user_lat,
+            "lon": user_lon,
+            "version": version,
+        },
+        dedupe_key=f"{HOSPITAL_RANK_JOB}:{user['id']}",
+        outcome_ttl_seconds=HOSPITAL_RANK_TTL_SECONDS,
+    )
+
+
+def _hospital_rank_job(payload):
+    user = get_user(payload["user_id"])
+    if not user:
+        return {"hospitals": 0, "overpass_used": False}
+    ranked, overpass_used = _cached_rank_for_user(user, user_lat=payload.get("lat"), user_lon=payload.get("lon"))
+    return {"hospitals": len(ranked), "overpass_used": overpass_used}
+
+
+register_job_handler(HOSPITAL_RANK_JOB, _hospital_rank_job)
+
+
+def _health_log_cursor(log):
+    return f"{log['date']}|{log['id']}"
+
+
+def _parse_health_log_cursor(value):
+    """(date, id) from a cursor made by _health_log_cursor, or None when malformed."""
+    date, _, log_id = (value or "").rpartition("|")
+    if not date or not log_id.isdigit():
+        return None
+    return date, int(log_id)
+
+
+def _health_log_window(user_id, limit, before=None, logs=None):
+    """
+    One page of health logs plus the cursor of the next one (None on the last page).
+    logs may hold rows already fetched with limit + 1.
+    """
+    if logs is None:
+        logs = get_health_logs_page(user_id, limit + 1, before)
+    next_cursor = _health_log_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return logs[:limit], next_cursor
+
+
+def _load_patient_dashboard_view(user):
+    """
+    Everything patient_dashboard renders. The patient's rows come from one batch of reads
+    (get_patient_dashboard_rows); adherence, health stability, fallback risk and the
+    summary fingerprint are derived from those rows instead of being queried again, and
+    the hospital recommendation is taken from the ranking cache only.
+    """
+    rows = get_patient_dashboard_rows(user["id"], DASHBOARD_HEALTH_LOG_LIMIT + 1)
+    health_logs, health_logs_next = _health_log_window(
+        user["id"], DASHBOARD_HEALTH_LOG_LIMIT, logs=rows["health_logs"]
+    )
+    adherence = summarize_adherence(rows["medicines"])
+    latest_log = health_logs[0] if health_logs else None
+
+    health_summary = None
+    if latest_log:
+        health_summary = compute_health_stability(
+            sleep_hours=latest_log["sleep_hours"],
+            stress_level=latest_log["stress_level"],
+            energy_level=latest_log["energy_level"],
+            adherence_score=adherence["ratio"],
+        )
+
+    # get_patient_state() creates the row on a patient's first visit.
+    adaptive_state = rows["state"] or get_patient_state(user["id"])
+    patient_health_summary = get_patient_summary(
+        user["id"],
+        user=user,
+        preloaded={
+            "state": adaptive_state,
+            "recent_answers": rows["recent_answers"],
+            "adherence": adherence,
+        },
+    )
+
+    risk_level = adaptive_state.get("risk_level")
+    if not risk_level:
+        risk_level = patient_risk_from_data(
+            adherence, latest_log, count_answers_for_user(user["id"])
+        )["risk"]
+    adaptive_risk = {
+        "risk": risk_level,
+        "risk_probability": adaptive_state.get("risk_probability"),
+        "risk_reason": adaptive_state.get("risk_reason"),
+        "recommendation": adaptive_state.get("recommendation"),
+    }
+
+    ranked_hospitals, _ = _cached_rank_for_user(user, cache_only=True)
+    return {
+        "user": user,
+        "adherence": adherence,
+        "medicines": rows["medicines"],
+        "prescriptions": rows["prescriptions"],
+        "health_logs": health_logs,
+        "health_logs_next": health_logs_next,
+        "health_summary": health_summary,
+        "patient_health_summary": patient_health_summary,
+        "top_recommendation": ranked_hospitals[0] if ranked_hospitals else None,
+        "adaptive_state": adaptive_state,
+        "adaptive_risk": adaptive_risk,
+    }
+
+
 @app.route("/")
 def landing_page():
     return render_template("index.html")
@@ -209,11 +512,13 @@ def search():
                 message="Create a patient password with at least 6 characters.",
             )
 
+        location = request.form.get("location", "Bengaluru")
+        coords = geocode_location(location) or (None, None)
         user_id = create_user(
             name=request.form.get("name", "Anonymous User").strip() or "Anonymous User",
             age=int(request.form.get("age", 30)),
             gender=request.form.get("gender", "Not specified"),
-            location=request.form.get("location", "Bengaluru"),
+            location=location,
             condition=request.form.get("condition", "general").lower(),
             password=generate_password_hash(raw_password),
             income_range=request.form.get("income_range", "Medium"),
@@ -224,6 +529,8 @@ def search():
             medical_conditions=request.form.get("medical_conditions", "").strip(),
             emergency_contact_name=request.form.get("emergency_contact_name", "").strip(),
             emergency_contact_phone=request.form.get("emergency_contact_phone", "").strip(),
+            latitude=coords[0],
+            longitude=coords[1],
         )
         session["user_id"] = user_id
         session["role"] = "patient"
@@ -249,21 +556,36 @@ def hospitals_page():
     user_lat = _to_float_or_none(request.args.get("lat"))
     user_lon = _to_float_or_none(request.args.get("lon"))
 
-    ranked_hospitals, overpass_used = _rank_for_user(user, user_lat=user_lat, user_lon=user_lon)
-    best_hospital = ranked_hospitals[0] if ranked_hospitals else None
+    # The ranking itself is fetched from /api/hospitals/rank once the page is shown.
     new_patient_id_notice = session.pop("new_patient_id_notice", None)
     return render_template(
         "hospitals.html",
         user=user,
-        ranked_hospitals=ranked_hospitals,
-        best_hospital=best_hospital,
         user_lat=user_lat,
         user_lon=user_lon,
         new_patient_id_notice=new_patient_id_notice,
-        overpass_used=overpass_used,
     )
 
 
+@app.route("/api/hospitals/rank")
+def api_rank_hospitals():
+    user = _get_current_user()
+    if not user:
+        return jsonify({"error": "Patient session required."}), 401
+
+    user_lat = _to_float_or_none(request.args.get("lat"))
+    user_lon = _to_float_or_none(request.args.get("lon"))
+
+    ranked_hospitals, overpass_used = _cached_rank_for_user(user, user_lat=user_lat, user_lon=user_lon)
+    hospitals = []
+    for hospital in ranked_hospitals:
+        hospital = dict(hospital)
+        if hospital["source"] != "overpass":
+            hospital["doctors_url"] = url_for("doctors", hospital_id=hospital["hospital_id"])
+        hospitals.append(hospital)
+    return jsonify({"hospitals": hospitals, "overpass_used": overpass_used})
+
+
 @app.route("/doctor/register", methods=["GET", "POST"])
 def doctor_register():
     message = None
@@ -333,7 +655,7 @@ def doctor_portal_dashboard():
         patient_rows.append(
             {
                 "patient": patient,
-                "summary": generate_patient_summary(patient["patient_id"]),
+                "summary": get_patient_summary(patient["patient_id"]),
             }
         )
 
@@ -393,7 +715,7 @@ def doctor_patient_detail(patient_id):
     assessment_history = get_assessment_history_for_patient(patient_id, limit=30)
     prescriptions = get_doctor_patient_prescriptions(doctor["id"], patient_id)
     adherence = calculate_adherence_score(patient_id)
-    patient_health_summary = generate_patient_summary(patient_id)
+    patient_health_summary = get_patient_summary(patient_id)
 
     return render_template(
         "doctor_patient.html",
@@ -519,45 +841,51 @@ def patient_dashboard():
     if not user:
         return redirect(url_for("patient_login"))
 
-    adherence = calculate_adherence_score(user["id"])
-    medicines = get_user_medicines(user["id"])
-    prescriptions = get_patient_prescriptions(user["id"])
-    health_logs = get_health_logs(user["id"])
-    latest_log = get_latest_health_log(user["id"])
+    return render_template("patient_dashboard.html", **_load_patient_dashboard_view(user))
 
-    health_summary = None
-    if latest_log:
-        health_summary = compute_health_stability(
-            sleep_hours=latest_log["sleep_hours"],
-            stress_level=latest_log["stress_level"],
-            energy_level=latest_log["energy_level"],
-            adherence_score=adherence["ratio"],
-        )
 
-    ranked_hospitals, _ = _rank_for_user(user)
-    top_recommendation = ranked_hospitals[0] if ranked_hospitals else None
-    adaptive_state = get_patient_state(user["id"])
-    patient_health_summary = generate_patient_summary(user["id"])
-    adaptive_risk = {
-        "risk": adaptive_state.get("risk_level") or calculate_patient_risk(user["id"])["risk"],
-        "risk_probability": adaptive_state.get("risk_probability"),
-        "risk_reason": adaptive_state.get("risk_reason"),
-        "recommendation": adaptive_state.get("recommendation"),
-    }
+@app.route("/api/health_logs")
+def api_health_logs():
+    user = _get_current_user() if _is_patient_session() else None
+    if not user:
+        return jsonify({"error": "Patient session required."}), 401
 
-    return render_template(
-        "patient_dashboard.html",
-        user=user,
-        adherence=adherence,
-        medicines=medicines,
-        prescriptions=prescriptions,
-        health_logs=health_logs,
-        health_summary=health_summary,
-        patient_health_summary=patient_health_summary,
-        top_recommendation=top_recommendation,
-        adaptive_state=adaptive_state,
-        adaptive_risk=adaptive_risk,
-    )
+    before = None
+    if request.args.get("before"):
+        before = _parse_health_log_cursor(request.args["before"])
+        if before is None:
+            return jsonify({"error": "Invalid cursor."}), 400
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    limit = max(1, min(HEALTH_LOG_PAGE_MAX, limit))
+
+    logs, next_cursor = _health_log_window(user["id"], limit, before)
+    return jsonify({"logs": logs, "next_cursor": next_cursor})
+
+
+@app.route("/api/health_logs/series")
+def api_health_log_series():
+    user = _get_current_user() if _is_patient_session() else None
+    if not user:
+        return jsonify({"error": "Patient session required."}), 401
+
+    period = request.args.get("period", "day")
+    if period not in ("day", "week"):
+        return jsonify({"error": "period must be 'day' or 'week'."}), 400
+    try:
+        days = int(request.args.get("days", 90))
+    except ValueError:
+        return jsonify({"error": "days must be an integer."}), 400
+    days = max(1, min(HEALTH_LOG_SERIES_MAX_DAYS, days))
+
+    end = datetime.now().date()
+    start = end - timedelta(days=days - 1)
+    if period == "week":
+        start -= timedelta(days=start.weekday())
+    series = get_health_log_series(user["id"], period, start.isoformat(), end.isoformat())
+    return jsonify({"period": period, "start": start.isoformat(), "end": end.isoformat(), "series": series})
 
 
 @app.route("/patient/logout")
@@ -788,7 +1116,9 @@ def family_dashboard(user_id):
     recommendation_explanation = generate_doctor_recommendation_explanation(
         risk_snapshot["risk"], recommendation
     )
-    emergency_hospital = recommend_emergency_hospital(user["location"])
+    # Emergency answers never wait on Nominatim: stored or locally resolvable coordinates only.
+    user_lat, user_lon = _user_coordinates(user, allow_network=False) or (None, None)
+    emergency_hospital = recommend_emergency_route(user_lat, user_lon)
 
     return render_template(
         "family_dashboard.html",
@@ -931,6 +1261,5 @@ def submit_adaptive_assessment(user_id):
 
 
 if __name__ == "__main__":
-    init_db()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
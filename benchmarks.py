@@ -0,0 +1,662 @@
+"""
+Micro-benchmarks for CareMatch hot paths.
+
+Usage:
+    python benchmarks.py                 # run every benchmark
+    python benchmarks.py schema_setup    # run selected benchmarks
+
+Each benchmark runs against a throwaway SQLite file so the real database is never touched.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import adherence_tracker
+import cache_store
+import database
+import emergency_engine
+import emergency_routing
+import gazetteer
+import geolocation_service
+import hospital_index
+import hospital_service
+import jobs
+import llm_gateway
+import models
+import scoring_engine
+from stub_servers import NominatimStubHandler, OverpassStubHandler, StubLLMBackend, start_stub_server
+
+
+def _use_temp_database():
+    handle, path = tempfile.mkstemp(prefix="carematch-bench-", suffix=".db")
+    os.close(handle)
+    os.remove(path)
+    database.release_shared_connection()
+    database.close_idle_connections()
+    database.DB_PATH = path
+    return path
+
+
+def _ms_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / iterations
+
+
+def _legacy_schema_setup():
+    # What every HTTP request paid when init_db() ran from before_request: the original
+    # setup steps, which are migrations 1-6.
+    conn = database.get_connection()
+    for version, _, step in database.MIGRATIONS:
+        if version <= 6:
+            step(conn)
+    conn.close()
+
+
+def bench_schema_setup(iterations=200):
+    _use_temp_database()
+    database.init_db()
+
+    return {
+        "per_request_ms_before": _ms_per_call(_legacy_schema_setup, iterations),
+        "worker_start_check_ms": _ms_per_call(database.init_db, iterations),
+    }
+
+
+def _ops_per_second(fn, iterations):
+    return 1000.0 / _ms_per_call(fn, iterations)
+
+
+def _unpooled_query(sql, params):
+    # Mirrors the previous models.py pattern: mkdir + connect + query + close per call.
+    db_file = Path(database.DB_PATH)
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_file))
+    conn.row_factory = sqlite3.Row
+    rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+    conn.close()
+    return rows
+
+
+def bench_connection_pool(iterations=2000):
+    _use_temp_database()
+    database.init_db()
+    user_id = models.create_user(
+        "Bench Patient", 52, "F", "Bengaluru", "cardiology", None, "Medium", "Basic", 3000
+    )
+    for idx in range(5):
+        models.add_medicine(user_id, f"Medicine {idx}", "10mg", "daily", 30)
+
+    def unpooled():
+        _unpooled_query("SELECT * FROM User WHERE id = ?", (user_id,))
+        _unpooled_query("SELECT * FROM Medicine WHERE user_id = ?", (user_id,))
+
+    def pooled():
+        models.get_user(user_id)
+        models.get_user_medicines(user_id)
+
+    def pooled_per_request():
+        pooled()
+        database.release_shared_connection()
+
+    return {
+        "unpooled_pairs_per_s": _ops_per_second(unpooled, iterations),
+        "pooled_pairs_per_s": _ops_per_second(pooled, iterations),
+        "pooled_with_request_release_per_s": _ops_per_second(pooled_per_request, iterations),
+    }
+
+
+def bench_overpass_hedging(queries=5):
+    failing = start_stub_server(OverpassStubHandler, latency_seconds=0.3, error_rate=1.0)
+    slow = start_stub_server(OverpassStubHandler, latency_seconds=1.5)
+    fast = start_stub_server(OverpassStubHandler, latency_seconds=0.1)
+    hospital_service._OVERPASS_ENDPOINTS = [
+        f"{server.url}/api/interpreter" for server in (failing, slow, fast)
+    ]
+    hospital_service._endpoint_stats.clear()
+    query = "[out:json];node(around:15000,12.97,77.59);out center tags;"
+
+    timings = []
+    for _ in range(queries):
+        started = time.perf_counter()
+        payload = hospital_service._run_overpass_query(query, hedge_delay_seconds=0.25)
+        timings.append((time.perf_counter() - started) * 1000.0)
+        assert payload["elements"], "hedged query returned no elements"
+
+    results = {
+        "first_query_ms": timings[0],
+        "warm_query_ms_avg": sum(timings[1:]) / max(1, len(timings) - 1),
+        "preferred_endpoint": hospital_service._ranked_endpoints()[0],
+    }
+    for server in (failing, slow, fast):
+        server.shutdown()
+    return results
+
+
+def bench_overpass_tile_cache(users=50):
+    _use_temp_database()
+    database.init_db()
+    stub = start_stub_server(OverpassStubHandler, latency_seconds=0.3)
+    hospital_service._OVERPASS_ENDPOINTS = [f"{stub.url}/api/interpreter"]
+    hospital_service._endpoint_stats.clear()
+    for key in hospital_service._tile_cache_stats:
+        hospital_service._tile_cache_stats[key] = 0
+
+    # Users scattered across roughly one neighbourhood (~2 km).
+    rng = random.Random(7)
+    points = [(12.97 + rng.uniform(-0.01, 0.01), 77.59 + rng.uniform(-0.01, 0.01)) for _ in range(users)]
+
+    timings = []
+    for lat, lon in points + points:
+        started = time.perf_counter()
+        hospital_service.fetch_nearest_hospitals_overpass(lat, lon)
+        timings.append((time.perf_counter() - started) * 1000.0)
+
+    results = {
+        "first_request_ms": timings[0],
+        "later_requests_ms_avg": sum(timings[1:]) / (len(timings) - 1),
+        "overpass_requests": stub.request_count,
+        "lookups": len(timings),
+    }
+    results.update(hospital_service.get_overpass_cache_stats())
+    stub.shutdown()
+    return results
+
+
+def _write_synthetic_geonames(path, places):
+    rng = random.Random(11)
+    syllables = ["ban", "gal", "pur", "nag", "ko", "ram", "del", "hi", "mum", "bai", "che", "nai", "ha", "bad"]
+    names = []
+    with open(path, "w", encoding="utf-8") as handle:
+        for index in range(places):
+            name = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).title()
+            name = f"{name} {index}"
+            names.append(name)
+            row = [""] * 19
+            row[0] = str(100000 + index)
+            row[1] = name
+            row[2] = name
+            row[3] = f"{name} Town,{name}pet"
+            row[4] = f"{rng.uniform(8.0, 30.0):.5f}"
+            row[5] = f"{rng.uniform(70.0, 90.0):.5f}"
+            row[6] = "P"
+            row[8] = "IN"
+            row[14] = str(rng.randint(500, 5000000))
+            handle.write("\t".join(row) + "\n")
+    return names
+
+
+def bench_geocode(lookups=200, places=20000):
+    _use_temp_database()
+    database.init_db()
+    tsv_path = database.DB_PATH + ".geonames.tsv"
+    names = _write_synthetic_geonames(tsv_path, places)
+
+    started = time.perf_counter()
+    gazetteer.import_geonames(tsv_path)
+    import_seconds = time.perf_counter() - started
+    os.remove(tsv_path)
+
+    # Nominatim's public policy allows 1 req/s; a fast stub still pays a round trip.
+    stub = start_stub_server(NominatimStubHandler, latency_seconds=0.05)
+    geolocation_service.NOMINATIM_URL = f"{stub.url}/search"
+
+    rng = random.Random(3)
+    sample = [rng.choice(names) for _ in range(lookups)]
+    typos = [name[:-3] + name[-2:] for name in sample]
+
+    def per_second(fn, queries):
+        # Distinct cold lookups: the shared cache is bypassed on purpose.
+        begin = time.perf_counter()
+        for query in queries:
+            fn(query)
+        return len(queries) / (time.perf_counter() - begin)
+
+    nominatim_sample = sample[: max(1, lookups // 10)]
+    results = {
+        "import_seconds": import_seconds,
+        "nominatim_stub_lookups_per_s": per_second(geolocation_service._geocode_nominatim, nominatim_sample),
+        "gazetteer_exact_lookups_per_s": per_second(gazetteer.geocode, sample),
+        "gazetteer_prefix_lookups_per_s": per_second(gazetteer.geocode, [name.split()[0] for name in sample]),
+        "gazetteer_fuzzy_lookups_per_s": per_second(gazetteer.geocode, typos),
+        "gazetteer_fuzzy_resolved": sum(1 for query in typos if gazetteer.geocode(query)),
+    }
+
+    for name in sample:
+        geolocation_service.geocode_location(name)
+    results["cached_lookups_per_s"] = per_second(geolocation_service.geocode_location, sample)
+    results["nominatim_requests"] = stub.request_count
+    cache_store.clear(geolocation_service.GEOCODE_CACHE_NAMESPACE)
+    stub.shutdown()
+    return results
+
+
+def bench_hospital_index(hospitals=20000, queries=500):
+    _use_temp_database()
+    database.init_db()
+
+    # Hospitals clustered around 40 city centres, the way imported Overpass tiles land.
+    rng = random.Random(5)
+    centres = [(rng.uniform(8.0, 30.0), rng.uniform(70.0, 90.0)) for _ in range(40)]
+    rows = []
+    for index in range(hospitals):
+        centre_lat, centre_lon = rng.choice(centres)
+        rows.append(
+            (
+                f"node/{index}",
+                f"Bench Hospital {index}",
+                "Bench City",
+                centre_lat + rng.gauss(0, 0.15),
+                centre_lon + rng.gauss(0, 0.15),
+                1 if rng.random() < 0.4 else 0,
+            )
+        )
+    models.save_overpass_hospitals(rows)
+    points = [
+        (lat + rng.gauss(0, 0.1), lon + rng.gauss(0, 0.1))
+        for lat, lon in (rng.choice(centres) for _ in range(queries))
+    ]
+
+    def linear_scan(lat, lon):
+        # Read every emergency row and sort it, as the emergency recommender used to.
+        candidates = [row for row in models.list_emergency_hospitals() if row["latitude"] is not None]
+        candidates.sort(
+            key=lambda row: geolocation_service.haversine_distance_km(
+                lat, lon, row["latitude"], row["longitude"]
+            )
+        )
+        return candidates[:5]
+
+    def ms_per_query(fn):
+        started = time.perf_counter()
+        for lat, lon in points:
+            fn(lat, lon)
+        return (time.perf_counter() - started) * 1000.0 / len(points)
+
+    started = time.perf_counter()
+    hospital_index.refresh_hospital_index()
+    hospital_index.nearest_hospitals(0.0, 0.0, k=1)
+    build_ms = (time.perf_counter() - started) * 1000.0
+
+    return {
+        "index_build_ms": build_ms,
+        "linear_scan_knn_ms": ms_per_query(linear_scan),
+        "index_knn_ms": ms_per_query(
+            lambda lat, lon: hospital_index.nearest_hospitals(lat, lon, k=5, emergency_capable=True)
+        ),
+        "index_radius_5km_ms": ms_per_query(
+            lambda lat, lon: hospital_index.hospitals_within(lat, lon, 5.0, emergency_capable=True)
+        ),
+    }
+
+
+def _synthetic_candidates(count, rng):
+    specializations = ["cardiology", "neurology", "general", "oncology", "orthopedics"]
+    hospitals = []
+    coords_by_id = {}
+    for index in range(count):
+        hospital_id = index + 1
+        hospitals.append(
+            {
+                "id": hospital_id,
+                "name": f"Bench Hospital {index}",
+                "location": "Bench City",
+                "specialization": rng.choice(specializations),
+                "rating": round(rng.uniform(3.0, 5.0), 1),
+                "avg_cost": 3000,
+                "emergency_capable": rng.randint(0, 1),
+                "source": "overpass",
+            }
+        )
+        coords_by_id[hospital_id] = (12.97 + rng.gauss(0, 0.4), 77.59 + rng.gauss(0, 0.4))
+    return hospitals, coords_by_id
+
+
+def bench_hospital_scoring(sizes=(100, 10000, 1000000), top_k=25, per_row_max=100000):
+    rng = random.Random(9)
+    user = {"condition": "cardiology"}
+    user_lat, user_lon = 12.97, 77.59
+    results = {"numpy_available": scoring_engine.np is not None}
+
+    for count in sizes:
+        hospitals, coords_by_id = _synthetic_candidates(count, rng)
+
+        def timed(fn):
+            # Best of three, except at sizes where one run already takes seconds.
+            timings = []
+            for _ in range(3 if count <= 10000 else 1):
+                started = time.perf_counter()
+                fn()
+                timings.append((time.perf_counter() - started) * 1000.0)
+            return min(timings)
+
+        def per_row():
+            # One calculate_hospital_score call and result dict per candidate, then a full sort.
+            ranked = [
+                scoring_engine.calculate_hospital_score(
+                    user, hospital, [], user_lat, user_lon, *coords_by_id[hospital["id"]]
+                )
+                for hospital in hospitals
+            ]
+            ranked.sort(key=lambda item: item["score"], reverse=True)
+            return ranked[:top_k]
+
+        def batch():
+            return scoring_engine.rank_hospitals_with_location(
+                user, hospitals, {}, user_lat, user_lon, coords_by_id, top_k=top_k
+            )
+
+        def pure_python_batch():
+            numpy_module = scoring_engine.np
+            scoring_engine.np = None
+            try:
+                return batch()
+            finally:
+                scoring_engine.np = numpy_module
+
+        # Skipped at the largest size: a million full result dicts do not fit comfortably in memory.
+        if count <= per_row_max:
+            results[f"per_row_{count}_ms"] = timed(per_row)
+            assert batch() == per_row(), "batch ranking differs from per-row scoring"
+        results[f"python_top{top_k}_{count}_ms"] = timed(pure_python_batch)
+        if scoring_engine.np is not None:
+            results[f"numpy_top{top_k}_{count}_ms"] = timed(batch)
+    return results
+
+
+def bench_emergency_routing(hospitals=5000, patients=300):
+    _use_temp_database()
+    database.init_db()
+
+    # One dense metro area with mixed ratings and ambulance cover.
+    rng = random.Random(3)
+    models.save_overpass_hospitals(
+        [
+            (
+                f"node/{index}",
+                f"Bench Hospital {index}",
+                "Bench City",
+                12.9 + rng.gauss(0, 0.25),
+                77.6 + rng.gauss(0, 0.25),
+                1 if rng.random() < 0.6 else 0,
+            )
+            for index in range(hospitals)
+        ]
+    )
+    with database.transaction() as conn:
+        conn.executemany(
+            "UPDATE Hospital SET rating = ?, ambulance_available = ? WHERE id = ?",
+            [
+                (round(rng.uniform(2.0, 5.0), 1), rng.randint(0, 1), row[0])
+                for row in conn.execute("SELECT id FROM Hospital").fetchall()
+            ],
+        )
+    points = [(12.9 + rng.gauss(0, 0.5), 77.6 + rng.gauss(0, 0.5)) for _ in range(patients)]
+
+    def score_every_row():
+        for lat, lon in points:
+            emergency_engine.recommend_emergency_hospital(lat, lon)
+
+    def precomputed_tiles():
+        for lat, lon in points:
+            emergency_routing.recommend_emergency_route(lat, lon)
+
+    hospital_index.refresh_hospital_index()
+    started = time.perf_counter()
+    tiles = emergency_routing.warm_emergency_routes(points)
+    warm_ms = (time.perf_counter() - started) * 1000.0
+    tile_sizes = [len(tile[0]) for tile in emergency_routing._routes["tiles"].values()]
+
+    return {
+        "tiles": tiles,
+        "max_candidates_per_tile": max(tile_sizes),
+        "warm_ms": warm_ms,
+        "score_every_row_ms": _ms_per_call(score_every_row, 1) / len(points),
+        "precomputed_tile_ms": _ms_per_call(precomputed_tiles, 5) / len(points),
+    }
+
+
+def bench_llm_flows(
+    patients=20,
+    dashboard_renders=20,
+    latency_seconds=0.05,
+    latency_sigma=0.5,
+    error_rate=0.05,
+    drain_threads=4,
+):
+    """
+    Assessment submissions, the LLM jobs they queue and doctor dashboard renders, with
+    every LLM call answered by the seeded stand-in backend, so runs are offline and
+    repeatable.
+    """
+    _use_temp_database()
+    database.init_db()
+    llm_gateway.register_llm_backend(
+        "bench",
+        StubLLMBackend(latency_seconds, latency_sigma, error_rate, seed=42),
+    )
+    llm_gateway.use_llm_backend("bench")
+
+    # Imported here so app start-up (schema, cache warm-up) runs against the benchmark
+    # database; background work is kept off so the drain below is measured alone.
+    os.environ["START_BACKGROUND_WORK"] = "0"
+    import app as carematch_app
+    from adaptive_question_engine import update_patient_state
+
+    created_at = "2024-01-01T00:00:00"
+    doctor_id = models.create_doctor_account(
+        "Bench Doctor", "bench@example.com", None, "cardiology", "Bench Hospital", created_at
+    )
+    patient_ids = []
+    for index in range(patients):
+        user_id = models.create_user(
+            f"Bench Patient {index}", 40 + index % 30, "F", "Bengaluru", "cardiology",
+            None, "Medium", "Basic", 3000,
+        )
+        for medicine in range(3):
+            models.add_medicine(user_id, f"Medicine {medicine}", "10mg", "daily", 30)
+        link_id = models.connect_patient_to_doctor(doctor_id, user_id, created_at)
+        models.approve_doctor_patient_link(link_id, doctor_id)
+        patient_ids.append(user_id)
+
+    question_context = {
+        "a1": {"category": "stress", "weight": 6, "question_text": "Bench stress question"},
+        "a2": {"category": "energy", "weight": 6, "question_text": "Bench energy question"},
+    }
+    rng = random.Random(5)
+
+    def submit_assessments():
+        for user_id in patient_ids:
+            answers = {"a1": rng.randint(0, 4), "a2": rng.randint(0, 4)}
+            update_patient_state(user_id, answers, question_context)
+
+    submit_ms = _ms_per_call(submit_assessments, 1) / patients
+
+    drain_started = time.perf_counter()
+    workers = [
+        threading.Thread(target=jobs.run_worker, kwargs={"exit_when_idle": True})
+        for _ in range(drain_threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    drain_seconds = time.perf_counter() - drain_started
+    job_counts = database.get_shared_connection().execute(
+        "SELECT status, COUNT(*) AS count FROM Job GROUP BY status"
+    ).fetchall()
+
+    client = carematch_app.app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session["role"] = "doctor"
+        flask_session["doctor_id"] = doctor_id
+
+    def render_dashboard():
+        response = client.get("/doctor/dashboard")
+        assert response.status_code == 200, response.status_code
+
+    dashboard_ms = _ms_per_call(render_dashboard, dashboard_renders)
+
+    llm_calls = sum(site["calls"] for site in llm_gateway.llm_metrics()["call_sites"].values())
+    return {
+        "submit_ms_per_assessment": submit_ms,
+        "job_drain_seconds": drain_seconds,
+        "jobs_per_s": sum(row["count"] for row in job_counts) / drain_seconds,
+        "jobs_by_status": {row["status"]: row["count"] for row in job_counts},
+        "llm_calls": llm_calls,
+        "dashboard_ms_per_render": dashboard_ms,
+        "dashboard_renders_per_s": 1000.0 / dashboard_ms,
+    }
+
+
+def _count_queries(fn):
+    statements = []
+    database.add_statement_listener(statements.append)
+    try:
+        fn()
+    finally:
+        database.remove_statement_listener(statements.append)
+    return len(statements)
+
+
+def bench_patient_dashboard(logs=365, answers=200, iterations=200):
+    _use_temp_database()
+    database.init_db()
+    # See bench_llm_flows: app start-up must run against the benchmark database.
+    os.environ["START_BACKGROUND_WORK"] = "0"
+    import app as carematch_app
+    from adaptive_question_engine import get_patient_state
+    from carebridge_engine import patient_risk_from_data
+    from health_summary_engine import get_patient_summary
+
+    user_id = models.create_user(
+        "Bench Patient", 52, "F", "Bengaluru", "cardiology", None, "Medium", "Basic", 3000,
+        latitude=12.97, longitude=77.59,
+    )
+    for idx in range(5):
+        models.add_medicine(user_id, f"Medicine {idx}", "10mg", "daily", 30)
+    for day in range(logs):
+        models.create_health_log(user_id, 7, 4, 6, "", f"2024-{1 + day // 28 % 12:02d}-{1 + day % 28:02d}")
+    doctor_id = models.create_doctor_account(
+        "Bench Doctor", "bench@example.com", None, "cardiology", "Bench Hospital", "2024-01-01T00:00:00"
+    )
+    questionnaire_id = models.create_questionnaire(doctor_id, "Bench", "2024-01-01T00:00:00")
+    models.add_question(questionnaire_id, "How are you?")
+    question_id = models.get_questions_for_questionnaire(questionnaire_id)[0]["id"]
+    for idx in range(answers):
+        models.save_answer(question_id, user_id, str(idx), f"2024-01-01T00:00:{idx % 60:02d}")
+    user = models.get_user(user_id)
+    # Both variants read the recommendation from a warm ranking cache; before the ranking
+    # cache the dashboard also waited on Overpass for every render.
+    stub = start_stub_server(OverpassStubHandler)
+    hospital_service._OVERPASS_ENDPOINTS = [f"{stub.url}/api/interpreter"]
+    carematch_app._cached_rank_for_user(user)
+    stub.shutdown()
+    # Likewise a stored clinical summary, produced through the scripted LLM stand-in.
+    llm_gateway.use_llm_backend("stub")
+    get_patient_state(user_id)
+    get_patient_summary(user_id)
+    jobs.run_worker(exit_when_idle=True)
+
+    def separate_reads():
+        # What patient_dashboard called before the aggregated loader.
+        models.get_user(user_id)
+        adherence_tracker.calculate_adherence_score(user_id)
+        models.get_user_medicines(user_id)
+        models.get_patient_prescriptions(user_id)
+        models.get_health_logs(user_id)
+        models.get_latest_health_log(user_id)
+        carematch_app._cached_rank_for_user(user)
+        state = get_patient_state(user_id)
+        get_patient_summary(user_id)
+        if not state.get("risk_level"):
+            # calculate_patient_risk as it was: every Answer row was read to count them.
+            patient_risk_from_data(
+                adherence_tracker.calculate_adherence_score(user_id),
+                models.get_latest_health_log(user_id),
+                len(models.get_answers_for_user(user_id)),
+            )
+
+    def aggregated_loader():
+        carematch_app._load_patient_dashboard_view(models.get_user(user_id))
+
+    separate_reads()
+    aggregated_loader()
+    results = {
+        "queries_per_render_before": _count_queries(separate_reads),
+        "queries_per_render_after": _count_queries(aggregated_loader),
+        "data_ms_before": _ms_per_call(separate_reads, iterations),
+        "data_ms_after": _ms_per_call(aggregated_loader, iterations),
+    }
+
+    # A patient whose location cannot be geocoded, with no LLM key: neither a ranking nor
+    # a summary can be produced. After the first view's jobs have run, later views only
+    # read their recorded outcomes.
+    unresolved_id = models.create_user(
+        "Unresolved Patient", 40, "M", "Nowhere Benchmark Town", "cardiology", None, "Medium", "Basic", 3000
+    )
+    geolocation_service.NOMINATIM_URL = "http://127.0.0.1:9/search"
+    llm_gateway.use_llm_backend("gemini")
+    os.environ.pop("GEMINI_API_KEY", None)
+    get_patient_state(unresolved_id)
+
+    def unresolved_loader():
+        carematch_app._load_patient_dashboard_view(models.get_user(unresolved_id))
+
+    unresolved_loader()
+    jobs.run_worker(exit_when_idle=True)
+    unresolved_loader()
+    statements = []
+    database.add_statement_listener(statements.append)
+    try:
+        unresolved_loader()
+    finally:
+        database.remove_statement_listener(statements.append)
+    results["queries_per_unresolved_render"] = len(statements)
+    results["writes_per_unresolved_render"] = sum(
+        1 for sql in statements if not sql.lstrip().upper().startswith("SELECT")
+    )
+    return results
+
+
+BENCHMARKS = {
+    "connection_pool": bench_connection_pool,
+    "emergency_routing": bench_emergency_routing,
+    "geocode": bench_geocode,
+    "hospital_index": bench_hospital_index,
+    "hospital_scoring": bench_hospital_scoring,
+    "llm_flows": bench_llm_flows,
+    "overpass_hedging": bench_overpass_hedging,
+    "overpass_tile_cache": bench_overpass_tile_cache,
+    "patient_dashboard": bench_patient_dashboard,
+    "schema_setup": bench_schema_setup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run CareMatch micro-benchmarks.")
+    parser.add_argument("names", nargs="*", help=f"any of: {', '.join(sorted(BENCHMARKS))}")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    for name in args.names or sorted(BENCHMARKS):
+        results = BENCHMARKS[name]()
+        print(name)
+        for key, value in results.items():
+            if isinstance(value, float):
+                print(f"  {key}: {value:.3f}")
+            else:
+                print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Shared two-tier cache: a bounded in-process LRU per namespace in front of the
+CacheEntry table, so every worker sees the same entries and they survive deploys.
+
+Values must be JSON-serializable. None is a valid cached value (negative caching),
+which is why lookup() returns a (hit, value) pair.
+
+Every CACHE_TRIM_EVERY stores to a namespace, the process trims that namespace in the
+shared table back to its most recently written entries (CACHE_MAX_ENTRIES unless
+limit_namespace() set a bound); purge_expired() drops expired rows of every namespace.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from models import (
+    delete_cache_namespace,
+    delete_expired_cache_entries,
+    get_cache_entry,
+    list_cache_entries,
+    save_cache_entry,
+    trim_cache_namespace,
+)
+
+CACHE_MEMORY_ENTRIES = int(os.environ.get("CACHE_MEMORY_ENTRIES", "2048"))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "20000"))
+CACHE_TRIM_EVERY = int(os.environ.get("CACHE_TRIM_EVERY", "100"))
+
+# {namespace: OrderedDict({key: (expires_at, value)})}, least recently used first.
+_memory = {}
+_memory_lock = threading.Lock()
+
+# {namespace: max entries} for namespaces bounded other than by CACHE_MAX_ENTRIES.
+_namespace_limits = {}
+# {namespace: stores since the namespace was last trimmed in this process}
+_stores_since_trim = {}
+
+
+def _remember(namespace, key, expires_at, value):
+    with _memory_lock:
+        entries = _memory.setdefault(namespace, OrderedDict())
+        entries[key] = (expires_at, value)
+        entries.move_to_end(key)
+        while len(entries) > CACHE_MEMORY_ENTRIES:
+            entries.popitem(last=False)
+
+
+def lookup(namespace, key):
+    now = time.time()
+    with _memory_lock:
+        entries = _memory.get(namespace)
+        entry = entries.get(key) if entries is not None else None
+        if entry is not None:
+            if entry[0] > now:
+                entries.move_to_end(key)
+                return True, entry[1]
+            del entries[key]
+
+    row = get_cache_entry(namespace, key)
+    if not row or row["expires_at"] <= now:
+        return False, None
+
+    value = json.loads(row["value"])
+    _remember(namespace, key, row["expires_at"], value)
+    return True, value
+
+
+def store(namespace, key, value, ttl_seconds):
+    now = time.time()
+    expires_at = now + ttl_seconds
+    save_cache_entry(namespace, key, json.dumps(value), expires_at, now)
+    _remember(namespace, key, expires_at, value)
+
+    with _memory_lock:
+        stores = _stores_since_trim.get(namespace, 0) + 1
+        due = stores >= CACHE_TRIM_EVERY
+        _stores_since_trim[namespace] = 0 if due else stores
+    if due:
+        trim(namespace, _namespace_limits.get(namespace, CACHE_MAX_ENTRIES))
+
+
+def limit_namespace(namespace, max_entries):
+    """Bound a namespace to max_entries instead of CACHE_MAX_ENTRIES."""
+    _namespace_limits[namespace] = max_entries
+
+
+def clear(namespace):
+    """Drop every entry of a namespace, in this process and in the shared table."""
+    with _memory_lock:
+        _memory.pop(namespace, None)
+    return delete_cache_namespace(namespace)
+
+
+def trim(namespace, max_entries):
+    """
+    Keep only the max_entries most recently written entries of a namespace in the shared
+    table. Returns the number of entries evicted.
+    """
+    evicted = trim_cache_namespace(namespace, max_entries)
+    if evicted:
+        with _memory_lock:
+            _memory.pop(namespace, None)
+    return evicted
+
+
+def purge_expired():
+    """Delete expired entries of every namespace from the shared table. Returns the count."""
+    return delete_expired_cache_entries(time.time())
+
+
+def warm(namespaces, limit=CACHE_MEMORY_ENTRIES):
+    """
+    Drop expired rows, then preload the most recently written live entries of each
+    namespace into memory. Returns the number of entries loaded.
+    """
+    now = time.time()
+    delete_expired_cache_entries(now)
+
+    loaded = 0
+    for namespace in namespaces:
+        rows = list_cache_entries(namespace, now, limit)
+        # Oldest first so the newest entries end up most recently used.
+        for row in reversed(rows):
+            _remember(namespace, row["cache_key"], row["expires_at"], json.loads(row["value"]))
+            loaded += 1
+    return loaded
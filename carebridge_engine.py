@@ -1,10 +1,9 @@
 from adherence_tracker import calculate_adherence_score
 from health_monitor import compute_health_stability
-from models import get_answers_for_user, get_latest_health_log
+from models import count_answers_for_user, get_latest_health_log
 
 
-def _calculate_health_percentage(user_id, adherence_ratio):
-    latest_log = get_latest_health_log(user_id)
+def _calculate_health_percentage(latest_log, adherence_ratio):
     if not latest_log:
         return 0.0
 
@@ -22,14 +21,23 @@ def calculate_patient_risk(user_id):
     Fetch adherence score, health score, and questionnaire answers,
     then return LOW / MODERATE / HIGH risk level.
     """
-    adherence = calculate_adherence_score(user_id)
+    return patient_risk_from_data(
+        calculate_adherence_score(user_id),
+        get_latest_health_log(user_id),
+        # Answers are counted for remote monitoring context and audit trail.
+        count_answers_for_user(user_id),
+    )
+
+
+def patient_risk_from_data(adherence, latest_log, answer_count):
+    """
+    calculate_patient_risk from already loaded data: an adherence summary, the newest
+    HealthLog row (or None) and the patient's questionnaire answer count.
+    """
     adherence_percentage = float(adherence["percentage"])
     adherence_ratio = float(adherence["ratio"])
 
-    health_percentage = _calculate_health_percentage(user_id, adherence_ratio)
-
-    # Answers are fetched for remote monitoring context and audit trail.
-    answers = get_answers_for_user(user_id)
+    health_percentage = _calculate_health_percentage(latest_log, adherence_ratio)
 
     if health_percentage > 80 and adherence_percentage > 80:
         risk = "LOW"
@@ -42,7 +50,7 @@ def calculate_patient_risk(user_id):
         "risk": risk,
         "adherence_score": round(adherence_percentage, 2),
         "health_score": round(health_percentage, 2),
-        "answer_count": len(answers),
+        "answer_count": answer_count,
     }
 
 
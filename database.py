@@ -1,19 +1,119 @@
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 DEFAULT_DB_PATH = "carematch.db" if os.name == "nt" else "/tmp/carematch.db"
 DB_PATH = os.environ.get("DB_PATH", DEFAULT_DB_PATH)
 
+# Idle connections kept for reuse; threads beyond this open (and later close) their own.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "8192"))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+
+_idle_connections = []
+_pool_lock = threading.Lock()
+_scope = threading.local()
+
+# Called with the text of every statement run on a connection from this module.
+_statement_listeners = []
+
+
+def add_statement_listener(listener):
+    _statement_listeners.append(listener)
+
+
+def remove_statement_listener(listener):
+    _statement_listeners.remove(listener)
+
+
+def _notify_statement(sql):
+    for listener in _statement_listeners:
+        listener(sql)
+
+
+def _configure_connection(conn):
+    conn.row_factory = sqlite3.Row
+    conn.set_trace_callback(_notify_statement)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    return conn
+
 
 def get_connection():
     db_file = Path(DB_PATH)
     db_file.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(db_file))
-    conn.row_factory = sqlite3.Row
+    # Pooled connections move between threads, but only one thread uses a connection at a time.
+    conn = sqlite3.connect(str(db_file), check_same_thread=False)
+    return _configure_connection(conn)
+
+
+def _acquire_pooled_connection():
+    with _pool_lock:
+        if _idle_connections:
+            return _idle_connections.pop()
+    return get_connection()
+
+
+def _return_pooled_connection(conn):
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_SIZE:
+            _idle_connections.append(conn)
+            return
+    conn.close()
+
+
+def get_shared_connection():
+    """
+    Return the connection shared by every models call in the current request or thread.
+    Callers must not close it; release_shared_connection() hands it back to the pool.
+    """
+    conn = getattr(_scope, "connection", None)
+    if conn is None:
+        conn = _acquire_pooled_connection()
+        _scope.connection = conn
     return conn
 
 
+def release_shared_connection():
+    conn = getattr(_scope, "connection", None)
+    if conn is None:
+        return
+    _scope.connection = None
+    _return_pooled_connection(conn)
+
+
+@contextmanager
+def transaction():
+    """
+    Run the enclosed statements on the shared connection as one atomic write.
+    Statements inside the block must not commit on their own.
+    """
+    conn = get_shared_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def close_idle_connections():
+    with _pool_lock:
+        idle = list(_idle_connections)
+        _idle_connections.clear()
+    for conn in idle:
+        conn.close()
+
+
 def create_tables(conn):
     cursor = conn.cursor()
 
@@ -257,8 +357,6 @@ def create_tables(conn):
         """
     )
 
-    conn.commit()
-
 
 def _add_column_if_missing(conn, table_name, column_name, column_ddl):
     cursor = conn.cursor()
@@ -305,8 +403,6 @@ def migrate_schema(conn):
     _add_column_if_missing(conn, "PatientState", "last_assessment_at", "TEXT")
     _add_column_if_missing(conn, "PatientState", "next_assessment_due", "TEXT")
 
-    conn.commit()
-
 
 def seed_hospitals_and_doctors(conn):
     cursor = conn.cursor()
@@ -431,8 +527,6 @@ def seed_hospitals_and_doctors(conn):
         ],
     )
 
-    conn.commit()
-
 
 def backfill_emergency_hospital_data(conn):
     cursor = conn.cursor()
@@ -447,7 +541,6 @@ def backfill_emergency_hospital_data(conn):
             )
         """
     )
-    conn.commit()
 
 
 def backfill_doctor_contact_data(conn):
@@ -458,7 +551,6 @@ def backfill_doctor_contact_data(conn):
         SET contact = COALESCE(contact, '+91-988000' || printf('%04d', id))
         """
     )
-    conn.commit()
 
 
 def seed_question_bank(conn):
@@ -490,15 +582,418 @@ def seed_question_bank(conn):
         """,
         seed_questions,
     )
-    conn.commit()
+
+
+INDEXES = [
+    ("idx_healthlog_user_date", "HealthLog (user_id, date, id)"),
+    ("idx_medicine_user", "Medicine (user_id)"),
+    ("idx_patientanswer_user_timestamp", "PatientAnswer (user_id, timestamp, id)"),
+    ("idx_assessmenthistory_user_timestamp", "AssessmentHistory (user_id, timestamp, id)"),
+    ("idx_doctorpatientlink_doctor_patient_status", "DoctorPatientLink (doctor_id, patient_id, status)"),
+    ("idx_doctorpatientlink_doctor_status_created", "DoctorPatientLink (doctor_id, status, created_at, id)"),
+    ("idx_doctorprescription_patient_created", "DoctorPrescription (patient_id, created_at, id)"),
+    ("idx_doctorprescription_doctor_patient", "DoctorPrescription (doctor_id, patient_id, created_at, id)"),
+    ("idx_answer_question_user", "Answer (question_id, user_id)"),
+    ("idx_answer_user_timestamp", "Answer (user_id, timestamp, id)"),
+    ("idx_question_questionnaire", "Question (questionnaire_id, id)"),
+    ("idx_questionnaire_doctor_created", "Questionnaire (doctor_id, created_at, id)"),
+    ("idx_familymember_user", "FamilyMember (user_id, id)"),
+    ("idx_patientdoctorlink_user_doctor", "PatientDoctorLink (user_id, doctor_id)"),
+    ("idx_patientdoctorlink_doctor", "PatientDoctorLink (doctor_id)"),
+    ("idx_doctor_hospital", "Doctor (hospital_id)"),
+    # Expression indexes must repeat the exact expressions used by the models.py queries.
+    ("idx_doctor_email_lower", "Doctor (LOWER(email), COALESCE(is_portal_doctor, 0))"),
+    ("idx_doctor_specialization_lower", "Doctor (LOWER(specialization))"),
+    ("idx_hospital_emergency_capable", "Hospital (COALESCE(emergency_capable, 0))"),
+    (
+        "idx_questionbank_condition_category",
+        "QuestionBank (LOWER(condition), LOWER(category), weight DESC, id)",
+    ),
+]
+
+
+def create_indexes(conn):
+    cursor = conn.cursor()
+    for index_name, definition in INDEXES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {definition}")
+
+
+def create_patient_summary_cache(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS PatientSummaryCache (
+            user_id INTEGER PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES User (id)
+        )
+        """
+    )
+
+
+def create_overpass_tile_cache(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS OverpassTileCache (
+            tile_key TEXT PRIMARY KEY,
+            elements TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        """
+    )
+
+
+def create_cache_entries(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS CacheEntry (
+            namespace TEXT NOT NULL,
+            cache_key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (namespace, cache_key)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_cacheentry_namespace_updated ON CacheEntry (namespace, updated_at)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cacheentry_expires ON CacheEntry (expires_at)")
+
+
+def create_gazetteer(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS GazetteerPlace (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            country_code TEXT,
+            admin1 TEXT,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            population INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    # One row per normalized spelling (primary, ASCII and alternate names) of a place.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS GazetteerName (
+            id INTEGER PRIMARY KEY,
+            place_id INTEGER NOT NULL,
+            name TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS GazetteerTrigram (
+            trigram TEXT NOT NULL,
+            name_id INTEGER NOT NULL,
+            PRIMARY KEY (trigram, name_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_gazetteername_name ON GazetteerName (name, place_id)"
+    )
+
+
+def add_hospital_coordinates(conn):
+    _add_column_if_missing(conn, "Hospital", "latitude", "REAL")
+    _add_column_if_missing(conn, "Hospital", "longitude", "REAL")
+    # "node/123", "way/456": the OpenStreetMap element an imported row came from.
+    _add_column_if_missing(conn, "Hospital", "osm_ref", "TEXT")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_hospital_osm_ref ON Hospital (osm_ref) "
+        "WHERE osm_ref IS NOT NULL"
+    )
+
+    # Per-table change counters so every worker can tell when its in-memory copy is stale.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS DataVersion (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO DataVersion (name, version) VALUES ('Hospital', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_hospital_version_{event.lower()}
+            AFTER {event} ON Hospital
+            BEGIN
+                UPDATE DataVersion SET version = version + 1 WHERE name = 'Hospital';
+            END
+            """
+        )
+
+
+def add_user_coordinates(conn):
+    # Filled once when the patient's location is first geocoded.
+    _add_column_if_missing(conn, "User", "latitude", "REAL")
+    _add_column_if_missing(conn, "User", "longitude", "REAL")
+
+
+def create_jobs(conn):
+    # status: queued -> running -> done | failed; times are Unix seconds.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS Job (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            dedupe_key TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after REAL NOT NULL,
+            lease_owner TEXT,
+            leased_until REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_status_run_after ON Job (status, run_after, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_status_leased_until ON Job (status, leased_until)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_status_updated ON Job (status, updated_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_job_dedupe_status ON Job (dedupe_key, status, id)")
+
+
+def create_adaptive_question_sets(conn):
+    # due_key is PatientState.next_assessment_due when the set was made ('' before the
+    # first assessment), so a submission moves the patient on to a new set.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS AdaptiveQuestionSet (
+            user_id INTEGER NOT NULL,
+            due_key TEXT NOT NULL,
+            questions TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, due_key),
+            FOREIGN KEY (user_id) REFERENCES User (id)
+        )
+        """
+    )
+
+
+# SQL for the start of the rollup period holding a HealthLog date; weeks start on Monday.
+# Shared by the incremental update in models.create_health_log and the backfill below so
+# both always agree. Dates SQLite cannot parse yield NULL and are left out of rollups.
+HEALTH_LOG_ROLLUP_PERIODS = {
+    "day": "date({date})",
+    "week": "date({date}, 'weekday 0', '-6 days')",
+}
+
+
+def create_health_log_rollups(conn):
+    # Totals rather than means so each new log is a single additive upsert.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS HealthLogRollup (
+            user_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            period_start TEXT NOT NULL,
+            log_count INTEGER NOT NULL,
+            sleep_total REAL NOT NULL,
+            stress_total INTEGER NOT NULL,
+            energy_total INTEGER NOT NULL,
+            symptom_log_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, period, period_start),
+            FOREIGN KEY (user_id) REFERENCES User (id)
+        )
+        """
+    )
+    populate_health_log_rollups(conn)
+
+
+def populate_health_log_rollups(conn, user_id=None):
+    """
+    Recompute the rollups of one user (or everyone) from HealthLog. Runs inside the
+    caller's transaction.
+    """
+    if user_id is None:
+        user_filter, params = "", ()
+        conn.execute("DELETE FROM HealthLogRollup")
+    else:
+        user_filter, params = "AND user_id = ?", (user_id,)
+        conn.execute("DELETE FROM HealthLogRollup WHERE user_id = ?", params)
+    for period, expression in HEALTH_LOG_ROLLUP_PERIODS.items():
+        period_start = expression.format(date="date")
+        conn.execute(
+            f"""
+            INSERT INTO HealthLogRollup (
+                user_id,
+                period,
+                period_start,
+                log_count,
+                sleep_total,
+                stress_total,
+                energy_total,
+                symptom_log_count
+            )
+            SELECT
+                user_id,
+                '{period}',
+                {period_start},
+                COUNT(*),
+                SUM(sleep_hours),
+                SUM(stress_level),
+                SUM(energy_level),
+                SUM(CASE WHEN TRIM(COALESCE(symptoms, '')) != '' THEN 1 ELSE 0 END)
+            FROM HealthLog
+            WHERE {period_start} IS NOT NULL {user_filter}
+            GROUP BY user_id, {period_start}
+            """,
+            params,
+        )
+
+
+def allow_unrated_hospitals(conn):
+    """
+    Make Hospital.rating and avg_cost nullable and clear the placeholder 4.0 / 3000
+    that Overpass imports were given, so unrated rows are told apart from curated ones.
+    SQLite cannot drop NOT NULL in place, so the table is rebuilt from its own DDL.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Hospital'")
+    table_sql = cursor.fetchone()["sql"]
+    cursor.execute(
+        """
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = 'Hospital' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        """
+    )
+    dependent_sql = [row["sql"] for row in cursor.fetchall()]
+    columns = ", ".join(row["name"] for row in cursor.execute("PRAGMA table_info(Hospital)").fetchall())
+
+    rebuilt_sql = (
+        table_sql.replace("rating REAL NOT NULL", "rating REAL")
+        .replace("avg_cost REAL NOT NULL", "avg_cost REAL")
+        .replace("Hospital", "Hospital_rebuilt", 1)
+    )
+    cursor.execute(rebuilt_sql)
+    cursor.execute(f"INSERT INTO Hospital_rebuilt ({columns}) SELECT {columns} FROM Hospital")
+    cursor.execute("DROP TABLE Hospital")
+    cursor.execute("ALTER TABLE Hospital_rebuilt RENAME TO Hospital")
+    for sql in dependent_sql:
+        cursor.execute(sql)
+
+    cursor.execute("UPDATE Hospital SET rating = NULL, avg_cost = NULL WHERE osm_ref IS NOT NULL")
+
+
+def narrow_hospital_version_trigger(conn):
+    """
+    Count only Hospital updates that change what the hospital index and emergency
+    routing read. Specialization is written back in the background after every
+    Overpass classification and would otherwise invalidate both moments later.
+    """
+    columns = [
+        row["name"]
+        for row in conn.execute("PRAGMA table_info(Hospital)").fetchall()
+        if row["name"] != "specialization"
+    ]
+    conn.execute("DROP TRIGGER IF EXISTS trg_hospital_version_update")
+    conn.execute(
+        f"""
+        CREATE TRIGGER trg_hospital_version_update
+        AFTER UPDATE OF {", ".join(columns)} ON Hospital
+        BEGIN
+            UPDATE DataVersion SET version = version + 1 WHERE name = 'Hospital';
+        END
+        """
+    )
+
+
+MIGRATIONS = [
+    (1, "create base tables", create_tables),
+    (2, "add profile, emergency and portal columns", migrate_schema),
+    (3, "seed hospitals and doctors", seed_hospitals_and_doctors),
+    (4, "backfill emergency hospital data", backfill_emergency_hospital_data),
+    (5, "backfill doctor contact data", backfill_doctor_contact_data),
+    (6, "seed question bank", seed_question_bank),
+    (7, "add secondary indexes for hot lookups", create_indexes),
+    (8, "add patient summary cache", create_patient_summary_cache),
+    (9, "add Overpass tile cache", create_overpass_tile_cache),
+    (10, "add shared cache entries", create_cache_entries),
+    (11, "add offline gazetteer", create_gazetteer),
+    (12, "add hospital coordinates and change counter", add_hospital_coordinates),
+    (13, "add user coordinates", add_user_coordinates),
+    (14, "add background job queue", create_jobs),
+    (15, "add precomputed adaptive question sets", create_adaptive_question_sets),
+    (16, "add daily and weekly health log rollups", create_health_log_rollups),
+    (17, "allow unrated imported hospitals", allow_unrated_hospitals),
+    (18, "ignore specialization-only hospital updates in the change counter", narrow_hospital_version_trigger),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    )
+    if cursor.fetchone() is None:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+    return cursor.fetchone()["version"]
+
+
+def apply_migrations(conn):
+    """
+    Apply pending migrations in order inside one write transaction.
+    Returns the number of steps applied.
+    """
+    if get_schema_version(conn) >= LATEST_SCHEMA_VERSION:
+        return 0
+
+    # BEGIN IMMEDIATE serializes concurrent workers booting against the same file;
+    # the version is re-read once the write lock is held.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+            """
+        )
+        current_version = get_schema_version(conn)
+
+        applied = 0
+        for version, description, step in MIGRATIONS:
+            if version <= current_version:
+                continue
+            step(conn)
+            conn.execute(
+                """
+                INSERT INTO schema_version (version, description, applied_at)
+                VALUES (?, ?, datetime('now'))
+                """,
+                (version, description),
+            )
+            applied += 1
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return applied
 
 
 def init_db():
     conn = get_connection()
-    create_tables(conn)
-    migrate_schema(conn)
-    seed_hospitals_and_doctors(conn)
-    backfill_emergency_hospital_data(conn)
-    backfill_doctor_contact_data(conn)
-    seed_question_bank(conn)
+    applied = apply_migrations(conn)
     conn.close()
+    return applied
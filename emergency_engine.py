@@ -1,8 +1,39 @@
+from geolocation_service import distance_score_from_km, haversine_distance_km
 from models import list_emergency_hospitals
-from scoring_engine import _calculate_distance_score
+from scoring_engine import UNLOCATED_DISTANCE_SCORE, UNRATED_RATING_SCORE
 
 
-def recommend_emergency_hospital(user_location):
+def _emergency_score(hospital, distance_score):
+    emergency_capable_score = 1.0 if hospital["emergency_capable"] else 0.0
+    ambulance_available_score = 1.0 if hospital["ambulance_available"] else 0.0
+    if hospital["rating"] is None:
+        rating_score = UNRATED_RATING_SCORE
+    else:
+        rating_score = min(1.0, float(hospital["rating"]) / 5.0)
+
+    return (
+        0.40 * distance_score
+        + 0.30 * emergency_capable_score
+        + 0.20 * ambulance_available_score
+        + 0.10 * rating_score
+    )
+
+
+def emergency_score_range(hospital, min_distance_km, max_distance_km):
+    """
+    (lowest, highest) score the hospital can get from anywhere in that distance range.
+    None for both distances means no coordinates, which scores a neutral distance.
+    """
+    if min_distance_km is None and max_distance_km is None:
+        score = _emergency_score(hospital, UNLOCATED_DISTANCE_SCORE)
+        return score, score
+    return (
+        _emergency_score(hospital, distance_score_from_km(max_distance_km)),
+        _emergency_score(hospital, distance_score_from_km(min_distance_km)),
+    )
+
+
+def recommend_emergency_hospital(user_lat, user_lon, candidates=None):
     """
     Emergency scoring formula:
     score =
@@ -10,24 +41,24 @@ def recommend_emergency_hospital(user_location):
     0.30 emergency_capable +
     0.20 ambulance_available +
     0.10 rating
+
+    candidates defaults to every emergency-capable hospital. Hospitals without
+    coordinates, or a patient without them, get a neutral distance score; unrated
+    hospitals get a neutral rating score.
     """
-    hospitals = list_emergency_hospitals()
+    hospitals = list_emergency_hospitals() if candidates is None else candidates
     if not hospitals:
         return None
 
     ranked = []
     for hospital in hospitals:
-        distance_score = _calculate_distance_score(user_location, hospital["location"])
-        emergency_capable_score = 1.0 if hospital["emergency_capable"] else 0.0
-        ambulance_available_score = 1.0 if hospital["ambulance_available"] else 0.0
-        rating_score = min(1.0, float(hospital["rating"]) / 5.0)
-
-        score = (
-            0.40 * distance_score
-            + 0.30 * emergency_capable_score
-            + 0.20 * ambulance_available_score
-            + 0.10 * rating_score
-        )
+        distance_km = None
+        if None not in (user_lat, user_lon, hospital.get("latitude"), hospital.get("longitude")):
+            distance_km = haversine_distance_km(
+                user_lat, user_lon, hospital["latitude"], hospital["longitude"]
+            )
+        distance_score = distance_score_from_km(distance_km) if distance_km is not None else UNLOCATED_DISTANCE_SCORE
+        score = _emergency_score(hospital, distance_score)
 
         ranked.append(
             {
@@ -37,9 +68,17 @@ def recommend_emergency_hospital(user_location):
                 "rating": hospital["rating"],
                 "ambulance_number": hospital["ambulance_number"] or "Not Available",
                 "ambulance_available": bool(hospital["ambulance_available"]),
+                "distance_km": round(distance_km, 2) if distance_km is not None else None,
                 "score": round(score, 4),
             }
         )
 
-    ranked.sort(key=lambda h: h["score"], reverse=True)
+    # Equal scores go to the closer hospital.
+    ranked.sort(
+        key=lambda h: (
+            -h["score"],
+            h["distance_km"] if h["distance_km"] is not None else float("inf"),
+            h["hospital_id"],
+        )
+    )
     return ranked[0]
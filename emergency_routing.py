@@ -0,0 +1,233 @@
+"""
+Precomputed emergency candidates per map tile.
+
+For each EMERGENCY_TILE_DEGREES tile, the emergency-capable hospitals that can be the
+answer for any point inside it are looked up once from hospital_index and kept in
+memory, so an emergency request only scores that short list against the patient's own
+coordinates. A hospital is left out of a tile when, from every point of the tile, some
+other candidate is guaranteed to score strictly higher; far and unlocated hospitals are
+only ruled out that way too, never by distance alone. When the Hospital version moves,
+only the tiles a changed hospital could enter or leave are dropped, and the tiles of
+every located patient are filled when a worker starts.
+"""
+import math
+import os
+import threading
+
+from database import release_shared_connection
+from emergency_engine import emergency_score_range, recommend_emergency_hospital
+from geolocation_service import haversine_distance_km
+from hospital_index import hospitals_within, index_version
+from models import get_data_version, list_emergency_hospitals, list_user_coordinates
+
+EMERGENCY_TILE_DEGREES = float(os.environ.get("EMERGENCY_TILE_DEGREES", "0.05"))
+# Hospitals beyond this radius of every point of a tile are only read when one of them
+# could still outscore the nearby candidates.
+EMERGENCY_SEARCH_RADIUS_KM = float(os.environ.get("EMERGENCY_SEARCH_RADIUS_KM", "50"))
+
+# Fields of a hospital that emergency scoring or its result reads.
+_ROUTE_FIELDS = (
+    "name",
+    "location",
+    "latitude",
+    "longitude",
+    "emergency_capable",
+    "ambulance_available",
+    "ambulance_number",
+    "rating",
+)
+
+# tiles: {tile key: (candidates, score floor, centre lat, centre lon, half diagonal km)};
+# hospitals: {id: hospital} for every emergency-capable hospital at version.
+_routes = {"version": None, "tiles": {}, "hospitals": {}}
+_routes_lock = threading.Lock()
+
+
+def _tile_for(lat, lon):
+    size = EMERGENCY_TILE_DEGREES
+    lat_index = math.floor(float(lat) / size)
+    lon_index = math.floor(float(lon) / size)
+    centre_lat = (lat_index + 0.5) * size
+    centre_lon = (lon_index + 0.5) * size
+    half_diagonal_km = size * 111.32 * math.sqrt(2) / 2
+    return (lat_index, lon_index), centre_lat, centre_lon, half_diagonal_km
+
+
+def _outside_score_ceiling():
+    """
+    Highest score a hospital outside the search radius can reach: every flag set, a full
+    rating, and either the distance tier just past the radius or the neutral distance
+    of a hospital without coordinates.
+    """
+    best_hospital = {"emergency_capable": 1, "ambulance_available": 1, "rating": 5.0}
+    past_radius = emergency_score_range(best_hospital, EMERGENCY_SEARCH_RADIUS_KM, EMERGENCY_SEARCH_RADIUS_KM)
+    unlocated = emergency_score_range(best_hospital, None, None)
+    return max(past_radius[1], unlocated[1])
+
+
+def _all_emergency_hospitals(hospitals, centre_lat, centre_lon):
+    located = []
+    for hospital in hospitals:
+        distance_km = None
+        if hospital.get("latitude") is not None and hospital.get("longitude") is not None:
+            distance_km = haversine_distance_km(
+                centre_lat, centre_lon, hospital["latitude"], hospital["longitude"]
+            )
+        located.append(dict(hospital, distance_km=distance_km))
+    return located
+
+
+def _tile_candidates(hospitals, use_index, centre_lat, centre_lon, half_diagonal_km):
+    """
+    (candidates, score floor) for a tile. hospitals is the emergency-capable set the
+    tile is built from; the grid index only narrows it when use_index says the index
+    copy is at the same version.
+    """
+    if use_index:
+        nearby = hospitals_within(
+            centre_lat,
+            centre_lon,
+            EMERGENCY_SEARCH_RADIUS_KM + half_diagonal_km,
+            emergency_capable=True,
+        )
+        ranges = _score_ranges(nearby, half_diagonal_km)
+        # Nothing outside the radius (located or not) can reach the best nearby worst
+        # case, so the nearby set holds every possible winner; otherwise score everything.
+        if ranges and _score_floor(ranges) > _outside_score_ceiling():
+            return _prune_candidates(nearby, ranges)
+    candidates = _all_emergency_hospitals(hospitals, centre_lat, centre_lon)
+    return _prune_candidates(candidates, _score_ranges(candidates, half_diagonal_km))
+
+
+def _score_ranges(candidates, half_diagonal_km):
+    # distance_km from the index is rounded to metres; widen the range to cover it.
+    slack_km = half_diagonal_km + 0.001
+    ranges = []
+    for hospital in candidates:
+        if hospital["distance_km"] is None:
+            ranges.append(emergency_score_range(hospital, None, None))
+        else:
+            ranges.append(
+                emergency_score_range(
+                    hospital,
+                    max(0.0, hospital["distance_km"] - slack_km),
+                    hospital["distance_km"] + slack_km,
+                )
+            )
+    return ranges
+
+
+def _score_floor(ranges):
+    # Scores are rounded to 4 places before comparing, which moves each by at most 5e-5.
+    return max(low for low, _ in ranges) - 1e-4
+
+
+def _prune_candidates(candidates, ranges):
+    """
+    Drop hospitals that some other candidate outscores from every point of the tile.
+    Returns (candidates, floor); a hospital whose best score is below floor cannot win.
+    """
+    if not ranges:
+        return candidates, float("-inf")
+    floor = _score_floor(ranges)
+    return [hospital for hospital, (_, high) in zip(candidates, ranges) if high >= floor], floor
+
+
+def _tile_affected(tile, changed):
+    """Whether any changed hospital ({id: hospital, or None when gone}) can alter the tile."""
+    candidates, floor, centre_lat, centre_lon, half_diagonal_km = tile
+    candidate_ids = {hospital["id"] for hospital in candidates}
+    for hospital_id, hospital in changed.items():
+        if hospital_id in candidate_ids:
+            return True
+        if hospital is None:
+            continue
+        located = _all_emergency_hospitals([hospital], centre_lat, centre_lon)
+        if _score_ranges(located, half_diagonal_km)[0][1] >= floor:
+            return True
+    return False
+
+
+def _advance_routes(routes, version):
+    hospitals = {hospital["id"]: dict(hospital) for hospital in list_emergency_hospitals()}
+    previous = routes["hospitals"]
+    changed = {
+        hospital_id: hospitals.get(hospital_id)
+        for hospital_id in previous.keys() | hospitals.keys()
+        if hospital_id not in previous
+        or hospital_id not in hospitals
+        or any(previous[hospital_id].get(field) != hospitals[hospital_id].get(field) for field in _ROUTE_FIELDS)
+    }
+    tiles = {
+        key: tile
+        for key, tile in routes["tiles"].items()
+        if routes["version"] is not None and not _tile_affected(tile, changed)
+    }
+    return {"version": version, "tiles": tiles, "hospitals": hospitals}
+
+
+def emergency_candidates(lat, lon):
+    """Emergency-capable hospitals worth scoring for a patient at (lat, lon)."""
+    global _routes
+    version = get_data_version("Hospital")
+    key, centre_lat, centre_lon, half_diagonal_km = _tile_for(lat, lon)
+
+    routes = _routes
+    if routes["version"] == version and key in routes["tiles"]:
+        return routes["tiles"][key][0]
+
+    with _routes_lock:
+        if _routes["version"] != version:
+            _routes = _advance_routes(_routes, version)
+        routes = _routes
+
+    candidates, floor = _tile_candidates(
+        routes["hospitals"].values(),
+        index_version() == version,
+        centre_lat,
+        centre_lon,
+        half_diagonal_km,
+    )
+    with _routes_lock:
+        if _routes is routes:
+            routes["tiles"][key] = (candidates, floor, centre_lat, centre_lon, half_diagonal_km)
+    return candidates
+
+
+def recommend_emergency_route(user_lat, user_lon):
+    """
+    Best emergency hospital for a patient. With coordinates only the patient's tile is
+    scored; without them every emergency-capable hospital is, at a neutral distance.
+    """
+    if user_lat is not None and user_lon is not None:
+        candidates = emergency_candidates(user_lat, user_lon)
+        if candidates:
+            return recommend_emergency_hospital(user_lat, user_lon, candidates)
+    return recommend_emergency_hospital(None, None)
+
+
+def warm_emergency_routes(points=None):
+    """
+    Precompute the tiles for (lat, lon) points; by default every patient with stored
+    coordinates. Returns the number of distinct tiles.
+    """
+    if points is None:
+        points = [(row["latitude"], row["longitude"]) for row in list_user_coordinates()]
+    tiles = set()
+    for lat, lon in points:
+        tiles.add(_tile_for(lat, lon)[0])
+        emergency_candidates(lat, lon)
+    return len(tiles)
+
+
+def _warm_in_background():
+    try:
+        warm_emergency_routes()
+    except Exception:
+        pass
+    finally:
+        release_shared_connection()
+
+
+def start_emergency_route_warmup():
+    threading.Thread(target=_warm_in_background, daemon=True).start()
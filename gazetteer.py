@@ -0,0 +1,177 @@
+"""
+Offline place-name lookup backed by the Gazetteer* tables.
+
+Load a GeoNames-style dump (cities500.txt, IN.txt, ...) with
+    flask --app app import-gazetteer path/to/cities500.txt
+after which geocode_location resolves known cities and localities without a network call.
+"""
+import csv
+import os
+import sys
+import unicodedata
+
+from models import (
+    find_gazetteer_names_by_trigrams,
+    find_gazetteer_places,
+    find_gazetteer_places_by_prefix,
+    get_gazetteer_place,
+    replace_gazetteer,
+)
+
+GAZETTEER_MIN_PREFIX_LENGTH = int(os.environ.get("GAZETTEER_MIN_PREFIX_LENGTH", "4"))
+GAZETTEER_MIN_SIMILARITY = float(os.environ.get("GAZETTEER_MIN_SIMILARITY", "0.4"))
+
+# GeoNames "geoname" table columns used by the importer.
+_GEONAMES_ID = 0
+_GEONAMES_NAME = 1
+_GEONAMES_ASCII_NAME = 2
+_GEONAMES_ALTERNATE_NAMES = 3
+_GEONAMES_LATITUDE = 4
+_GEONAMES_LONGITUDE = 5
+_GEONAMES_FEATURE_CLASS = 6
+_GEONAMES_COUNTRY_CODE = 8
+_GEONAMES_ADMIN1 = 10
+_GEONAMES_POPULATION = 14
+
+
+def normalize_place_name(value):
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in folded).split())
+
+
+def place_trigrams(normalized_name):
+    padded = f"  {normalized_name} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def _best_trigram_match(normalized_name):
+    query_trigrams = place_trigrams(normalized_name)
+    best = None
+    for candidate in find_gazetteer_names_by_trigrams(sorted(query_trigrams)):
+        candidate_trigrams = place_trigrams(candidate["name"])
+        shared = len(query_trigrams & candidate_trigrams)
+        similarity = shared / len(query_trigrams | candidate_trigrams)
+        rank = (similarity, candidate["population"] or 0)
+        if similarity >= GAZETTEER_MIN_SIMILARITY and (best is None or rank > best[0]):
+            best = (rank, candidate["place_id"])
+    if best is None:
+        return None
+    return get_gazetteer_place(best[1])
+
+
+def _lookup_exact_or_prefix(normalized_name):
+    places = find_gazetteer_places(normalized_name, limit=1)
+    if places:
+        return places[0]
+    if len(normalized_name) >= GAZETTEER_MIN_PREFIX_LENGTH:
+        places = find_gazetteer_places_by_prefix(normalized_name, limit=1)
+        if places:
+            return places[0]
+    return None
+
+
+def lookup_place(location_name):
+    """
+    Resolve a free-text location to its most populous gazetteer match, or None.
+    Tries the whole string, then each comma-separated part from the most specific
+    ("Indiranagar, Bengaluru"), by exact name and name prefix; only when no part
+    matches that way is trigram similarity tried, in the same order.
+    """
+    candidates = []
+    for part in [location_name] + (location_name or "").split(","):
+        normalized = normalize_place_name(part)
+        if normalized and normalized not in candidates:
+            candidates.append(normalized)
+
+    for lookup in (_lookup_exact_or_prefix, _best_trigram_match):
+        for normalized in candidates:
+            place = lookup(normalized)
+            if place:
+                return place
+    return None
+
+
+def geocode(location_name):
+    place = lookup_place(location_name)
+    if not place:
+        return None
+    return (place["latitude"], place["longitude"])
+
+
+def _read_geonames(path, min_population, countries, feature_classes, include_alternate_names):
+    # sys.maxsize overflows the C long csv uses on Windows.
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    with open(path, encoding="utf-8", newline="") as handle:
+        for row in csv.reader(handle, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if len(row) <= _GEONAMES_POPULATION or row[0].startswith("#"):
+                continue
+            if feature_classes and row[_GEONAMES_FEATURE_CLASS] not in feature_classes:
+                continue
+            if countries and row[_GEONAMES_COUNTRY_CODE] not in countries:
+                continue
+            try:
+                population = int(row[_GEONAMES_POPULATION] or 0)
+                place = (
+                    int(row[_GEONAMES_ID]),
+                    row[_GEONAMES_NAME],
+                    row[_GEONAMES_COUNTRY_CODE],
+                    row[_GEONAMES_ADMIN1],
+                    float(row[_GEONAMES_LATITUDE]),
+                    float(row[_GEONAMES_LONGITUDE]),
+                    population,
+                )
+            except ValueError:
+                continue
+            if population < min_population:
+                continue
+
+            primary_names = [row[_GEONAMES_NAME], row[_GEONAMES_ASCII_NAME]]
+            alternate_names = []
+            if include_alternate_names and row[_GEONAMES_ALTERNATE_NAMES]:
+                alternate_names = row[_GEONAMES_ALTERNATE_NAMES].split(",")
+            yield place, primary_names, alternate_names
+
+
+def import_geonames(
+    path,
+    min_population=0,
+    countries=None,
+    feature_classes=("P",),
+    include_alternate_names=True,
+):
+    """
+    Replace the gazetteer with the places in a GeoNames-format TSV. By default only
+    populated places (feature class P) are kept. Alternate names are matched exactly
+    and by prefix; only primary names get trigrams, which keeps the fuzzy index small.
+    Returns (places, names).
+    """
+    countries = {code.upper() for code in countries} if countries else None
+    feature_classes = set(feature_classes or ())
+
+    places = []
+    names = []
+    trigram_name_ids = []
+    for place, primary_names, alternate_names in _read_geonames(
+        path, min_population, countries, feature_classes, include_alternate_names
+    ):
+        places.append(place)
+        seen = set()
+        for index, raw_name in enumerate(primary_names + alternate_names):
+            normalized = normalize_place_name(raw_name)
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            name_id = len(names) + 1
+            names.append((name_id, place[0], normalized))
+            if index < len(primary_names):
+                trigram_name_ids.append(name_id)
+
+    trigrams = (
+        (trigram, name_id)
+        for name_id in trigram_name_ids
+        for trigram in place_trigrams(names[name_id - 1][2])
+    )
+    replace_gazetteer(places, names, trigrams)
+    return len(places), len(names)
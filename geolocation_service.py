@@ -1,10 +1,19 @@
 import json
+import os
 from math import asin, cos, radians, sin, sqrt
 from urllib.parse import quote_plus
 from urllib.request import Request, urlopen
 
+import cache_store
+import gazetteer
 
-_geo_cache = {}
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+NOMINATIM_TIMEOUT_SECONDS = float(os.environ.get("NOMINATIM_TIMEOUT_SECONDS", "4"))
+
+GEOCODE_CACHE_NAMESPACE = "geocode"
+GEOCODE_TTL_SECONDS = float(os.environ.get("GEOCODE_TTL_SECONDS", str(90 * 86400)))
+# Failed lookups are retried sooner than successful ones are refreshed.
+GEOCODE_NEGATIVE_TTL_SECONDS = float(os.environ.get("GEOCODE_NEGATIVE_TTL_SECONDS", "3600"))
 
 
 _SPECIALTY_KEYWORDS = {
@@ -97,35 +106,51 @@ def _display_specialization(value):
     return normalized.replace("_", " ").title()
 
 
-def geocode_location(location_name):
-    key = (location_name or "").strip().lower()
-    if not key:
-        return None
-
-    if key in _geo_cache:
-        return _geo_cache[key]
-
-    url = (
-        "https://nominatim.openstreetmap.org/search?"
-        f"q={quote_plus(location_name)}&format=json&limit=1"
-    )
+def _geocode_nominatim(location_name):
+    url = f"{NOMINATIM_URL}?q={quote_plus(location_name)}&format=json&limit=1"
     request = Request(url, headers={"User-Agent": "CareMatchAI/1.0"})
 
     try:
-        with urlopen(request, timeout=4) as response:
+        with urlopen(request, timeout=NOMINATIM_TIMEOUT_SECONDS) as response:
             payload = json.loads(response.read().decode("utf-8"))
             if payload:
-                lat = float(payload[0]["lat"])
-                lon = float(payload[0]["lon"])
-                _geo_cache[key] = (lat, lon)
-                return _geo_cache[key]
+                return (float(payload[0]["lat"]), float(payload[0]["lon"]))
     except Exception:
         pass
-
-    _geo_cache[key] = None
     return None
 
 
+def geocode_location(location_name, allow_network=True):
+    """
+    Resolve a location to (lat, lon) from the cache, then the offline gazetteer,
+    and only then Nominatim. With allow_network=False a miss returns None without
+    calling Nominatim (and is not cached, so a later networked lookup still runs).
+    """
+    key = (location_name or "").strip().lower()
+    if not key:
+        return None
+
+    hit, cached = cache_store.lookup(GEOCODE_CACHE_NAMESPACE, key)
+    if hit:
+        return tuple(cached) if cached else None
+
+    try:
+        coords = gazetteer.geocode(location_name)
+    except Exception:
+        coords = None
+    if coords is None:
+        if not allow_network:
+            return None
+        coords = _geocode_nominatim(location_name)
+
+    if coords is None:
+        cache_store.store(GEOCODE_CACHE_NAMESPACE, key, None, GEOCODE_NEGATIVE_TTL_SECONDS)
+        return None
+
+    cache_store.store(GEOCODE_CACHE_NAMESPACE, key, list(coords), GEOCODE_TTL_SECONDS)
+    return coords
+
+
 def haversine_distance_km(lat1, lon1, lat2, lon2):
     r = 6371.0
     d_lat = radians(lat2 - lat1)
@@ -1,16 +1,42 @@
 import os
 
-from google import genai
-
-
-def _get_client():
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        return None
-    return genai.Client(api_key=api_key)
-
-
-def generate_health_summary(condition, stress_history, energy_history, adherence_history, trend):
+from llm_gateway import generate_text, llm_configured
+
+# 0 disables caching of summary responses for identical histories.
+HEALTH_SUMMARY_CACHE_TTL_SECONDS = float(
+    os.environ.get("HEALTH_SUMMARY_CACHE_TTL_SECONDS", "86400")
+)
+
+SUMMARY_UNAVAILABLE_NO_KEY = (
+    "Health summary unavailable: GEMINI_API_KEY is not configured. "
+    "Continue monitoring adherence, stress, and energy trends daily."
+)
+SUMMARY_UNAVAILABLE_EMPTY = (
+    "Clinical summary unavailable from AI response. Continue current monitoring and follow-up plan."
+)
+SUMMARY_UNAVAILABLE_ERROR = (
+    "Clinical summary temporarily unavailable. "
+    "Use current risk level, adherence score, and trend for immediate decisions."
+)
+
+_FALLBACK_SUMMARIES = frozenset(
+    [SUMMARY_UNAVAILABLE_NO_KEY, SUMMARY_UNAVAILABLE_EMPTY, SUMMARY_UNAVAILABLE_ERROR]
+)
+
+
+def is_fallback_summary(text):
+    """True when text is one of the placeholder messages rather than an AI summary."""
+    return text in _FALLBACK_SUMMARIES
+
+
+def generate_health_summary(
+    condition,
+    stress_history,
+    energy_history,
+    adherence_history,
+    trend,
+    timeout_seconds=None,
+):
     prompt = f"""
 You are a clinical health analysis AI.
 
@@ -39,18 +65,18 @@ Include:
 Limit to 4 sentences.
 """
 
-    client = _get_client()
-    if not client:
-        return "Health summary unavailable: GEMINI_API_KEY is not configured. Continue monitoring adherence, stress, and energy trends daily."
+    if not llm_configured():
+        return SUMMARY_UNAVAILABLE_NO_KEY
 
     try:
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=prompt,
+        text = generate_text(
+            "health_summary",
+            prompt,
+            timeout_seconds=timeout_seconds,
+            cache_ttl_seconds=HEALTH_SUMMARY_CACHE_TTL_SECONDS,
         )
-        text = (response.text or "").strip()
         if not text:
-            return "Clinical summary unavailable from AI response. Continue current monitoring and follow-up plan."
+            return SUMMARY_UNAVAILABLE_EMPTY
         return text
     except Exception:
-        return "Clinical summary temporarily unavailable. Use current risk level, adherence score, and trend for immediate decisions."
+        return SUMMARY_UNAVAILABLE_ERROR
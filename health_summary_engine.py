@@ -1,6 +1,38 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
 from adherence_tracker import calculate_adherence_score
-from health_summary_api import generate_health_summary
-from models import get_patient_state_row, get_recent_patient_answers, get_user
+from health_summary_api import (
+    SUMMARY_UNAVAILABLE_NO_KEY,
+    generate_health_summary,
+    is_fallback_summary,
+)
+from jobs import enqueue, enqueue_if_new, latest_job, register_job_handler
+from models import (
+    get_cached_patient_summary,
+    get_patient_state_row,
+    get_recent_patient_answers,
+    get_user,
+    save_cached_patient_summary,
+)
+
+SUMMARY_CALL_TIMEOUT_SECONDS = float(os.environ.get("SUMMARY_CALL_TIMEOUT_SECONDS", "8"))
+SUMMARY_LRU_SIZE = int(os.environ.get("SUMMARY_LRU_SIZE", "512"))
+
+PATIENT_SUMMARY_JOB = "patient_summary"
+
+SUMMARY_PENDING_MESSAGE = (
+    "Summary is taking longer than expected. Refresh the page to load the latest clinical summary."
+)
+
+# In-process tier in front of PatientSummaryCache: {user_id: (fingerprint, summary)}.
+# Entries are only served when the fingerprint still matches, so inputs changed by other
+# workers can never surface a stale summary here.
+_summary_lru = OrderedDict()
+_summary_lru_lock = threading.Lock()
 
 
 def _format_answer_history(rows, category):
@@ -12,28 +44,144 @@ def _format_answer_history(rows, category):
     return ", ".join(values)
 
 
-def _build_adherence_history(user_id):
-    adherence = calculate_adherence_score(user_id)
+def _build_adherence_history(adherence):
     return f"Current adherence: {adherence['percentage']}% ({adherence['taken']}/{adherence['total']} doses)"
 
 
-def generate_patient_summary(user_id):
+def _summary_fingerprint(user, state, recent_answers, adherence):
+    parts = [
+        str(user["condition"]),
+        str(state["last_updated"]) if state else "",
+        ",".join(str(row["id"]) for row in recent_answers),
+        f"{adherence['taken']}/{adherence['total']}",
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _lru_get(user_id, fingerprint):
+    with _summary_lru_lock:
+        entry = _summary_lru.get(user_id)
+        if not entry or entry[0] != fingerprint:
+            return None
+        _summary_lru.move_to_end(user_id)
+        return entry[1]
+
+
+def _lru_put(user_id, fingerprint, summary):
+    with _summary_lru_lock:
+        _summary_lru[user_id] = (fingerprint, summary)
+        _summary_lru.move_to_end(user_id)
+        while len(_summary_lru) > SUMMARY_LRU_SIZE:
+            _summary_lru.popitem(last=False)
+
+
+def _summary_inputs(user_id, user, preloaded=None):
+    """preloaded may carry already fetched state, recent_answers (newest 20) and adherence."""
+    preloaded = preloaded or {}
+    state = preloaded["state"] if "state" in preloaded else get_patient_state_row(user_id)
+    recent_answers = preloaded.get("recent_answers")
+    if recent_answers is None:
+        recent_answers = get_recent_patient_answers(user_id, limit=20)
+    adherence = preloaded.get("adherence") or calculate_adherence_score(user_id)
+    fingerprint = _summary_fingerprint(user, state, recent_answers, adherence)
+    return state, recent_answers, adherence, fingerprint
+
+
+def get_patient_summary(user_id, user=None, preloaded=None):
+    """
+    The latest stored summary for a patient, without waiting on the LLM. When the inputs
+    changed since it was written a refresh job is queued, and the previous summary (or
+    SUMMARY_PENDING_MESSAGE when there is none yet) is returned meanwhile.
+    Callers that already loaded the patient's rows pass user and preloaded (see
+    _summary_inputs) to skip re-reading them.
+    """
+    user = user or get_user(user_id)
+    if not user:
+        return "Patient summary unavailable: user not found."
+
+    _, _, _, fingerprint = _summary_inputs(user_id, user, preloaded)
+    summary = _lru_get(user_id, fingerprint)
+    if summary is not None:
+        return summary
+
+    cached = get_cached_patient_summary(user_id)
+    if cached and cached["fingerprint"] == fingerprint:
+        _lru_put(user_id, fingerprint, cached["summary"])
+        return cached["summary"]
+
+    enqueue_patient_summary(user_id, fingerprint)
+    if cached:
+        return cached["summary"]
+    # Placeholders are never cached, but the last finished job keeps the one it produced.
+    finished = latest_job(f"{PATIENT_SUMMARY_JOB}:{user_id}", status="done")
+    if finished and finished["result"]:
+        return finished["result"]
+    return SUMMARY_PENDING_MESSAGE
+
+
+def enqueue_patient_summary(user_id, fingerprint=None):
+    """
+    Queue a summary refresh. With the fingerprint of the inputs (the read path) nothing
+    is written when a job for those inputs is already queued or recently finished.
+    """
+    dedupe_key = f"{PATIENT_SUMMARY_JOB}:{user_id}"
+    if fingerprint is None:
+        return enqueue(PATIENT_SUMMARY_JOB, {"user_id": user_id}, dedupe_key=dedupe_key)
+    return enqueue_if_new(
+        PATIENT_SUMMARY_JOB,
+        {"user_id": user_id, "fingerprint": fingerprint},
+        dedupe_key=dedupe_key,
+    )
+
+
+def _summary_job(payload):
+    summary = generate_patient_summary(payload["user_id"], timeout_seconds=SUMMARY_CALL_TIMEOUT_SECONDS)
+    if is_fallback_summary(summary) and summary != SUMMARY_UNAVAILABLE_NO_KEY:
+        # A failed or empty LLM answer: raising schedules a retry with backoff.
+        raise RuntimeError(summary)
+    return summary
+
+
+def generate_patient_summary(user_id, timeout_seconds=None):
+    """
+    Return the AI health summary for a patient, regenerating it only when the
+    inputs (patient state, recent answers, adherence totals) have changed.
+    """
     user = get_user(user_id)
     if not user:
         return "Patient summary unavailable: user not found."
 
-    state = get_patient_state_row(user_id)
+    state, recent_answers, adherence, fingerprint = _summary_inputs(user_id, user)
     trend = state["trend"] if state and state["trend"] else "stable"
 
-    recent_answers = get_recent_patient_answers(user_id, limit=20)
-    stress_history = _format_answer_history(recent_answers, "stress")
-    energy_history = _format_answer_history(recent_answers, "energy")
-    adherence_history = _build_adherence_history(user_id)
+    summary = _lru_get(user_id, fingerprint)
+    if summary is not None:
+        return summary
+
+    cached = get_cached_patient_summary(user_id)
+    if cached and cached["fingerprint"] == fingerprint:
+        _lru_put(user_id, fingerprint, cached["summary"])
+        return cached["summary"]
 
-    return generate_health_summary(
+    summary = generate_health_summary(
         condition=user["condition"],
-        stress_history=stress_history,
-        energy_history=energy_history,
-        adherence_history=adherence_history,
+        stress_history=_format_answer_history(recent_answers, "stress"),
+        energy_history=_format_answer_history(recent_answers, "energy"),
+        adherence_history=_build_adherence_history(adherence),
         trend=trend,
+        timeout_seconds=timeout_seconds,
     )
+
+    # Placeholder messages are returned but never cached, so the next view retries the LLM.
+    if not is_fallback_summary(summary):
+        save_cached_patient_summary(
+            user_id,
+            fingerprint,
+            summary,
+            datetime.now().isoformat(timespec="seconds"),
+        )
+        _lru_put(user_id, fingerprint, summary)
+    return summary
+
+
+register_job_handler(PATIENT_SUMMARY_JOB, _summary_job)
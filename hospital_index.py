@@ -0,0 +1,266 @@
+"""
+In-memory grid index over Hospital rows that have coordinates.
+
+Hospitals are bucketed into HOSPITAL_INDEX_CELL_DEGREES cells. k-nearest and radius
+queries walk outward ring by ring and stop as soon as nothing in an unvisited ring can
+beat what has already been found. Each worker rebuilds its copy whenever the Hospital
+change counter in DataVersion moves; once a copy exists the rebuild runs in the
+background and queries keep using the previous copy until it finishes. Specialization-only
+updates do not move the counter, so the specialization filter sees the values as of the
+last rebuild.
+"""
+import heapq
+import math
+import os
+import threading
+
+from database import release_shared_connection
+from geolocation_service import geocode_location, haversine_distance_km
+from models import (
+    get_data_version,
+    list_located_hospitals,
+    list_unlocated_hospitals,
+    set_hospital_coordinates,
+)
+
+HOSPITAL_INDEX_CELL_DEGREES = float(os.environ.get("HOSPITAL_INDEX_CELL_DEGREES", "0.1"))
+
+_EARTH_RADIUS_KM = 6371.0
+
+_index = {"version": None, "cells": {}, "size": 0}
+_index_lock = threading.Lock()
+_rebuild_running = False
+
+
+def _cell_for(lat, lon, cell_degrees):
+    lon_cells = int(round(360.0 / cell_degrees))
+    return math.floor(lat / cell_degrees), math.floor((lon + 180.0) / cell_degrees) % lon_cells
+
+
+def _build_index(version):
+    cells = {}
+    hospitals = list_located_hospitals()
+    for hospital in hospitals:
+        hospital["_specialization_key"] = str(hospital.get("specialization") or "").strip().lower()
+        cell = _cell_for(hospital["latitude"], hospital["longitude"], HOSPITAL_INDEX_CELL_DEGREES)
+        cells.setdefault(cell, []).append(hospital)
+    return {"version": version, "cells": cells, "size": len(hospitals)}
+
+
+def _rebuild_in_background():
+    global _index, _rebuild_running
+    try:
+        version = get_data_version("Hospital")
+        rebuilt = _build_index(version)
+        with _index_lock:
+            if _index["version"] is not None and rebuilt["version"] >= _index["version"]:
+                _index = rebuilt
+    finally:
+        release_shared_connection()
+        with _index_lock:
+            _rebuild_running = False
+
+
+def _current_index():
+    global _index, _rebuild_running
+    version = get_data_version("Hospital")
+    index = _index
+    if index["version"] == version:
+        return index
+    with _index_lock:
+        if _index["version"] is None:
+            _index = _build_index(version)
+        elif _index["version"] != version and not _rebuild_running:
+            _rebuild_running = True
+            threading.Thread(target=_rebuild_in_background, daemon=True).start()
+        return _index
+
+
+def index_version():
+    """The Hospital change counter the copy currently serving queries was built from."""
+    return _current_index()["version"]
+
+
+def refresh_hospital_index():
+    """Drop this worker's copy so the next query rebuilds it."""
+    global _index
+    with _index_lock:
+        _index = {"version": None, "cells": {}, "size": 0}
+
+
+def _ring_cells(centre, ring, lon_cells):
+    lat_index, lon_index = centre
+    if ring == 0:
+        return [centre]
+    cells = set()
+    for offset in range(-ring, ring + 1):
+        for lat_offset, lon_offset in (
+            (-ring, offset),
+            (ring, offset),
+            (offset, -ring),
+            (offset, ring),
+        ):
+            cells.add((lat_index + lat_offset, (lon_index + lon_offset) % lon_cells))
+    return cells
+
+
+def _arc_lower_bound_km(lat_gap_degrees, lon_gap_degrees, max_abs_lat):
+    # hav(d) >= hav(dlat) and hav(d) >= cos^2(max |lat|) * hav(dlon) for any two points.
+    lat_bound = _EARTH_RADIUS_KM * math.radians(lat_gap_degrees)
+    lon_bound = 2 * _EARTH_RADIUS_KM * math.asin(
+        min(
+            1.0,
+            math.cos(math.radians(min(90.0, max_abs_lat)))
+            * math.sin(math.radians(min(180.0, lon_gap_degrees)) / 2),
+        )
+    )
+    return lat_bound, lon_bound
+
+
+def _ring_lower_bound_km(lat, ring, cell_degrees):
+    """
+    Smallest possible distance to a hospital outside rings 0..ring: it is at least
+    `ring` whole cells away in latitude or in longitude.
+    """
+    gap = ring * cell_degrees
+    return min(_arc_lower_bound_km(gap, gap, abs(lat) + (ring + 1) * cell_degrees))
+
+
+def _cell_lower_bound_km(lat, lon, cell, cell_degrees):
+    south = cell[0] * cell_degrees
+    north = south + cell_degrees
+    west = cell[1] * cell_degrees - 180.0
+    lat_gap = max(0.0, south - lat, lat - north)
+    if (lon - west) % 360.0 <= cell_degrees:
+        lon_gap = 0.0
+    else:
+        lon_gap = min((west - lon) % 360.0, (lon - west - cell_degrees) % 360.0)
+    max_abs_lat = max(abs(lat), abs(south), abs(north))
+    return max(_arc_lower_bound_km(lat_gap, lon_gap, max_abs_lat))
+
+
+def _matches(hospital, emergency_capable, ambulance_available, specialization):
+    if emergency_capable is not None and bool(hospital.get("emergency_capable")) != emergency_capable:
+        return False
+    if ambulance_available is not None and bool(hospital.get("ambulance_available")) != ambulance_available:
+        return False
+    if specialization is not None and hospital["_specialization_key"] != specialization:
+        return False
+    return True
+
+
+def _search(lat, lon, k, radius_km, emergency_capable, ambulance_available, specialization):
+    if k is not None and k <= 0:
+        return []
+    index = _current_index()
+    if not index["size"]:
+        return []
+
+    lat = float(lat)
+    lon = float(lon)
+    cell_degrees = HOSPITAL_INDEX_CELL_DEGREES
+    lon_cells = int(round(360.0 / cell_degrees))
+    centre = _cell_for(lat, lon, cell_degrees)
+    if specialization is not None:
+        specialization = str(specialization).strip().lower()
+
+    # With k set, `found` is a heap of the k best (-distance, -id, hospital) seen so far.
+    found = []
+
+    def done(bound_km):
+        if radius_km is not None and bound_km > radius_km:
+            return True
+        return k is not None and len(found) >= k and -found[0][0] <= bound_km
+
+    def visit(bucket):
+        for hospital in bucket:
+            if not _matches(hospital, emergency_capable, ambulance_available, specialization):
+                continue
+            distance_km = haversine_distance_km(lat, lon, hospital["latitude"], hospital["longitude"])
+            if radius_km is not None and distance_km > radius_km:
+                continue
+            entry = (-distance_km, -hospital["id"], hospital)
+            if k is None or len(found) < k:
+                heapq.heappush(found, entry)
+            elif entry > found[0]:
+                heapq.heapreplace(found, entry)
+
+    cells = index["cells"]
+    visited = set()
+    ring = 0
+    finished = False
+    # Walk rings outward while they are cheaper than touching every occupied cell.
+    while (2 * ring + 1) ** 2 <= len(cells) and len(visited) < len(cells):
+        for cell in _ring_cells(centre, ring, lon_cells):
+            bucket = cells.get(cell)
+            if bucket:
+                visited.add(cell)
+                visit(bucket)
+        if done(_ring_lower_bound_km(lat, ring, cell_degrees)):
+            finished = True
+            break
+        ring += 1
+
+    if not finished:
+        # Sparse surroundings: visit the remaining occupied cells closest-bound first.
+        remaining = sorted(
+            (_cell_lower_bound_km(lat, lon, cell, cell_degrees), cell)
+            for cell in cells
+            if cell not in visited
+        )
+        for bound_km, cell in remaining:
+            if done(bound_km):
+                break
+            visit(cells[cell])
+
+    results = []
+    for negative_distance, _, hospital in sorted(found, reverse=True):
+        row = {key: value for key, value in hospital.items() if not key.startswith("_")}
+        row["distance_km"] = round(-negative_distance, 3)
+        results.append(row)
+    return results
+
+
+def nearest_hospitals(
+    lat,
+    lon,
+    k=5,
+    max_distance_km=None,
+    emergency_capable=None,
+    ambulance_available=None,
+    specialization=None,
+):
+    """
+    The k closest located hospitals, nearest first, each with distance_km. Filters left
+    as None are not applied; specialization is compared case-insensitively.
+    """
+    return _search(lat, lon, int(k), max_distance_km, emergency_capable, ambulance_available, specialization)
+
+
+def hospitals_within(
+    lat,
+    lon,
+    radius_km,
+    emergency_capable=None,
+    ambulance_available=None,
+    specialization=None,
+):
+    """Every located hospital within radius_km, nearest first, each with distance_km."""
+    return _search(lat, lon, None, float(radius_km), emergency_capable, ambulance_available, specialization)
+
+
+def backfill_hospital_coordinates():
+    """
+    Geocode the location text of hospitals that have no coordinates yet (the seeded
+    rows). Returns (located, still missing).
+    """
+    located = 0
+    missing = 0
+    for hospital in list_unlocated_hospitals():
+        coords = geocode_location(hospital["location"])
+        if coords is None:
+            missing += 1
+            continue
+        set_hospital_coordinates(hospital["id"], coords[0], coords[1])
+        located += 1
+    return located, missing
@@ -1,16 +1,57 @@
 import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from urllib.request import Request, urlopen
 
+from database import release_shared_connection
 from geolocation_service import haversine_distance_km
-from specialization_inference import infer_specialization_with_gemini
+from models import (
+    get_overpass_tile,
+    save_overpass_hospital_specializations,
+    save_overpass_hospitals,
+    save_overpass_tile,
+)
+from specialization_inference import infer_specializations_with_gemini
 
 
-_OVERPASS_ENDPOINTS = [
+_DEFAULT_OVERPASS_ENDPOINTS = [
     "https://overpass-api.de/api/interpreter",
     "https://overpass.kumi.systems/api/interpreter",
     "https://lz4.overpass-api.de/api/interpreter",
 ]
 
+# Comma-separated override, e.g. to point at a local stub from stub_servers.py.
+_OVERPASS_ENDPOINTS = [
+    endpoint.strip()
+    for endpoint in os.environ.get("OVERPASS_ENDPOINTS", "").split(",")
+    if endpoint.strip()
+] or _DEFAULT_OVERPASS_ENDPOINTS
+
+OVERPASS_TIMEOUT_SECONDS = float(os.environ.get("OVERPASS_TIMEOUT_SECONDS", "12"))
+# Delay before the next mirror is raced against the ones already in flight; 0 fires all at once.
+OVERPASS_HEDGE_DELAY_SECONDS = float(os.environ.get("OVERPASS_HEDGE_DELAY_SECONDS", "0.75"))
+
+_overpass_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="overpass")
+
+_endpoint_stats = {}
+_endpoint_stats_lock = threading.Lock()
+
+# Results are cached per grid tile (~5.5 km at the default 0.05 degrees) so nearby users share
+# one Overpass query. Fresh entries are served as-is, stale ones are served while a background
+# refresh runs, and anything older is refetched inline.
+OVERPASS_TILE_DEGREES = float(os.environ.get("OVERPASS_TILE_DEGREES", "0.05"))
+OVERPASS_CACHE_TTL_SECONDS = float(os.environ.get("OVERPASS_CACHE_TTL_SECONDS", str(7 * 86400)))
+OVERPASS_CACHE_STALE_SECONDS = float(os.environ.get("OVERPASS_CACHE_STALE_SECONDS", str(30 * 86400)))
+# A tile with no hospitals is only trusted briefly and never served stale.
+OVERPASS_NEGATIVE_TTL_SECONDS = float(os.environ.get("OVERPASS_NEGATIVE_TTL_SECONDS", "3600"))
+
+_tile_cache_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "fetch_failures": 0}
+_tile_cache_lock = threading.Lock()
+_refreshing_tiles = set()
+
 
 def _display_specialization(value):
     normalized = str(value or "general").strip().lower()
@@ -21,74 +62,338 @@ def _display_specialization(value):
     return normalized.replace("_", " ").title()
 
 
-def _run_overpass_query(query, timeout_seconds=12):
-    for endpoint in _OVERPASS_ENDPOINTS:
-        request = Request(
+def _record_endpoint_result(endpoint, latency_seconds, ok):
+    with _endpoint_stats_lock:
+        stats = _endpoint_stats.setdefault(
             endpoint,
-            data=query.encode("utf-8"),
-            headers={
-                "User-Agent": "CareMatchAI/1.0",
-                "Content-Type": "text/plain; charset=utf-8",
+            {
+                "successes": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "latency_ewma": None,
+                "last_latency": None,
             },
-            method="POST",
         )
+        stats["last_latency"] = round(latency_seconds, 4)
+        if ok:
+            stats["successes"] += 1
+            stats["consecutive_failures"] = 0
+            previous = stats["latency_ewma"]
+            stats["latency_ewma"] = (
+                latency_seconds if previous is None else 0.7 * previous + 0.3 * latency_seconds
+            )
+        else:
+            stats["failures"] += 1
+            stats["consecutive_failures"] += 1
 
-        try:
-            with urlopen(request, timeout=timeout_seconds) as response:
-                payload = json.loads(response.read().decode("utf-8"))
-                if isinstance(payload, dict):
-                    return payload
-        except Exception:
-            continue
 
-    return {"elements": []}
+def _ranked_endpoints():
+    """
+    Healthy mirrors first, fastest first; mirrors without data keep their configured order.
+    """
+    with _endpoint_stats_lock:
+        snapshot = {endpoint: dict(stats) for endpoint, stats in _endpoint_stats.items()}
 
+    def sort_key(item):
+        index, endpoint = item
+        stats = snapshot.get(endpoint) or {}
+        latency = stats.get("latency_ewma")
+        return (
+            min(stats.get("consecutive_failures", 0), 3),
+            latency if latency is not None else float("inf"),
+            index,
+        )
 
-def fetch_nearest_hospitals_overpass(user_lat, user_lon, radius_m=15000, limit=25, preferred_condition=None):
-    payload = {"elements": []}
-    for search_radius in [int(radius_m), int(radius_m * 2), int(radius_m * 3)]:
-        query = f"""
+    return [endpoint for _, endpoint in sorted(enumerate(_OVERPASS_ENDPOINTS), key=sort_key)]
+
+
+def get_overpass_endpoint_stats():
+    with _endpoint_stats_lock:
+        return {endpoint: dict(stats) for endpoint, stats in _endpoint_stats.items()}
+
+
+def _fetch_from_endpoint(endpoint, query, timeout_seconds):
+    request = Request(
+        endpoint,
+        data=query.encode("utf-8"),
+        headers={
+            "User-Agent": "CareMatchAI/1.0",
+            "Content-Type": "text/plain; charset=utf-8",
+        },
+        method="POST",
+    )
+
+    started = time.monotonic()
+    try:
+        with urlopen(request, timeout=timeout_seconds) as response:
+            payload = json.loads(response.read().decode("utf-8"))
+    except Exception:
+        payload = None
+
+    ok = isinstance(payload, dict)
+    _record_endpoint_result(endpoint, time.monotonic() - started, ok)
+    return payload if ok else None
+
+
+def _query_overpass_hedged(query, timeout_seconds, hedge_delay_seconds):
+    """
+    Race the query across mirrors, best-ranked first. Another mirror joins the race every
+    hedge_delay_seconds (or immediately when one fails); the first valid payload wins and
+    calls that have not started yet are cancelled. Returns None when every mirror fails.
+    """
+    endpoints = _ranked_endpoints()
+    deadline = time.monotonic() + timeout_seconds
+    pending = set()
+    next_index = 0
+
+    while True:
+        if next_index < len(endpoints):
+            pending.add(
+                _overpass_executor.submit(
+                    _fetch_from_endpoint, endpoints[next_index], query, timeout_seconds
+                )
+            )
+            next_index += 1
+
+        remaining = deadline - time.monotonic()
+        if not pending or remaining <= 0:
+            break
+
+        wait_seconds = remaining
+        if next_index < len(endpoints):
+            wait_seconds = min(hedge_delay_seconds, remaining)
+
+        done, pending = wait(pending, timeout=wait_seconds, return_when=FIRST_COMPLETED)
+        for future in done:
+            payload = future.result()
+            if payload is not None:
+                for other in pending:
+                    other.cancel()
+                return payload
+
+        if not pending and next_index >= len(endpoints):
+            break
+
+    for future in pending:
+        future.cancel()
+    return None
+
+
+def _run_overpass_query(
+    query,
+    timeout_seconds=OVERPASS_TIMEOUT_SECONDS,
+    hedge_delay_seconds=OVERPASS_HEDGE_DELAY_SECONDS,
+):
+    payload = _query_overpass_hedged(query, timeout_seconds, hedge_delay_seconds)
+    return payload if payload is not None else {"elements": []}
+
+
+def _hospital_query(search_radius, lat, lon):
+    return f"""
         [out:json][timeout:20];
         (
-          node["amenity"="hospital"](around:{search_radius},{user_lat},{user_lon});
-          way["amenity"="hospital"](around:{search_radius},{user_lat},{user_lon});
-          relation["amenity"="hospital"](around:{search_radius},{user_lat},{user_lon});
-          node["healthcare"="hospital"](around:{search_radius},{user_lat},{user_lon});
-          way["healthcare"="hospital"](around:{search_radius},{user_lat},{user_lon});
-          relation["healthcare"="hospital"](around:{search_radius},{user_lat},{user_lon});
+          node["amenity"="hospital"](around:{search_radius},{lat},{lon});
+          way["amenity"="hospital"](around:{search_radius},{lat},{lon});
+          relation["amenity"="hospital"](around:{search_radius},{lat},{lon});
+          node["healthcare"="hospital"](around:{search_radius},{lat},{lon});
+          way["healthcare"="hospital"](around:{search_radius},{lat},{lon});
+          relation["healthcare"="hospital"](around:{search_radius},{lat},{lon});
         );
         out center tags;
         """
-        payload = _run_overpass_query(query)
-        if payload.get("elements"):
+
+
+def _element_coordinates(element):
+    lat = element.get("lat")
+    lon = element.get("lon")
+    if lat is None or lon is None:
+        center = element.get("center", {})
+        lat = center.get("lat")
+        lon = center.get("lon")
+    if lat is None or lon is None:
+        return None
+    return float(lat), float(lon)
+
+
+def _element_osm_ref(element):
+    return f"{element.get('type', 'node')}/{int(element.get('id', 0))}"
+
+
+def _element_location_text(tags):
+    address = ", ".join(
+        [
+            part
+            for part in [
+                tags.get("addr:street"),
+                tags.get("addr:city"),
+                tags.get("addr:state"),
+            ]
+            if part
+        ]
+    )
+    return address or "Near your location"
+
+
+def _import_overpass_hospitals(elements):
+    """Keep a local copy of every hospital Overpass returns, for hospital_index."""
+    rows = []
+    for element in elements:
+        coordinates = _element_coordinates(element)
+        if coordinates is None:
+            continue
+        tags = element.get("tags", {})
+        rows.append(
+            (
+                _element_osm_ref(element),
+                tags.get("name") or "Nearby Hospital",
+                _element_location_text(tags),
+                coordinates[0],
+                coordinates[1],
+                1 if tags.get("emergency") == "yes" else 0,
+            )
+        )
+    if rows:
+        save_overpass_hospitals(rows)
+
+
+def _store_specializations(specializations):
+    # Runs off the request path; the imported rows keep working with their old value on failure.
+    try:
+        save_overpass_hospital_specializations(specializations)
+    except Exception:
+        pass
+    finally:
+        release_shared_connection()
+
+
+def _count_tile_event(name):
+    with _tile_cache_lock:
+        _tile_cache_stats[name] += 1
+
+
+def get_overpass_cache_stats():
+    with _tile_cache_lock:
+        return dict(_tile_cache_stats)
+
+
+def _tile_for(lat, lon, search_radius):
+    """
+    Return (cache key, tile centre lat, tile centre lon, query radius in metres).
+    The query radius covers the search circle of any point inside the tile.
+    """
+    size = OVERPASS_TILE_DEGREES
+    lat_index = math.floor(float(lat) / size)
+    lon_index = math.floor(float(lon) / size)
+    centre_lat = round((lat_index + 0.5) * size, 6)
+    centre_lon = round((lon_index + 0.5) * size, 6)
+    half_diagonal_m = size * 111320 * math.sqrt(2) / 2
+    key = f"{size}:{lat_index}:{lon_index}:{int(search_radius)}"
+    return key, centre_lat, centre_lon, int(search_radius + half_diagonal_m)
+
+
+def _fetch_tile_elements(key, centre_lat, centre_lon, query_radius):
+    payload = _query_overpass_hedged(
+        _hospital_query(query_radius, centre_lat, centre_lon),
+        OVERPASS_TIMEOUT_SECONDS,
+        OVERPASS_HEDGE_DELAY_SECONDS,
+    )
+    if payload is None:
+        _count_tile_event("fetch_failures")
+        return None
+
+    elements = payload.get("elements", [])
+    # Overpass answers a server-side timeout or memory limit with HTTP 200, a "remark"
+    # and no (or only some) elements; such a result is used once but never cached.
+    if payload.get("remark"):
+        if not elements:
+            _count_tile_event("fetch_failures")
+            return None
+    else:
+        save_overpass_tile(key, json.dumps(elements), time.time())
+    try:
+        _import_overpass_hospitals(elements)
+    except Exception:
+        pass
+    return elements
+
+
+def _refresh_tile(key, centre_lat, centre_lon, query_radius):
+    try:
+        _fetch_tile_elements(key, centre_lat, centre_lon, query_radius)
+        _count_tile_event("refreshes")
+    finally:
+        release_shared_connection()
+        with _tile_cache_lock:
+            _refreshing_tiles.discard(key)
+
+
+def _schedule_tile_refresh(key, centre_lat, centre_lon, query_radius):
+    with _tile_cache_lock:
+        if key in _refreshing_tiles:
+            return
+        _refreshing_tiles.add(key)
+    _overpass_executor.submit(_refresh_tile, key, centre_lat, centre_lon, query_radius)
+
+
+def _cached_tile_elements(user_lat, user_lon, search_radius):
+    key, centre_lat, centre_lon, query_radius = _tile_for(user_lat, user_lon, search_radius)
+    row = get_overpass_tile(key)
+    age = time.time() - row["fetched_at"] if row else None
+    ttl_seconds, stale_seconds = OVERPASS_CACHE_TTL_SECONDS, OVERPASS_CACHE_STALE_SECONDS
+    if row and row["elements"] == "[]":
+        ttl_seconds = stale_seconds = OVERPASS_NEGATIVE_TTL_SECONDS
+
+    if row and age < ttl_seconds:
+        _count_tile_event("hits")
+        return json.loads(row["elements"])
+
+    if row and age < stale_seconds:
+        _count_tile_event("stale_hits")
+        _schedule_tile_refresh(key, centre_lat, centre_lon, query_radius)
+        return json.loads(row["elements"])
+
+    _count_tile_event("misses")
+    elements = _fetch_tile_elements(key, centre_lat, centre_lon, query_radius)
+    if elements is None:
+        # Every mirror failed: an expired entry is still better than nothing.
+        return json.loads(row["elements"]) if row else []
+    return elements
+
+
+def overpass_tile_version(user_lat, user_lon, radius_m=15000):
+    """
+    When the Overpass tile that fetch_nearest_hospitals_overpass reads first for this
+    point was last fetched, or None when it is not cached. Results built from the tile
+    can be keyed by it, so only a refresh of that tile invalidates them.
+    """
+    row = get_overpass_tile(_tile_for(user_lat, user_lon, int(radius_m))[0])
+    return row["fetched_at"] if row else None
+
+
+def fetch_nearest_hospitals_overpass(user_lat, user_lon, radius_m=15000, limit=25, preferred_condition=None):
+    elements = []
+    for search_radius in [int(radius_m), int(radius_m * 2), int(radius_m * 3)]:
+        # Tiles are queried with a wider radius, so trim back to the user's own search circle.
+        elements = []
+        for element in _cached_tile_elements(user_lat, user_lon, search_radius):
+            coordinates = _element_coordinates(element)
+            if coordinates is None:
+                continue
+            distance_km = haversine_distance_km(
+                float(user_lat), float(user_lon), coordinates[0], coordinates[1]
+            )
+            if distance_km * 1000 <= search_radius:
+                elements.append(element)
+        if elements:
             break
 
     hospitals = []
-    for element in payload.get("elements", []):
+    for element in elements:
         tags = element.get("tags", {})
-
-        lat = element.get("lat")
-        lon = element.get("lon")
-        if lat is None or lon is None:
-            center = element.get("center", {})
-            lat = center.get("lat")
-            lon = center.get("lon")
-        if lat is None or lon is None:
-            continue
+        lat, lon = _element_coordinates(element)
 
         name = tags.get("name") or "Nearby Hospital"
-        address = ", ".join(
-            [
-                part
-                for part in [
-                    tags.get("addr:street"),
-                    tags.get("addr:city"),
-                    tags.get("addr:state"),
-                ]
-                if part
-            ]
-        )
-        location_text = address or "Near your location"
+        location_text = _element_location_text(tags)
 
         emergency_capable = 1 if tags.get("emergency") == "yes" else 0
         distance_km = haversine_distance_km(float(user_lat), float(user_lon), float(lat), float(lon))
@@ -98,23 +403,31 @@ def fetch_nearest_hospitals_overpass(user_lat, user_lon, radius_m=15000, limit=2
                 "id": int(element.get("id", 0)) + 900000000,
                 "name": name,
                 "location": location_text,
-                "rating": 4.0,
-                "avg_cost": 3000,
+                "rating": None,
+                "avg_cost": None,
                 "emergency_capable": emergency_capable,
                 "latitude": float(lat),
                 "longitude": float(lon),
                 "distance_km": round(distance_km, 2),
                 "source": "overpass",
+                "osm_ref": _element_osm_ref(element),
             }
         )
 
     hospitals.sort(key=lambda row: row["distance_km"])
     selected = hospitals[: int(limit)]
 
+    specializations = infer_specializations_with_gemini([hospital["name"] for hospital in selected])
     for hospital in selected:
-        specialization = infer_specialization_with_gemini(hospital["name"]) or "general"
+        specialization = specializations.get(hospital["name"]) or "general"
         hospital["specialties"] = specialization
         hospital["specialization"] = specialization
         hospital["specialization_display"] = _display_specialization(specialization)
 
+    if selected:
+        _overpass_executor.submit(
+            _store_specializations,
+            [(hospital["osm_ref"], hospital["specialization"]) for hospital in selected],
+        )
+
     return selected
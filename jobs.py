@@ -0,0 +1,206 @@
+"""
+Background jobs backed by the Job table.
+
+Modules register a handler per job kind with register_job_handler and call enqueue()
+from the request path; a worker leases due jobs, runs the handler and stores its
+JSON result. Failed attempts are retried with exponential backoff until max_attempts.
+
+Every web worker runs JOB_WORKER_THREADS worker threads. A dedicated process can drain
+the queue instead with
+    JOB_WORKER_THREADS=0 flask --app app run-jobs
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+import cache_store
+from database import release_shared_connection
+from models import (
+    delete_finished_jobs,
+    enqueue_job,
+    finish_job,
+    get_job,
+    get_latest_job,
+    lease_job,
+)
+
+JOB_WORKER_THREADS = int(os.environ.get("JOB_WORKER_THREADS", "1"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "2"))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.environ.get("JOB_RETRY_MAX_SECONDS", "900"))
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# How long enqueue_if_new() lets a finished job's outcome stand for the same payload.
+JOB_OUTCOME_TTL_SECONDS = float(os.environ.get("JOB_OUTCOME_TTL_SECONDS", "3600"))
+
+# {kind: handler(payload) -> JSON-serializable result}
+_handlers = {}
+
+# Set by enqueue() so idle worker threads in this process pick new work up at once.
+_wakeup = threading.Event()
+_stop = threading.Event()
+_threads = []
+_threads_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def register_job_handler(kind, handler):
+    _handlers[kind] = handler
+
+
+def enqueue(kind, payload=None, dedupe_key=None, delay_seconds=0, max_attempts=None):
+    """
+    Queue a job and return its id. While a job with the same dedupe_key is still
+    waiting to run, no second one is queued; that job takes the newer payload.
+    """
+    now = time.time()
+    job_id = enqueue_job(
+        kind,
+        _encode_payload(payload),
+        dedupe_key,
+        max_attempts or JOB_MAX_ATTEMPTS,
+        now + delay_seconds,
+        now,
+    )
+    _wakeup.set()
+    return job_id
+
+
+def enqueue_if_new(kind, payload=None, dedupe_key=None, outcome_ttl_seconds=JOB_OUTCOME_TTL_SECONDS):
+    """
+    enqueue() for page views, behind a read-only check: nothing is written when the
+    latest job for dedupe_key has the same payload and is queued or running, or finished
+    (done or failed) less than outcome_ttl_seconds ago. Failed and unresolvable outcomes
+    thus stand until they expire instead of being queued again on every view.
+    Returns the job id.
+    """
+    latest = get_latest_job(dedupe_key) if dedupe_key is not None else None
+    if latest is not None and latest["payload"] == _encode_payload(payload):
+        if latest["status"] in ("queued", "running"):
+            return latest["id"]
+        if time.time() - latest["updated_at"] < outcome_ttl_seconds:
+            return latest["id"]
+    return enqueue(kind, payload, dedupe_key)
+
+
+def _encode_payload(payload):
+    return json.dumps(payload if payload is not None else {}, sort_keys=True)
+
+
+def job_status(job_id):
+    """The job row with payload and result decoded, or None."""
+    return _decode(get_job(job_id))
+
+
+def latest_job(dedupe_key, status=None):
+    """The most recent job (optionally only with the given status) for a dedupe key."""
+    return _decode(get_latest_job(dedupe_key, status))
+
+
+def _decode(job):
+    if job is None:
+        return None
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+def retry_delay_seconds(attempts):
+    return min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+
+
+def run_next_job(worker_id):
+    """
+    Lease and run one due job. Returns False when nothing was due.
+    """
+    now = time.time()
+    job = lease_job(worker_id, now + JOB_LEASE_SECONDS, now)
+    if job is None:
+        return False
+
+    handler = _handlers.get(job["kind"])
+    try:
+        if handler is None:
+            raise LookupError(f"no handler registered for job kind {job['kind']!r}")
+        result = handler(json.loads(job["payload"]))
+    except Exception:
+        error = traceback.format_exc(limit=5)
+        finished_at = time.time()
+        if job["attempts"] >= job["max_attempts"]:
+            finish_job(job["id"], worker_id, "failed", None, error, job["run_after"], finished_at)
+        else:
+            run_after = finished_at + retry_delay_seconds(job["attempts"])
+            finish_job(job["id"], worker_id, "queued", None, error, run_after, finished_at)
+        return True
+
+    finish_job(job["id"], worker_id, "done", json.dumps(result), None, job["run_after"], time.time())
+    return True
+
+
+def purge_finished_jobs(older_than_seconds=JOB_RETENTION_SECONDS):
+    return delete_finished_jobs(time.time() - older_than_seconds)
+
+
+def run_worker(worker_id=None, stop_event=None, exit_when_idle=False):
+    """
+    Run jobs until stop_event is set, or until the queue has nothing due when
+    exit_when_idle is set. Returns the number of jobs run.
+    """
+    global _last_purge
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    stop_event = stop_event or threading.Event()
+    processed = 0
+    while not stop_event.is_set():
+        try:
+            ran = run_next_job(worker_id)
+            if time.time() - _last_purge > 3600:
+                _last_purge = time.time()
+                purge_finished_jobs()
+                cache_store.purge_expired()
+        except Exception:
+            # A locked or unavailable database: back off and try again.
+            ran = False
+        finally:
+            release_shared_connection()
+
+        if ran:
+            processed += 1
+            continue
+        if exit_when_idle:
+            break
+        _wakeup.wait(JOB_POLL_SECONDS)
+        _wakeup.clear()
+    return processed
+
+
+def start_job_workers(count=None):
+    """Start the in-process worker threads once per process."""
+    count = JOB_WORKER_THREADS if count is None else count
+    with _threads_lock:
+        if _threads:
+            return
+        _stop.clear()
+        for _ in range(count):
+            thread = threading.Thread(
+                target=run_worker,
+                kwargs={"stop_event": _stop},
+                name="job-worker",
+                daemon=True,
+            )
+            thread.start()
+            _threads.append(thread)
+
+
+def stop_job_workers(timeout_seconds=None):
+    """Ask the in-process worker threads to exit after their current job."""
+    with _threads_lock:
+        threads = list(_threads)
+        _threads.clear()
+    _stop.set()
+    _wakeup.set()
+    for thread in threads:
+        thread.join(timeout_seconds)
@@ -0,0 +1,318 @@
+"""
+Single way out to the LLM for every call site.
+
+LLM_BACKEND picks what answers the calls: "gemini" (default) or "stub", the scripted
+in-process stand-in from stub_servers for offline load tests (LLM_STUB_LATENCY_SECONDS,
+LLM_STUB_LATENCY_SIGMA, LLM_STUB_ERROR_RATE, LLM_STUB_SEED). Other backends can be added
+with register_llm_backend(). LLM_BASE_URL points the Gemini client at another endpoint,
+such as the stub_servers.py gemini server.
+
+- One long-lived client per deadline, so calls reuse pooled HTTPS connections.
+- Every call has a deadline (LLM_TIMEOUT_SECONDS unless the caller passes a shorter one).
+- At most LLM_MAX_CONCURRENCY calls are in flight per process; a call that cannot get a
+  slot within LLM_QUEUE_TIMEOUT_SECONDS is rejected instead of queueing behind a slow provider.
+- After LLM_BREAKER_FAILURES consecutive failures the circuit opens and calls fail fast
+  for LLM_BREAKER_COOLDOWN_SECONDS; then one trial call decides whether it closes again.
+
+Call sites that pass cache_ttl_seconds opt into the response cache: responses are
+stored in the shared cache under a hash of model, prompt and generation config, and
+an identical request is answered from there without reaching the provider (even while
+the circuit is open). cache_store trims the cache back to the LLM_CACHE_MAX_ENTRIES most
+recent responses.
+
+Rejected and failed calls raise, so each call site falls through to its rule-based
+fallback. llm_metrics() reports latency, outcomes and cache hit rate per call site.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from google import genai
+
+import cache_store
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "gemini")
+LLM_MODEL = os.environ.get("LLM_MODEL", "gemini-1.5-flash")
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL")
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "20"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", "2"))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+LLM_CACHE_NAMESPACE = "llm_response"
+cache_store.limit_namespace(LLM_CACHE_NAMESPACE, LLM_CACHE_MAX_ENTRIES)
+
+LLM_STUB_LATENCY_SECONDS = float(os.environ.get("LLM_STUB_LATENCY_SECONDS", "0"))
+LLM_STUB_LATENCY_SIGMA = float(os.environ.get("LLM_STUB_LATENCY_SIGMA", "0"))
+LLM_STUB_ERROR_RATE = float(os.environ.get("LLM_STUB_ERROR_RATE", "0"))
+LLM_STUB_SEED = int(os.environ.get("LLM_STUB_SEED", "0"))
+
+# {timeout_ms: genai.Client}
+_clients = {}
+_clients_lock = threading.Lock()
+
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+_breaker = {"failures": 0, "open_until": 0.0, "trial_running": False}
+_breaker_lock = threading.Lock()
+
+# {call_site: counters}; see llm_metrics().
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def llm_configured():
+    if LLM_BACKEND != "gemini":
+        return True
+    return bool(os.environ.get("GEMINI_API_KEY"))
+
+
+def _client(timeout_seconds):
+    timeout_ms = int(timeout_seconds * 1000)
+    client = _clients.get(timeout_ms)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(timeout_ms)
+        if client is None:
+            # HttpOptions.timeout is expressed in milliseconds.
+            http_options = {"timeout": timeout_ms}
+            if LLM_BASE_URL:
+                http_options["base_url"] = LLM_BASE_URL
+            client = genai.Client(
+                api_key=os.environ.get("GEMINI_API_KEY"),
+                http_options=http_options,
+            )
+            _clients[timeout_ms] = client
+        return client
+
+
+def _gemini_backend(call_site, prompt, config, timeout_seconds):
+    response = _client(timeout_seconds).models.generate_content(
+        model=LLM_MODEL,
+        contents=prompt,
+        config=config or None,
+    )
+    return response.text or ""
+
+
+def _stub_backend():
+    # Imported on first use so production processes never load the test stand-ins.
+    from stub_servers import StubLLMBackend
+
+    return StubLLMBackend(
+        latency_seconds=LLM_STUB_LATENCY_SECONDS,
+        latency_sigma=LLM_STUB_LATENCY_SIGMA,
+        error_rate=LLM_STUB_ERROR_RATE,
+        seed=LLM_STUB_SEED,
+    )
+
+
+# {name: backend(call_site, prompt, config, timeout_seconds) -> response text}
+_backends = {"gemini": _gemini_backend}
+# {name: factory() -> backend}, built the first time the backend is used.
+_backend_factories = {"stub": _stub_backend}
+_backends_lock = threading.Lock()
+
+
+def register_llm_backend(name, backend):
+    _backends[name] = backend
+
+
+def _get_backend(name):
+    backend = _backends.get(name)
+    if backend is None and name in _backend_factories:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = _backend_factories[name]()
+    return backend
+
+
+def use_llm_backend(name):
+    """Switch this process to a registered backend."""
+    global LLM_BACKEND
+    if name not in _backends and name not in _backend_factories:
+        raise ValueError(f"unknown LLM backend {name!r}")
+    LLM_BACKEND = name
+
+
+def _record(call_site, outcome, elapsed_ms=None, error=None):
+    with _metrics_lock:
+        site = _metrics.setdefault(
+            call_site,
+            {
+                "calls": 0,
+                "ok": 0,
+                "errors": 0,
+                "rejected": 0,
+                "cache_hits": 0,
+                "cache_misses": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "last_error": None,
+            },
+        )
+        if outcome != "cache_misses":
+            site["calls"] += 1
+        site[outcome] += 1
+        if elapsed_ms is not None:
+            site["total_ms"] += elapsed_ms
+            site["max_ms"] = max(site["max_ms"], elapsed_ms)
+        if error is not None:
+            site["last_error"] = error
+
+
+def _admit():
+    """True when the breaker lets a call through; claims the trial slot when half-open."""
+    with _breaker_lock:
+        if _breaker["failures"] < LLM_BREAKER_FAILURES:
+            return True
+        if time.monotonic() < _breaker["open_until"] or _breaker["trial_running"]:
+            return False
+        _breaker["trial_running"] = True
+        return True
+
+
+def _settle(succeeded):
+    with _breaker_lock:
+        _breaker["trial_running"] = False
+        if succeeded:
+            _breaker["failures"] = 0
+            return
+        _breaker["failures"] += 1
+        if _breaker["failures"] >= LLM_BREAKER_FAILURES:
+            _breaker["open_until"] = time.monotonic() + LLM_BREAKER_COOLDOWN_SECONDS
+
+
+def _settle_trial_unused():
+    # A half-open trial that never reached the provider proves nothing either way.
+    with _breaker_lock:
+        _breaker["trial_running"] = False
+
+
+def circuit_open():
+    with _breaker_lock:
+        return (
+            _breaker["failures"] >= LLM_BREAKER_FAILURES
+            and time.monotonic() < _breaker["open_until"]
+        )
+
+
+def _cache_key(prompt, config):
+    material = json.dumps(
+        {
+            # Stand-in answers must never be served as real ones, and vice versa.
+            "backend": LLM_BACKEND,
+            "base_url": LLM_BASE_URL,
+            "model": LLM_MODEL,
+            "prompt": prompt,
+            "config": config,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _cache_response(key, text, ttl_seconds):
+    cache_store.store(LLM_CACHE_NAMESPACE, key, text, ttl_seconds)
+
+
+def generate_text(
+    call_site,
+    prompt,
+    temperature=None,
+    response_mime_type=None,
+    timeout_seconds=None,
+    cache_ttl_seconds=None,
+):
+    """
+    Send one prompt and return the response text (possibly empty).
+    With cache_ttl_seconds, an identical earlier response is returned from the cache and
+    a new non-empty response is cached for that long.
+    Raises RuntimeError without calling the backend when no API key is configured, the
+    circuit is open or no concurrency slot frees up in time; provider errors propagate.
+    """
+    config = {}
+    if temperature is not None:
+        config["temperature"] = temperature
+    if response_mime_type is not None:
+        config["response_mime_type"] = response_mime_type
+
+    cache_key = None
+    if cache_ttl_seconds:
+        cache_key = _cache_key(prompt, config)
+        try:
+            hit, cached = cache_store.lookup(LLM_CACHE_NAMESPACE, cache_key)
+        except Exception:
+            hit, cached = False, None
+        if hit:
+            _record(call_site, "cache_hits")
+            return cached
+        _record(call_site, "cache_misses")
+
+    backend = _get_backend(LLM_BACKEND)
+    if backend is None:
+        _record(call_site, "rejected", error=f"unknown LLM backend {LLM_BACKEND!r}")
+        raise RuntimeError(f"unknown LLM backend {LLM_BACKEND!r}")
+    if not llm_configured():
+        _record(call_site, "rejected", error="GEMINI_API_KEY is not configured")
+        raise RuntimeError("GEMINI_API_KEY is not configured")
+    if not _admit():
+        _record(call_site, "rejected", error="circuit open")
+        raise RuntimeError("LLM circuit open")
+    if not _slots.acquire(timeout=LLM_QUEUE_TIMEOUT_SECONDS):
+        _settle_trial_unused()
+        _record(call_site, "rejected", error="concurrency limit")
+        raise RuntimeError("LLM concurrency limit reached")
+
+    timeout_seconds = min(LLM_TIMEOUT_SECONDS, timeout_seconds or LLM_TIMEOUT_SECONDS)
+
+    started = time.perf_counter()
+    try:
+        text = (backend(call_site, prompt, config, timeout_seconds) or "").strip()
+    except Exception as exc:
+        _settle(False)
+        _record(call_site, "errors", (time.perf_counter() - started) * 1000.0, repr(exc)[:200])
+        raise
+    finally:
+        _slots.release()
+
+    _settle(True)
+    _record(call_site, "ok", (time.perf_counter() - started) * 1000.0)
+    if cache_key is not None and text:
+        try:
+            _cache_response(cache_key, text, cache_ttl_seconds)
+        except Exception:
+            pass
+    return text
+
+
+def llm_metrics():
+    """
+    Breaker state plus {call_site: {calls, ok, errors, rejected, cache_hits, cache_misses,
+    cache_hit_rate, avg_ms, max_ms, last_error}} for this process. calls counts provider
+    calls and cache hits; cache_hit_rate covers only calls that opted into the cache.
+    """
+    with _metrics_lock:
+        snapshot = {}
+        for call_site, site in _metrics.items():
+            timed = site["ok"] + site["errors"]
+            cacheable = site["cache_hits"] + site["cache_misses"]
+            snapshot[call_site] = {
+                "calls": site["calls"],
+                "ok": site["ok"],
+                "errors": site["errors"],
+                "rejected": site["rejected"],
+                "cache_hits": site["cache_hits"],
+                "cache_misses": site["cache_misses"],
+                "cache_hit_rate": round(site["cache_hits"] / cacheable, 3) if cacheable else None,
+                "avg_ms": round(site["total_ms"] / timed, 1) if timed else None,
+                "max_ms": round(site["max_ms"], 1),
+                "last_error": site["last_error"],
+            }
+    return {"backend": LLM_BACKEND, "circuit_open": circuit_open(), "call_sites": snapshot}
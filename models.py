@@ -1,4 +1,12 @@
-from database import get_connection
+from flask import g, has_request_context
+
+from database import (
+    HEALTH_LOG_ROLLUP_PERIODS,
+    add_statement_listener,
+    get_shared_connection,
+    populate_health_log_rollups,
+    transaction,
+)
 
 
 def _row_to_dict(row):
@@ -11,6 +19,75 @@ def _rows_to_dicts(rows):
     return [dict(row) for row in rows]
 
 
+# Request-scoped identity map: during a Flask request, User, Doctor and PatientState rows
+# are read at most once by primary key, and writes made through this module update the
+# mapped row in place. Outside a request (job workers, CLI commands) every lookup goes to
+# the database.
+
+def _request_scope():
+    if not has_request_context():
+        return None
+    scope = g.get("models_scope")
+    if scope is None:
+        scope = g.models_scope = {
+            "rows": {},
+            "counters": {"queries": 0, "identity_map_hits": 0, "identity_map_misses": 0},
+        }
+    return scope
+
+
+def _count_statement(_sql):
+    scope = _request_scope()
+    if scope is not None:
+        scope["counters"]["queries"] += 1
+
+
+add_statement_listener(_count_statement)
+
+
+def query_counters():
+    """
+    SQL statements run and identity map hits/misses so far in the current request, e.g.
+    to bound the queries a route issues. All zero outside a request.
+    """
+    scope = _request_scope()
+    if scope is None:
+        return {"queries": 0, "identity_map_hits": 0, "identity_map_misses": 0}
+    return dict(scope["counters"])
+
+
+def _mapped_row(table, key, load):
+    scope = _request_scope()
+    if scope is None:
+        return load()
+    rows = scope["rows"]
+    if (table, key) in rows:
+        scope["counters"]["identity_map_hits"] += 1
+        return rows[(table, key)]
+    scope["counters"]["identity_map_misses"] += 1
+    row = load()
+    rows[(table, key)] = row
+    return row
+
+
+def _update_mapped_row(table, key, values, complete=False):
+    """
+    Apply a write to the mapped row, if any. complete means values hold the whole row,
+    so a row recorded as missing (or never read) can be mapped from them directly.
+    """
+    scope = _request_scope()
+    if scope is None:
+        return
+    rows = scope["rows"]
+    row = rows.get((table, key))
+    if row is not None:
+        row.update(values)
+    elif complete:
+        rows[(table, key)] = dict(values)
+    else:
+        rows.pop((table, key), None)
+
+
 # User model operations
 
 def create_user(
@@ -28,8 +105,10 @@ def create_user(
     medical_conditions="",
     emergency_contact_name="",
     emergency_contact_phone="",
+    latitude=None,
+    longitude=None,
 ):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -47,9 +126,11 @@ def create_user(
             allergies,
             medical_conditions,
             emergency_contact_name,
-            emergency_contact_phone
+            emergency_contact_phone,
+            latitude,
+            longitude
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             name,
@@ -66,36 +147,68 @@ def create_user(
             medical_conditions,
             emergency_contact_name,
             emergency_contact_phone,
+            latitude,
+            longitude,
         ),
     )
     conn.commit()
     user_id = cursor.lastrowid
-    conn.close()
     return user_id
 
 
+def set_user_coordinates(user_id, latitude, longitude):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE User SET latitude = ?, longitude = ? WHERE id = ?",
+        (latitude, longitude, user_id),
+    )
+    conn.commit()
+    _update_mapped_row("User", user_id, {"latitude": latitude, "longitude": longitude})
+
+
+def list_unlocated_users():
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, location FROM User WHERE latitude IS NULL OR longitude IS NULL")
+    users = _rows_to_dicts(cursor.fetchall())
+    return users
+
+
+def list_user_coordinates():
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT latitude, longitude FROM User WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    )
+    rows = _rows_to_dicts(cursor.fetchall())
+    return rows
+
+
 def get_user(user_id):
-    conn = get_connection()
+    return _mapped_row("User", user_id, lambda: _load_user(user_id))
+
+
+def _load_user(user_id):
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM User WHERE id = ?", (user_id,))
     user = _row_to_dict(cursor.fetchone())
-    conn.close()
     return user
 
 
 # Hospital and doctor model operations
 
 def list_hospitals():
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Hospital")
     hospitals = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return hospitals
 
 
 def list_emergency_hospitals():
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -105,47 +218,136 @@ def list_emergency_hospitals():
         """
     )
     hospitals = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return hospitals
 
 
 def get_hospital(hospital_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Hospital WHERE id = ?", (hospital_id,))
     hospital = _row_to_dict(cursor.fetchone())
-    conn.close()
     return hospital
 
 
+def list_located_hospitals():
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT *
+        FROM Hospital
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """
+    )
+    hospitals = _rows_to_dicts(cursor.fetchall())
+    return hospitals
+
+
+def list_unlocated_hospitals():
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, location FROM Hospital WHERE latitude IS NULL OR longitude IS NULL")
+    hospitals = _rows_to_dicts(cursor.fetchall())
+    return hospitals
+
+
+def set_hospital_coordinates(hospital_id, latitude, longitude):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE Hospital SET latitude = ?, longitude = ? WHERE id = ?",
+        (latitude, longitude, hospital_id),
+    )
+    conn.commit()
+
+
+def save_overpass_hospitals(hospitals):
+    """
+    Upsert Overpass results keyed by osm_ref. hospitals holds tuples of
+    (osm_ref, name, location, latitude, longitude, emergency_capable); rows that have
+    not changed are left alone so the Hospital change counter only moves on real edits.
+    Imported rows have no rating or cost, so both are stored as NULL.
+    """
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            """
+            INSERT INTO Hospital (
+                osm_ref,
+                name,
+                location,
+                latitude,
+                longitude,
+                emergency_capable,
+                specialization,
+                rating,
+                avg_cost
+            )
+            VALUES (?, ?, ?, ?, ?, ?, 'general', NULL, NULL)
+            ON CONFLICT(osm_ref) WHERE osm_ref IS NOT NULL DO UPDATE SET
+                name = excluded.name,
+                location = excluded.location,
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                emergency_capable = excluded.emergency_capable
+            WHERE Hospital.name IS NOT excluded.name
+                OR Hospital.location IS NOT excluded.location
+                OR Hospital.latitude IS NOT excluded.latitude
+                OR Hospital.longitude IS NOT excluded.longitude
+                OR Hospital.emergency_capable IS NOT excluded.emergency_capable
+            """,
+            hospitals,
+        )
+
+
+def save_overpass_hospital_specializations(specializations):
+    """specializations holds (osm_ref, specialization) pairs."""
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            """
+            UPDATE Hospital
+            SET specialization = ?
+            WHERE osm_ref = ? AND specialization IS NOT ?
+            """,
+            [(specialization, osm_ref, specialization) for osm_ref, specialization in specializations],
+        )
+
+
+def get_data_version(name):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM DataVersion WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    return row["version"] if row else 0
+
+
 def get_doctors_by_hospital(hospital_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT * FROM Doctor WHERE hospital_id = ? ORDER BY rating DESC, experience_years DESC",
         (hospital_id,),
     )
     doctors = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return doctors
 
 
 def get_doctors_for_specialization(specialization):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT * FROM Doctor WHERE LOWER(specialization) = LOWER(?)",
         (specialization,),
     )
     doctors = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return doctors
 
 
 # Medicine model operations
 
 def add_medicine(user_id, name, dosage, schedule, total_count):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -155,20 +357,18 @@ def add_medicine(user_id, name, dosage, schedule, total_count):
         (user_id, name, dosage, schedule, total_count),
     )
     conn.commit()
-    conn.close()
 
 
 def get_user_medicines(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Medicine WHERE user_id = ?", (user_id,))
     medicines = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return medicines
 
 
 def increment_medicine_taken(medicine_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -182,71 +382,158 @@ def increment_medicine_taken(medicine_id):
         (medicine_id,),
     )
     conn.commit()
-    conn.close()
 
 
 # Health log model operations
 
-def create_health_log(user_id, sleep_hours, stress_level, energy_level, symptoms, date):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO HealthLog (user_id, sleep_hours, stress_level, energy_level, symptoms, date)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (user_id, sleep_hours, stress_level, energy_level, symptoms, date),
+_ADD_TO_HEALTH_LOG_ROLLUP_SQL = """
+    INSERT INTO HealthLogRollup (
+        user_id,
+        period,
+        period_start,
+        log_count,
+        sleep_total,
+        stress_total,
+        energy_total,
+        symptom_log_count
     )
-    conn.commit()
-    conn.close()
+    SELECT ?, ?, {period_start}, 1, ?, ?, ?, ?
+    WHERE {period_start} IS NOT NULL
+    ON CONFLICT(user_id, period, period_start) DO UPDATE SET
+        log_count = log_count + 1,
+        sleep_total = sleep_total + excluded.sleep_total,
+        stress_total = stress_total + excluded.stress_total,
+        energy_total = energy_total + excluded.energy_total,
+        symptom_log_count = symptom_log_count + excluded.symptom_log_count
+"""
+
+
+def create_health_log(user_id, sleep_hours, stress_level, energy_level, symptoms, date):
+    """Insert the log and add it to the user's daily and weekly rollups atomically."""
+    has_symptoms = 1 if (symptoms or "").strip() else 0
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO HealthLog (user_id, sleep_hours, stress_level, energy_level, symptoms, date)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, sleep_hours, stress_level, energy_level, symptoms, date),
+        )
+        for period, expression in HEALTH_LOG_ROLLUP_PERIODS.items():
+            cursor.execute(
+                _ADD_TO_HEALTH_LOG_ROLLUP_SQL.format(period_start=expression.format(date="?")),
+                (user_id, period, date, sleep_hours, stress_level, energy_level, has_symptoms, date),
+            )
 
 
 def get_health_logs(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT * FROM HealthLog WHERE user_id = ? ORDER BY date DESC, id DESC",
         (user_id,),
     )
     logs = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return logs
 
 
+def get_health_logs_page(user_id, limit, before=None):
+    """
+    Up to limit HealthLog rows, newest first. before is the (date, id) of the last row of
+    the previous page; the keyset walks idx_healthlog_user_date, so a page costs the same
+    however far back it is.
+    """
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    if before is None:
+        cursor.execute(
+            "SELECT * FROM HealthLog WHERE user_id = ? ORDER BY date DESC, id DESC LIMIT ?",
+            (user_id, limit),
+        )
+    else:
+        cursor.execute(
+            """
+            SELECT *
+            FROM HealthLog
+            WHERE user_id = ? AND (date, id) < (?, ?)
+            ORDER BY date DESC, id DESC
+            LIMIT ?
+            """,
+            (user_id, before[0], before[1], limit),
+        )
+    logs = _rows_to_dicts(cursor.fetchall())
+    return logs
+
+
+def rebuild_health_log_rollups(user_id=None):
+    """Recompute daily and weekly rollups from HealthLog for one user, or for everyone."""
+    with transaction() as conn:
+        populate_health_log_rollups(conn, user_id)
+
+
+def get_health_log_series(user_id, period, start_date, end_date):
+    """
+    Per-period means for period_start in [start_date, end_date] (YYYY-MM-DD), oldest
+    first, from one range scan of the HealthLogRollup primary key. Periods without logs
+    are absent.
+    """
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT
+            period_start,
+            log_count,
+            sleep_total / log_count AS mean_sleep_hours,
+            CAST(stress_total AS REAL) / log_count AS mean_stress_level,
+            CAST(energy_total AS REAL) / log_count AS mean_energy_level,
+            symptom_log_count
+        FROM HealthLogRollup
+        WHERE user_id = ? AND period = ? AND period_start BETWEEN ? AND ?
+        ORDER BY period_start
+        """,
+        (user_id, period, start_date, end_date),
+    )
+    rows = _rows_to_dicts(cursor.fetchall())
+    return rows
+
+
 def get_latest_health_log(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT * FROM HealthLog WHERE user_id = ? ORDER BY date DESC, id DESC LIMIT 1",
         (user_id,),
     )
     log = _row_to_dict(cursor.fetchone())
-    conn.close()
     return log
 
 
 # CareBridge model operations
 
 def list_doctors():
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Doctor ORDER BY name ASC")
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def get_doctor(doctor_id):
-    conn = get_connection()
+    return _mapped_row("Doctor", doctor_id, lambda: _load_doctor(doctor_id))
+
+
+def _load_doctor(doctor_id):
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Doctor WHERE id = ?", (doctor_id,))
     row = _row_to_dict(cursor.fetchone())
-    conn.close()
     return row
 
 
 def get_doctor_by_email(email):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -256,12 +543,15 @@ def get_doctor_by_email(email):
         (email,),
     )
     row = _row_to_dict(cursor.fetchone())
-    conn.close()
     return row
 
 
 def get_portal_doctor(doctor_id):
-    conn = get_connection()
+    if _request_scope() is not None:
+        row = get_doctor(doctor_id)
+        return row if row and (row["is_portal_doctor"] or 0) == 1 else None
+
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -271,12 +561,11 @@ def get_portal_doctor(doctor_id):
         (doctor_id,),
     )
     row = _row_to_dict(cursor.fetchone())
-    conn.close()
     return row
 
 
 def create_doctor_account(name, email, password, specialization, hospital, created_at):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -311,12 +600,11 @@ def create_doctor_account(name, email, password, specialization, hospital, creat
     )
     conn.commit()
     doctor_id = cursor.lastrowid
-    conn.close()
     return doctor_id
 
 
 def connect_patient_to_doctor(doctor_id, patient_id, created_at):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -330,7 +618,6 @@ def connect_patient_to_doctor(doctor_id, patient_id, created_at):
     )
     existing = _row_to_dict(cursor.fetchone())
     if existing:
-        conn.close()
         return existing["id"]
 
     cursor.execute(
@@ -342,12 +629,11 @@ def connect_patient_to_doctor(doctor_id, patient_id, created_at):
     )
     conn.commit()
     link_id = cursor.lastrowid
-    conn.close()
     return link_id
 
 
 def get_pending_links_for_doctor(doctor_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -360,12 +646,11 @@ def get_pending_links_for_doctor(doctor_id):
         (doctor_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def approve_doctor_patient_link(link_id, doctor_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -376,11 +661,10 @@ def approve_doctor_patient_link(link_id, doctor_id):
         (link_id, doctor_id),
     )
     conn.commit()
-    conn.close()
 
 
 def get_approved_patients_for_doctor(doctor_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -401,12 +685,11 @@ def get_approved_patients_for_doctor(doctor_id):
         (doctor_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def is_doctor_linked_to_patient(doctor_id, patient_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -418,12 +701,11 @@ def is_doctor_linked_to_patient(doctor_id, patient_id):
         (doctor_id, patient_id),
     )
     linked = cursor.fetchone() is not None
-    conn.close()
     return linked
 
 
 def get_assessment_history_for_patient(user_id, limit=30):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -436,7 +718,6 @@ def get_assessment_history_for_patient(user_id, limit=30):
         (user_id, limit),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
@@ -450,7 +731,7 @@ def add_doctor_prescription(
     start_date,
     created_at,
 ):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -478,11 +759,10 @@ def add_doctor_prescription(
         ),
     )
     conn.commit()
-    conn.close()
 
 
 def get_patient_prescriptions(patient_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -495,7 +775,6 @@ def get_patient_prescriptions(patient_id):
         (patient_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
@@ -504,7 +783,7 @@ def get_prescriptions(user_id):
 
 
 def get_health_summary(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
 
     cursor.execute(
@@ -538,7 +817,6 @@ def get_health_summary(user_id):
     )
     latest_assessment = _row_to_dict(cursor.fetchone())
 
-    conn.close()
 
     return {
         "state": state,
@@ -547,7 +825,7 @@ def get_health_summary(user_id):
 
 
 def get_emergency_contacts(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
 
     cursor.execute(
@@ -582,12 +860,11 @@ def get_emergency_contacts(user_id):
     family_rows = _rows_to_dicts(cursor.fetchall())
     contacts.extend(family_rows)
 
-    conn.close()
     return contacts
 
 
 def get_doctor_patient_prescriptions(doctor_id, patient_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -599,12 +876,11 @@ def get_doctor_patient_prescriptions(doctor_id, patient_id):
         (doctor_id, patient_id),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def add_family_member(user_id, name, relationship, contact):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -614,23 +890,21 @@ def add_family_member(user_id, name, relationship, contact):
         (user_id, name, relationship, contact),
     )
     conn.commit()
-    conn.close()
 
 
 def get_family_members(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT * FROM FamilyMember WHERE user_id = ? ORDER BY id DESC",
         (user_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def link_patient_doctor(user_id, doctor_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT id FROM PatientDoctorLink WHERE user_id = ? AND doctor_id = ?",
@@ -646,11 +920,10 @@ def link_patient_doctor(user_id, doctor_id):
             (user_id, doctor_id),
         )
         conn.commit()
-    conn.close()
 
 
 def get_linked_patients_for_doctor(doctor_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -663,12 +936,11 @@ def get_linked_patients_for_doctor(doctor_id):
         (doctor_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def get_linked_doctors_for_user(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -681,12 +953,11 @@ def get_linked_doctors_for_user(user_id):
         (user_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def create_questionnaire(doctor_id, title, created_at):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -697,12 +968,11 @@ def create_questionnaire(doctor_id, title, created_at):
     )
     conn.commit()
     questionnaire_id = cursor.lastrowid
-    conn.close()
     return questionnaire_id
 
 
 def add_question(questionnaire_id, question_text):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -712,20 +982,18 @@ def add_question(questionnaire_id, question_text):
         (questionnaire_id, question_text),
     )
     conn.commit()
-    conn.close()
 
 
 def get_questionnaire(questionnaire_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Questionnaire WHERE id = ?", (questionnaire_id,))
     row = _row_to_dict(cursor.fetchone())
-    conn.close()
     return row
 
 
 def get_questionnaires_for_user(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -738,24 +1006,22 @@ def get_questionnaires_for_user(user_id):
         (user_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def get_questions_for_questionnaire(questionnaire_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT * FROM Question WHERE questionnaire_id = ? ORDER BY id ASC",
         (questionnaire_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def save_answer(question_id, user_id, answer_text, timestamp):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -765,11 +1031,10 @@ def save_answer(question_id, user_id, answer_text, timestamp):
         (question_id, user_id, answer_text, timestamp),
     )
     conn.commit()
-    conn.close()
 
 
 def get_answers_for_user(user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -782,12 +1047,26 @@ def get_answers_for_user(user_id):
         (user_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
+def count_answers_for_user(user_id):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT COUNT(*) AS answer_count
+        FROM Answer a
+        JOIN Question q ON q.id = a.question_id
+        WHERE a.user_id = ?
+        """,
+        (user_id,),
+    )
+    return cursor.fetchone()["answer_count"]
+
+
 def get_answer_map_for_questionnaire_user(questionnaire_id, user_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -800,7 +1079,6 @@ def get_answer_map_for_questionnaire_user(questionnaire_id, user_id):
         (questionnaire_id, user_id),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
 
     answer_map = {}
     for row in rows:
@@ -811,28 +1089,59 @@ def get_answer_map_for_questionnaire_user(questionnaire_id, user_id):
 
 
 def get_questionnaires_by_doctor(doctor_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT * FROM Questionnaire WHERE doctor_id = ? ORDER BY created_at DESC, id DESC",
         (doctor_id,),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 # Adaptive assessment model operations
 
 def get_patient_state_row(user_id):
-    conn = get_connection()
+    return _mapped_row("PatientState", user_id, lambda: _load_patient_state_row(user_id))
+
+
+def _load_patient_state_row(user_id):
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM PatientState WHERE user_id = ?", (user_id,))
     row = _row_to_dict(cursor.fetchone())
-    conn.close()
     return row
 
 
+_UPSERT_PATIENT_STATE_SQL = """
+    INSERT INTO PatientState (
+        user_id,
+        stress_score,
+        energy_score,
+        trend,
+        last_updated,
+        last_assessment_at,
+        next_assessment_due,
+        risk_level,
+        risk_probability,
+        risk_reason,
+        recommendation
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        stress_score = excluded.stress_score,
+        energy_score = excluded.energy_score,
+        trend = excluded.trend,
+        last_updated = excluded.last_updated,
+        last_assessment_at = excluded.last_assessment_at,
+        next_assessment_due = excluded.next_assessment_due,
+        risk_level = excluded.risk_level,
+        risk_probability = excluded.risk_probability,
+        risk_reason = excluded.risk_reason,
+        recommendation = excluded.recommendation
+"""
+
+
 def upsert_patient_state(
     user_id,
     stress_score,
@@ -846,36 +1155,10 @@ def upsert_patient_state(
     risk_reason=None,
     recommendation=None,
 ):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
-        """
-        INSERT INTO PatientState (
-            user_id,
-            stress_score,
-            energy_score,
-            trend,
-            last_updated,
-            last_assessment_at,
-            next_assessment_due,
-            risk_level,
-            risk_probability,
-            risk_reason,
-            recommendation
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            stress_score = excluded.stress_score,
-            energy_score = excluded.energy_score,
-            trend = excluded.trend,
-            last_updated = excluded.last_updated,
-            last_assessment_at = excluded.last_assessment_at,
-            next_assessment_due = excluded.next_assessment_due,
-            risk_level = excluded.risk_level,
-            risk_probability = excluded.risk_probability,
-            risk_reason = excluded.risk_reason,
-            recommendation = excluded.recommendation
-        """,
+        _UPSERT_PATIENT_STATE_SQL,
         (
             user_id,
             stress_score,
@@ -891,11 +1174,52 @@ def upsert_patient_state(
         ),
     )
     conn.commit()
-    conn.close()
+    _update_mapped_row(
+        "PatientState",
+        user_id,
+        {
+            "user_id": user_id,
+            "stress_score": stress_score,
+            "energy_score": energy_score,
+            "trend": trend,
+            "last_updated": last_updated,
+            "last_assessment_at": last_assessment_at,
+            "next_assessment_due": next_assessment_due,
+            "risk_level": risk_level,
+            "risk_probability": risk_probability,
+            "risk_reason": risk_reason,
+            "recommendation": recommendation,
+        },
+        complete=True,
+    )
+
+
+def save_patient_risk(user_id, risk_level, risk_probability, risk_reason, recommendation):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE PatientState
+        SET risk_level = ?, risk_probability = ?, risk_reason = ?, recommendation = ?
+        WHERE user_id = ?
+        """,
+        (risk_level, risk_probability, risk_reason, recommendation, user_id),
+    )
+    conn.commit()
+    _update_mapped_row(
+        "PatientState",
+        user_id,
+        {
+            "risk_level": risk_level,
+            "risk_probability": risk_probability,
+            "risk_reason": risk_reason,
+            "recommendation": recommendation,
+        },
+    )
 
 
 def list_question_bank(condition=None, category=None):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
 
     query = "SELECT * FROM QuestionBank WHERE 1=1"
@@ -911,21 +1235,34 @@ def list_question_bank(condition=None, category=None):
     query += " ORDER BY weight DESC, id ASC"
     cursor.execute(query, tuple(params))
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
 def get_question_bank_item(question_id):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM QuestionBank WHERE id = ?", (question_id,))
     row = _row_to_dict(cursor.fetchone())
-    conn.close()
     return row
 
 
+def get_question_bank_items(question_ids):
+    unique_ids = sorted({int(question_id) for question_id in question_ids})
+    if not unique_ids:
+        return {}
+
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    placeholders = ", ".join("?" for _ in unique_ids)
+    cursor.execute(
+        f"SELECT * FROM QuestionBank WHERE id IN ({placeholders})",
+        tuple(unique_ids),
+    )
+    return {row["id"]: row for row in _rows_to_dicts(cursor.fetchall())}
+
+
 def save_patient_answer(user_id, question_id, answer_value, timestamp):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -935,11 +1272,10 @@ def save_patient_answer(user_id, question_id, answer_value, timestamp):
         (user_id, question_id, answer_value, timestamp),
     )
     conn.commit()
-    conn.close()
 
 
 def get_recent_patient_answers(user_id, limit=20):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -953,12 +1289,56 @@ def get_recent_patient_answers(user_id, limit=20):
         (user_id, limit),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return rows
 
 
+def get_patient_dashboard_rows(user_id, health_log_limit, recent_answer_limit=20):
+    """
+    Every row the patient dashboard reads, fetched back to back on the shared connection:
+    medicines, prescriptions, the newest health logs, the PatientState row (or None) and
+    the most recent adaptive answers.
+    """
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM Medicine WHERE user_id = ?", (user_id,))
+    medicines = _rows_to_dicts(cursor.fetchall())
+    cursor.execute(
+        """
+        SELECT dp.*, d.name AS doctor_name
+        FROM DoctorPrescription dp
+        LEFT JOIN Doctor d ON d.id = dp.doctor_id
+        WHERE dp.patient_id = ?
+        ORDER BY dp.created_at DESC, dp.id DESC
+        """,
+        (user_id,),
+    )
+    prescriptions = _rows_to_dicts(cursor.fetchall())
+    health_logs = get_health_logs_page(user_id, health_log_limit)
+    cursor.execute("SELECT * FROM PatientState WHERE user_id = ?", (user_id,))
+    state = _row_to_dict(cursor.fetchone())
+    cursor.execute(
+        """
+        SELECT pa.*, qb.category, qb.weight, qb.condition
+        FROM PatientAnswer pa
+        JOIN QuestionBank qb ON qb.id = pa.question_id
+        WHERE pa.user_id = ?
+        ORDER BY pa.timestamp DESC, pa.id DESC
+        LIMIT ?
+        """,
+        (user_id, recent_answer_limit),
+    )
+    recent_answers = _rows_to_dicts(cursor.fetchall())
+    return {
+        "medicines": medicines,
+        "prescriptions": prescriptions,
+        "health_logs": health_logs,
+        "state": state,
+        "recent_answers": recent_answers,
+    }
+
+
 def add_assessment_history(user_id, question, answer):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -968,11 +1348,10 @@ def add_assessment_history(user_id, question, answer):
         (user_id, question, answer),
     )
     conn.commit()
-    conn.close()
 
 
 def get_assessment_history_questions(user_id, limit=10):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -985,12 +1364,11 @@ def get_assessment_history_questions(user_id, limit=10):
         (user_id, limit),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return [row["question"] for row in rows]
 
 
 def get_assessment_history_entries(user_id, limit=10):
-    conn = get_connection()
+    conn = get_shared_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -1003,8 +1381,546 @@ def get_assessment_history_entries(user_id, limit=10):
         (user_id, limit),
     )
     rows = _rows_to_dicts(cursor.fetchall())
-    conn.close()
     return [
-        f"Q: {row['question']} | A: {row['answer']} | At: {row['timestamp']}"
+        format_assessment_history_entry(row["question"], row["answer"], row["timestamp"])
         for row in rows
     ]
+
+
+def format_assessment_history_entry(question, answer, timestamp):
+    return f"Q: {question} | A: {answer} | At: {timestamp}"
+
+
+def save_assessment_submission(
+    user_id,
+    patient_answers,
+    history_entries,
+    answered_at,
+    stress_score,
+    energy_score,
+    trend,
+    next_assessment_due,
+    risk_level,
+    risk_probability,
+    risk_reason,
+    recommendation,
+):
+    """
+    Record one adaptive assessment in a single transaction:
+    - patient_answers: (question_bank_id, answer_value) pairs for PatientAnswer
+    - history_entries: (question_text, answer_value) pairs for AssessmentHistory
+    - the resulting PatientState
+    Either everything is written or nothing is.
+    """
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            """
+            INSERT INTO PatientAnswer (user_id, question_id, answer_value, timestamp)
+            VALUES (?, ?, ?, ?)
+            """,
+            [
+                (user_id, question_id, answer_value, answered_at)
+                for question_id, answer_value in patient_answers
+            ],
+        )
+        cursor.executemany(
+            """
+            INSERT INTO AssessmentHistory (user_id, question, answer)
+            VALUES (?, ?, ?)
+            """,
+            [(user_id, question, answer) for question, answer in history_entries],
+        )
+        cursor.execute(
+            _UPSERT_PATIENT_STATE_SQL,
+            (
+                user_id,
+                stress_score,
+                energy_score,
+                trend,
+                answered_at,
+                answered_at,
+                next_assessment_due,
+                risk_level,
+                risk_probability,
+                risk_reason,
+                recommendation,
+            ),
+        )
+    _update_mapped_row(
+        "PatientState",
+        user_id,
+        {
+            "user_id": user_id,
+            "stress_score": stress_score,
+            "energy_score": energy_score,
+            "trend": trend,
+            "last_updated": answered_at,
+            "last_assessment_at": answered_at,
+            "next_assessment_due": next_assessment_due,
+            "risk_level": risk_level,
+            "risk_probability": risk_probability,
+            "risk_reason": risk_reason,
+            "recommendation": recommendation,
+        },
+        complete=True,
+    )
+
+
+# Patient summary cache operations
+
+def get_cached_patient_summary(user_id):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM PatientSummaryCache WHERE user_id = ?", (user_id,))
+    row = _row_to_dict(cursor.fetchone())
+    return row
+
+
+def save_cached_patient_summary(user_id, fingerprint, summary, created_at):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO PatientSummaryCache (user_id, fingerprint, summary, created_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            fingerprint = excluded.fingerprint,
+            summary = excluded.summary,
+            created_at = excluded.created_at
+        """,
+        (user_id, fingerprint, summary, created_at),
+    )
+    conn.commit()
+
+
+# Adaptive question set operations
+
+def get_adaptive_question_set(user_id, due_key):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT * FROM AdaptiveQuestionSet WHERE user_id = ? AND due_key = ?",
+        (user_id, due_key),
+    )
+    row = _row_to_dict(cursor.fetchone())
+    return row
+
+
+def save_adaptive_question_set(user_id, due_key, questions, created_at):
+    """
+    Store the question set for (user_id, due_key) unless one is already there, drop the
+    patient's sets for earlier due keys, and return the stored row. The first writer
+    wins so every request for the same assessment sees the same questions.
+    """
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM AdaptiveQuestionSet WHERE user_id = ? AND due_key != ?",
+            (user_id, due_key),
+        )
+        cursor.execute(
+            """
+            INSERT INTO AdaptiveQuestionSet (user_id, due_key, questions, created_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, due_key) DO NOTHING
+            """,
+            (user_id, due_key, questions, created_at),
+        )
+        cursor.execute(
+            "SELECT * FROM AdaptiveQuestionSet WHERE user_id = ? AND due_key = ?",
+            (user_id, due_key),
+        )
+        return _row_to_dict(cursor.fetchone())
+
+
+def list_users_missing_question_sets(due_before):
+    """
+    Patients whose next assessment is due before due_before (or who never took one) and
+    have no question set for it yet, as (user_id, due_key) rows.
+    """
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT u.id AS user_id, COALESCE(ps.next_assessment_due, '') AS due_key
+        FROM User u
+        LEFT JOIN PatientState ps ON ps.user_id = u.id
+        WHERE (ps.next_assessment_due IS NULL OR ps.next_assessment_due <= ?)
+            AND NOT EXISTS (
+                SELECT 1
+                FROM AdaptiveQuestionSet aqs
+                WHERE aqs.user_id = u.id
+                    AND aqs.due_key = COALESCE(ps.next_assessment_due, '')
+            )
+        ORDER BY u.id
+        """,
+        (due_before,),
+    )
+    rows = _rows_to_dicts(cursor.fetchall())
+    return rows
+
+
+# Overpass tile cache operations
+
+def get_overpass_tile(tile_key):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM OverpassTileCache WHERE tile_key = ?", (tile_key,))
+    row = _row_to_dict(cursor.fetchone())
+    return row
+
+
+def save_overpass_tile(tile_key, elements, fetched_at):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO OverpassTileCache (tile_key, elements, fetched_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(tile_key) DO UPDATE SET
+            elements = excluded.elements,
+            fetched_at = excluded.fetched_at
+        """,
+        (tile_key, elements, fetched_at),
+    )
+    conn.commit()
+
+
+# Shared cache operations
+
+def get_cache_entry(namespace, cache_key):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT * FROM CacheEntry WHERE namespace = ? AND cache_key = ?",
+        (namespace, cache_key),
+    )
+    row = _row_to_dict(cursor.fetchone())
+    return row
+
+
+def save_cache_entry(namespace, cache_key, value, expires_at, updated_at):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO CacheEntry (namespace, cache_key, value, expires_at, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(namespace, cache_key) DO UPDATE SET
+            value = excluded.value,
+            expires_at = excluded.expires_at,
+            updated_at = excluded.updated_at
+        """,
+        (namespace, cache_key, value, expires_at, updated_at),
+    )
+    conn.commit()
+
+
+def list_cache_entries(namespace, now, limit):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT cache_key, value, expires_at
+        FROM CacheEntry
+        WHERE namespace = ? AND expires_at > ?
+        ORDER BY updated_at DESC
+        LIMIT ?
+        """,
+        (namespace, now, limit),
+    )
+    rows = _rows_to_dicts(cursor.fetchall())
+    return rows
+
+
+def delete_cache_namespace(namespace):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM CacheEntry WHERE namespace = ?", (namespace,))
+    conn.commit()
+    return cursor.rowcount
+
+
+def trim_cache_namespace(namespace, max_entries):
+    """Delete all but the max_entries most recently written entries of a namespace."""
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        DELETE FROM CacheEntry
+        WHERE namespace = ?
+            AND updated_at <= (
+                SELECT updated_at
+                FROM CacheEntry
+                WHERE namespace = ?
+                ORDER BY updated_at DESC
+                LIMIT 1 OFFSET ?
+            )
+        """,
+        (namespace, namespace, max_entries),
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def delete_expired_cache_entries(now):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM CacheEntry WHERE expires_at <= ?", (now,))
+    conn.commit()
+    return cursor.rowcount
+
+
+# Gazetteer operations
+
+def find_gazetteer_places(name, limit=5):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT DISTINCT GazetteerPlace.*
+        FROM GazetteerName
+        JOIN GazetteerPlace ON GazetteerPlace.id = GazetteerName.place_id
+        WHERE GazetteerName.name = ?
+        ORDER BY GazetteerPlace.population DESC, GazetteerPlace.id
+        LIMIT ?
+        """,
+        (name, limit),
+    )
+    rows = _rows_to_dicts(cursor.fetchall())
+    return rows
+
+
+def find_gazetteer_places_by_prefix(prefix, limit=5):
+    # A range over the name index; U+10FFFF sorts after every character a name can hold.
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT DISTINCT GazetteerPlace.*
+        FROM GazetteerName
+        JOIN GazetteerPlace ON GazetteerPlace.id = GazetteerName.place_id
+        WHERE GazetteerName.name >= ? AND GazetteerName.name < ?
+        ORDER BY GazetteerPlace.population DESC, GazetteerPlace.id
+        LIMIT ?
+        """,
+        (prefix, prefix + "\U0010ffff", limit),
+    )
+    rows = _rows_to_dicts(cursor.fetchall())
+    return rows
+
+
+def find_gazetteer_names_by_trigrams(trigrams, limit=50):
+    """
+    Names sharing the most trigrams with the query, as dicts with name, place_id,
+    population and shared (the number of trigrams in common).
+    """
+    if not trigrams:
+        return []
+
+    placeholders = ", ".join("?" for _ in trigrams)
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT GazetteerName.name, GazetteerName.place_id, GazetteerPlace.population,
+               matches.shared
+        FROM (
+            SELECT name_id, COUNT(*) AS shared
+            FROM GazetteerTrigram
+            WHERE trigram IN ({placeholders})
+            GROUP BY name_id
+            ORDER BY shared DESC
+            LIMIT ?
+        ) AS matches
+        JOIN GazetteerName ON GazetteerName.id = matches.name_id
+        JOIN GazetteerPlace ON GazetteerPlace.id = GazetteerName.place_id
+        ORDER BY matches.shared DESC
+        """,
+        (*trigrams, limit),
+    )
+    rows = _rows_to_dicts(cursor.fetchall())
+    return rows
+
+
+def get_gazetteer_place(place_id):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM GazetteerPlace WHERE id = ?", (place_id,))
+    row = _row_to_dict(cursor.fetchone())
+    return row
+
+
+def replace_gazetteer(places, names, trigrams):
+    """
+    Swap the whole gazetteer in one transaction. places, names and trigrams are
+    iterables of GazetteerPlace, GazetteerName and GazetteerTrigram row tuples.
+    """
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM GazetteerTrigram")
+        cursor.execute("DELETE FROM GazetteerName")
+        cursor.execute("DELETE FROM GazetteerPlace")
+        cursor.executemany(
+            """
+            INSERT INTO GazetteerPlace (id, name, country_code, admin1, latitude, longitude, population)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            places,
+        )
+        cursor.executemany(
+            "INSERT INTO GazetteerName (id, place_id, name) VALUES (?, ?, ?)",
+            names,
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO GazetteerTrigram (trigram, name_id) VALUES (?, ?)",
+            trigrams,
+        )
+
+
+# Background job operations
+
+def enqueue_job(kind, payload, dedupe_key, max_attempts, run_after, now):
+    """
+    Insert a queued job and return its id. When a job with the same dedupe_key is
+    still queued, that job takes the new payload and its id is returned instead.
+    """
+    with transaction() as conn:
+        cursor = conn.cursor()
+        if dedupe_key is not None:
+            cursor.execute(
+                """
+                SELECT id FROM Job
+                WHERE dedupe_key = ? AND status = 'queued'
+                ORDER BY id
+                LIMIT 1
+                """,
+                (dedupe_key,),
+            )
+            row = cursor.fetchone()
+            if row:
+                cursor.execute(
+                    "UPDATE Job SET payload = ?, updated_at = ? WHERE id = ?",
+                    (payload, now, row["id"]),
+                )
+                return row["id"]
+
+        cursor.execute(
+            """
+            INSERT INTO Job (kind, payload, dedupe_key, max_attempts, run_after, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (kind, payload, dedupe_key, max_attempts, run_after, now, now),
+        )
+        return cursor.lastrowid
+
+
+def lease_job(lease_owner, leased_until, now):
+    """
+    Claim the next due job for lease_owner until leased_until and return it, or None.
+    Jobs whose lease ran out (their worker died) are first put back in the queue, or
+    failed once they have used every attempt.
+    """
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE Job
+            SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                error = 'lease expired',
+                lease_owner = NULL,
+                leased_until = NULL,
+                run_after = ?,
+                updated_at = ?
+            WHERE status = 'running' AND leased_until <= ?
+            """,
+            (now, now, now),
+        )
+        cursor.execute(
+            """
+            SELECT id FROM Job
+            WHERE status = 'queued' AND run_after <= ?
+            ORDER BY run_after, id
+            LIMIT 1
+            """,
+            (now,),
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None
+        cursor.execute(
+            """
+            UPDATE Job
+            SET status = 'running',
+                attempts = attempts + 1,
+                lease_owner = ?,
+                leased_until = ?,
+                updated_at = ?
+            WHERE id = ?
+            """,
+            (lease_owner, leased_until, now, row["id"]),
+        )
+        cursor.execute("SELECT * FROM Job WHERE id = ?", (row["id"],))
+        return _row_to_dict(cursor.fetchone())
+
+
+def finish_job(job_id, lease_owner, status, result, error, run_after, now):
+    """
+    Record the outcome of a leased job: status 'done' or 'failed', or 'queued' to retry
+    at run_after. Ignored (returns False) when lease_owner no longer holds the lease.
+    """
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE Job
+        SET status = ?,
+            result = ?,
+            error = ?,
+            run_after = ?,
+            lease_owner = NULL,
+            leased_until = NULL,
+            updated_at = ?
+        WHERE id = ? AND status = 'running' AND lease_owner = ?
+        """,
+        (status, result, error, run_after, now, job_id, lease_owner),
+    )
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def get_job(job_id):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM Job WHERE id = ?", (job_id,))
+    row = _row_to_dict(cursor.fetchone())
+    return row
+
+
+def get_latest_job(dedupe_key, status=None):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    if status is None:
+        cursor.execute(
+            "SELECT * FROM Job WHERE dedupe_key = ? ORDER BY id DESC LIMIT 1",
+            (dedupe_key,),
+        )
+    else:
+        cursor.execute(
+            "SELECT * FROM Job WHERE dedupe_key = ? AND status = ? ORDER BY id DESC LIMIT 1",
+            (dedupe_key, status),
+        )
+    row = _row_to_dict(cursor.fetchone())
+    return row
+
+
+def delete_finished_jobs(before):
+    conn = get_shared_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM Job WHERE status IN ('done', 'failed') AND updated_at < ?",
+        (before,),
+    )
+    conn.commit()
+    return cursor.rowcount
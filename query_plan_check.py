@@ -0,0 +1,147 @@
+"""
+Regression check for index coverage of the models.py queries.
+
+Runs every hot model lookup against a fresh database, captures the SQL it issues and
+fails (exit status 1) if EXPLAIN QUERY PLAN reports a full table scan for any of them.
+
+Usage:
+    python query_plan_check.py
+"""
+import os
+import sys
+import tempfile
+
+import database
+import models
+
+# Intentionally unfiltered listings (list_hospitals, list_located_hospitals, list_doctors,
+# list_question_bank()) read every row by design and are not part of this check.
+HOT_LOOKUPS = [
+    (models.get_user, (1,)),
+    (models.get_hospital, (1,)),
+    (models.list_emergency_hospitals, ()),
+    (models.get_doctors_by_hospital, (1,)),
+    (models.get_doctors_for_specialization, ("cardiology",)),
+    (models.get_user_medicines, (1,)),
+    (models.get_health_logs, (1,)),
+    (models.get_health_logs_page, (1, 20, ("2024-01-01", 10))),
+    (models.get_health_log_series, (1, "day", "2024-01-01", "2024-03-31")),
+    (models.get_latest_health_log, (1,)),
+    (models.get_doctor, (1,)),
+    (models.get_doctor_by_email, ("doctor@example.com",)),
+    (models.get_portal_doctor, (1,)),
+    (models.connect_patient_to_doctor, (1, 1, "2024-01-01T00:00:00")),
+    (models.get_pending_links_for_doctor, (1,)),
+    (models.get_approved_patients_for_doctor, (1,)),
+    (models.is_doctor_linked_to_patient, (1, 1)),
+    (models.get_assessment_history_for_patient, (1,)),
+    (models.get_patient_prescriptions, (1,)),
+    (models.get_health_summary, (1,)),
+    (models.get_emergency_contacts, (1,)),
+    (models.get_doctor_patient_prescriptions, (1, 1)),
+    (models.get_family_members, (1,)),
+    (models.link_patient_doctor, (1, 1)),
+    (models.get_linked_patients_for_doctor, (1,)),
+    (models.get_linked_doctors_for_user, (1,)),
+    (models.get_questionnaire, (1,)),
+    (models.get_questionnaires_for_user, (1,)),
+    (models.get_questions_for_questionnaire, (1,)),
+    (models.get_answers_for_user, (1,)),
+    (models.count_answers_for_user, (1,)),
+    (models.get_patient_dashboard_rows, (1, 5)),
+    (models.get_answer_map_for_questionnaire_user, (1, 1)),
+    (models.get_questionnaires_by_doctor, (1,)),
+    (models.get_patient_state_row, (1,)),
+    (models.list_question_bank, ("cardiology",)),
+    (models.list_question_bank, ("cardiology", "stress")),
+    (models.get_question_bank_item, (1,)),
+    (models.get_question_bank_items, ([1, 2],)),
+    (models.get_recent_patient_answers, (1,)),
+    (models.get_assessment_history_questions, (1,)),
+    (models.get_assessment_history_entries, (1,)),
+    (models.get_cached_patient_summary, (1,)),
+    (models.get_overpass_tile, ("0.05:259:1551:15000",)),
+    (models.get_cache_entry, ("geocode", "bengaluru")),
+    (models.list_cache_entries, ("geocode", 0, 100)),
+    (models.trim_cache_namespace, ("llm_response", 5000)),
+    (models.find_gazetteer_places, ("bengaluru",)),
+    (models.find_gazetteer_places_by_prefix, ("beng",)),
+    (models.find_gazetteer_names_by_trigrams, (["  b", " be", "ben"],)),
+    (models.get_gazetteer_place, (1277333,)),
+    (models.get_data_version, ("Hospital",)),
+    (models.enqueue_job, ("patient_summary", "{}", "patient_summary:1", 5, 0.0, 0.0)),
+    (models.lease_job, ("worker", 120.0, 0.0)),
+    (models.get_adaptive_question_set, (1, "")),
+    (models.get_job, (1,)),
+    (models.get_latest_job, ("patient_summary:1",)),
+    (models.get_latest_job, ("patient_summary:1", "done")),
+]
+
+
+def _full_scan_steps(conn, sql):
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    # Reading back a bounded subquery result ("SCAN matches") is not a table scan.
+    derived = {"CONSTANT ROW"}
+    for row in rows:
+        for prefix in ("MATERIALIZE ", "CO-ROUTINE "):
+            if row["detail"].startswith(prefix):
+                derived.add(row["detail"][len(prefix):])
+    return [
+        row["detail"]
+        for row in rows
+        if row["detail"].startswith("SCAN ") and row["detail"][len("SCAN "):] not in derived
+    ]
+
+
+def find_full_scans():
+    """
+    Return (function name, sql, plan step) for every hot lookup that scans a whole table.
+    """
+    handle, path = tempfile.mkstemp(prefix="carematch-plan-", suffix=".db")
+    os.close(handle)
+    os.remove(path)
+
+    previous_path = database.DB_PATH
+    database.release_shared_connection()
+    database.DB_PATH = path
+    try:
+        database.init_db()
+        conn = database.get_shared_connection()
+
+        failures = []
+        for fn, args in HOT_LOOKUPS:
+            statements = []
+            database.add_statement_listener(statements.append)
+            try:
+                fn(*args)
+            finally:
+                database.remove_statement_listener(statements.append)
+
+            for sql in statements:
+                if not sql.lstrip().upper().startswith("SELECT"):
+                    continue
+                for step in _full_scan_steps(conn, sql):
+                    failures.append((fn.__name__, " ".join(sql.split()), step))
+        return failures
+    finally:
+        database.release_shared_connection()
+        database.close_idle_connections()
+        database.DB_PATH = previous_path
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    failures = find_full_scans()
+    for name, sql, step in failures:
+        print(f"{name}: {step}\n    {sql}")
+    if failures:
+        print(f"{len(failures)} full scan(s) found.")
+        return 1
+    print(f"All {len(HOT_LOOKUPS)} hot lookups use an index.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,31 @@
+import heapq
+import math
+import os
+
 from geolocation_service import distance_score_from_km, haversine_distance_km
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Below this many candidates the per-row Python loop beats array setup.
+SCORING_NUMPY_MIN_BATCH = int(os.environ.get("SCORING_NUMPY_MIN_BATCH", "256"))
+
+# distance_score_from_km bucket edges; NumPy distances this close to one are recomputed
+# with haversine_distance_km so both paths land in the same bucket.
+_DISTANCE_BUCKET_EDGES_KM = (2.0, 10.0, 25.0, 50.0)
+_DISTANCE_EDGE_TOLERANCE_KM = 1e-9
+
+# Neutral scores for a missing input, shared with emergency_engine: a hospital or patient
+# without coordinates, and an imported hospital nobody has rated.
+UNLOCATED_DISTANCE_SCORE = 0.5
+UNRATED_RATING_SCORE = 0.5
+
 
 def _calculate_distance_score(user_lat, user_lon, hospital_lat, hospital_lon):
     if None in (user_lat, user_lon, hospital_lat, hospital_lon):
-        return 0.5
+        return UNLOCATED_DISTANCE_SCORE
     distance_km = haversine_distance_km(user_lat, user_lon, hospital_lat, hospital_lon)
     return distance_score_from_km(distance_km)
 
@@ -20,6 +42,8 @@ def _calculate_specialty_match_score(user_condition, hospital_specialties):
 
 
 def _calculate_rating_score(hospital_rating):
+    if hospital_rating is None:
+        return UNRATED_RATING_SCORE
     return min(1.0, max(0.0, float(hospital_rating) / 5.0))
 
 
@@ -31,6 +55,50 @@ def _calculate_doctor_availability_score(doctors):
     return 1.0 if doctors else 0.0
 
 
+def _combine_scores(distance_score, specialty_match_score, rating_score, emergency_capability_score):
+    return (
+        0.30 * distance_score
+        + 0.30 * specialty_match_score
+        + 0.25 * rating_score
+        + 0.15 * emergency_capability_score
+    )
+
+
+def _score_result(
+    hospital,
+    hospital_specialties,
+    distance_km,
+    distance_score,
+    specialty_match_score,
+    rating_score,
+    emergency_capability_score,
+    doctor_availability_score,
+    final_score,
+):
+    components = {
+        "distance": round(distance_score, 4),
+        "specialization_match": round(specialty_match_score, 4),
+        "emergency_capability": round(emergency_capability_score, 4),
+        "doctor_availability": round(doctor_availability_score, 4),
+        "rating": round(rating_score, 4),
+    }
+    return {
+        "hospital_id": hospital["id"],
+        "hospital_name": hospital["name"],
+        "location": hospital["location"],
+        "specialization": hospital.get("specialization") or hospital_specialties,
+        "specialties": hospital_specialties,
+        "rating": hospital["rating"],
+        "avg_cost": hospital["avg_cost"],
+        "emergency_capable": int(hospital["emergency_capable"] or 0),
+        "source": hospital.get("source", "database"),
+        "distance_km": round(distance_km, 2) if distance_km is not None else hospital.get("distance_km"),
+        "score": round(final_score, 4),
+        "score_components": components,
+        "components": dict(components),
+    }
+
+
 def calculate_hospital_score(
     user,
     hospital,
@@ -47,50 +115,31 @@ def calculate_hospital_score(
     - rating
     - emergency capability
     """
-    distance_score = _calculate_distance_score(user_lat, user_lon, hospital_lat, hospital_lon)
     distance_km = None
+    distance_score = UNLOCATED_DISTANCE_SCORE
     if None not in (user_lat, user_lon, hospital_lat, hospital_lon):
         distance_km = haversine_distance_km(user_lat, user_lon, hospital_lat, hospital_lon)
+        distance_score = distance_score_from_km(distance_km)
     hospital_specialties = hospital.get("specialties") or hospital.get("specialization") or "general"
     specialty_match_score = _calculate_specialty_match_score(user["condition"], hospital_specialties)
     rating_score = _calculate_rating_score(hospital["rating"])
     emergency_capability_score = _calculate_emergency_capability_score(hospital)
     doctor_availability_score = _calculate_doctor_availability_score(doctors or [])
 
-    final_score = (
-        0.30 * distance_score
-        + 0.30 * specialty_match_score
-        + 0.25 * rating_score
-        + 0.15 * emergency_capability_score
+    final_score = _combine_scores(
+        distance_score, specialty_match_score, rating_score, emergency_capability_score
+    )
+    return _score_result(
+        hospital,
+        hospital_specialties,
+        distance_km,
+        distance_score,
+        specialty_match_score,
+        rating_score,
+        emergency_capability_score,
+        doctor_availability_score,
+        final_score,
     )
-
-    return {
-        "hospital_id": hospital["id"],
-        "hospital_name": hospital["name"],
-        "location": hospital["location"],
-        "specialization": hospital.get("specialization") or hospital_specialties,
-        "specialties": hospital_specialties,
-        "rating": hospital["rating"],
-        "avg_cost": hospital["avg_cost"],
-        "emergency_capable": int(hospital["emergency_capable"] or 0),
-        "source": hospital.get("source", "database"),
-        "distance_km": round(distance_km, 2) if distance_km is not None else hospital.get("distance_km"),
-        "score": round(final_score, 4),
-        "score_components": {
-            "distance": round(distance_score, 4),
-            "specialization_match": round(specialty_match_score, 4),
-            "emergency_capability": round(emergency_capability_score, 4),
-            "doctor_availability": round(doctor_availability_score, 4),
-            "rating": round(rating_score, 4),
-        },
-        "components": {
-            "distance": round(distance_score, 4),
-            "specialization_match": round(specialty_match_score, 4),
-            "emergency_capability": round(emergency_capability_score, 4),
-            "doctor_availability": round(doctor_availability_score, 4),
-            "rating": round(rating_score, 4),
-        },
-    }
 
 
 def rank_hospitals(user, hospitals, doctors_by_hospital):
@@ -104,6 +153,121 @@ def rank_hospitals(user, hospitals, doctors_by_hospital):
     )
 
 
+def _batch_columns(user, hospitals, user_lat, user_lon, hospital_coords_by_id):
+    """
+    Per-hospital specialties, specialty match scores and (lat, lon) pairs as parallel
+    lists. Specialty matches are computed once per distinct specialization string.
+    """
+    specialties = [
+        hospital.get("specialties") or hospital.get("specialization") or "general"
+        for hospital in hospitals
+    ]
+    specialty_scores = {
+        value: _calculate_specialty_match_score(user["condition"], value) for value in set(specialties)
+    }
+    specialty_match = [specialty_scores[value] for value in specialties]
+
+    missing = (None, None)
+    if user_lat is None or user_lon is None:
+        coordinates = [missing] * len(hospitals)
+    else:
+        coordinates = [hospital_coords_by_id.get(hospital["id"], missing) for hospital in hospitals]
+    return specialties, specialty_match, coordinates
+
+
+def _python_batch(user_lat, user_lon, hospitals, specialty_match, coordinates):
+    distances = []
+    distance_scores = []
+    final_scores = []
+    for index, hospital in enumerate(hospitals):
+        distance_km = None
+        distance_score = UNLOCATED_DISTANCE_SCORE
+        hospital_lat, hospital_lon = coordinates[index]
+        if hospital_lat is not None and hospital_lon is not None:
+            distance_km = haversine_distance_km(user_lat, user_lon, hospital_lat, hospital_lon)
+            distance_score = distance_score_from_km(distance_km)
+        distances.append(distance_km)
+        distance_scores.append(distance_score)
+        final_scores.append(
+            _combine_scores(
+                distance_score,
+                specialty_match[index],
+                _calculate_rating_score(hospital["rating"]),
+                _calculate_emergency_capability_score(hospital),
+            )
+        )
+    return distances, distance_scores, final_scores
+
+
+def _numpy_batch(user_lat, user_lon, hospitals, specialty_match, coordinates):
+    # None becomes NaN under dtype=float.
+    pairs = np.array(coordinates, dtype=float).reshape(len(coordinates), 2)
+    lat2 = pairs[:, 0]
+    lon2 = pairs[:, 1]
+    located = ~(np.isnan(lat2) | np.isnan(lon2))
+
+    distances = np.full(len(coordinates), math.nan)
+    if user_lat is not None and user_lon is not None and located.any():
+        # Same formula and operation order as haversine_distance_km.
+        lat1 = float(user_lat)
+        lon1 = float(user_lon)
+        d_lat = np.radians(lat2[located] - lat1)
+        d_lon = np.radians(lon2[located] - lon1)
+        a = np.sin(d_lat / 2) ** 2 + math.cos(math.radians(lat1)) * np.cos(
+            np.radians(lat2[located])
+        ) * np.sin(d_lon / 2) ** 2
+        distances[located] = 6371.0 * (2 * np.arcsin(np.sqrt(a)))
+
+        # Vector sin/cos may differ from libm in the last bit; settle bucket edges exactly.
+        near_edge = np.zeros(len(coordinates), dtype=bool)
+        for edge in _DISTANCE_BUCKET_EDGES_KM:
+            near_edge |= np.abs(distances - edge) <= _DISTANCE_EDGE_TOLERANCE_KM
+        for index in np.flatnonzero(near_edge):
+            distances[index] = haversine_distance_km(user_lat, user_lon, *coordinates[index])
+    else:
+        located[:] = False
+
+    distance_scores = np.select(
+        [
+            ~located,
+            distances <= 2,
+            distances <= 10,
+            distances <= 25,
+            distances <= 50,
+        ],
+        [UNLOCATED_DISTANCE_SCORE, 1.0, 0.9, 0.75, 0.6],
+        default=0.4,
+    )
+    ratings = np.array(
+        [
+            UNRATED_RATING_SCORE * 5.0 if hospital["rating"] is None else hospital["rating"]
+            for hospital in hospitals
+        ],
+        dtype=float,
+    )
+    emergency = np.array([int(hospital["emergency_capable"] or 0) for hospital in hospitals]) == 1
+    final_scores = _combine_scores(
+        distance_scores,
+        np.array(specialty_match),
+        np.minimum(1.0, np.maximum(0.0, ratings / 5.0)),
+        emergency.astype(float),
+    )
+    return distances, located, distance_scores, final_scores
+
+
+def _top_indices(final_scores, rounded_score, top_k):
+    """
+    Indices of the best rows in the order the per-row path produces: rounded score
+    descending, ties kept in input order.
+    """
+    count = len(final_scores)
+    if top_k is None or top_k >= count:
+        return sorted(range(count), key=lambda index: (-rounded_score(index), index))
+    if top_k <= 0:
+        return []
+    return heapq.nsmallest(top_k, range(count), key=lambda index: (-rounded_score(index), index))
+
+
 def rank_hospitals_with_location(
     user,
     hospitals,
@@ -111,22 +275,73 @@ def rank_hospitals_with_location(
     user_lat,
     user_lon,
     hospital_coords_by_id,
+    top_k=None,
 ):
-    ranked = []
+    """
+    Score every candidate and return them best first (only the best top_k when set).
+    Large candidate sets are scored over NumPy arrays when it is installed; results are
+    identical to calling calculate_hospital_score on each hospital.
+    """
+    hospitals = list(hospitals)
     hospital_coords_by_id = hospital_coords_by_id or {}
-    for hospital in hospitals:
-        doctors = doctors_by_hospital.get(hospital["id"], [])
-        hospital_lat, hospital_lon = hospital_coords_by_id.get(hospital["id"], (None, None))
+    if user_lat is None or user_lon is None:
+        user_lat = user_lon = None
+
+    specialties, specialty_match, coordinates = _batch_columns(
+        user, hospitals, user_lat, user_lon, hospital_coords_by_id
+    )
+
+    if np is not None and len(hospitals) >= SCORING_NUMPY_MIN_BATCH:
+        distances, located, distance_scores, final_scores = _numpy_batch(
+            user_lat, user_lon, hospitals, specialty_match, coordinates
+        )
+        if top_k is not None and 0 < top_k < len(hospitals):
+            # Rounding to 4 places moves a score by at most 5e-5, so anything that can
+            # still reach the top_k after rounding is within 1e-4 of the k-th raw score.
+            kth_score = np.partition(final_scores, len(hospitals) - top_k)[len(hospitals) - top_k]
+            candidates = np.flatnonzero(final_scores >= kth_score - 1e-4)
+            order = _top_indices(
+                final_scores[candidates],
+                lambda position: round(float(final_scores[candidates[position]]), 4),
+                top_k,
+            )
+            selected = [int(candidates[position]) for position in order]
+        else:
+            selected = _top_indices(final_scores, lambda index: round(float(final_scores[index]), 4), top_k)
+
+        def row_values(index):
+            distance_km = None
+            if located[index]:
+                distance_km = float(distances[index])
+                scaled = distance_km * 100
+                if abs(scaled - math.floor(scaled) - 0.5) < 1e-6:
+                    # Too close to a rounding midpoint to trust the vector result.
+                    distance_km = haversine_distance_km(user_lat, user_lon, *coordinates[index])
+            return distance_km, float(distance_scores[index]), float(final_scores[index])
+    else:
+        distances, distance_scores, final_scores = _python_batch(
+            user_lat, user_lon, hospitals, specialty_match, coordinates
+        )
+        selected = _top_indices(final_scores, lambda index: round(final_scores[index], 4), top_k)
+
+        def row_values(index):
+            return distances[index], distance_scores[index], final_scores[index]
+
+    ranked = []
+    for index in selected:
+        hospital = hospitals[index]
+        distance_km, distance_score, final_score = row_values(index)
         ranked.append(
-            calculate_hospital_score(
-                user,
+            _score_result(
                 hospital,
-                doctors=doctors,
-                user_lat=user_lat,
-                user_lon=user_lon,
-                hospital_lat=hospital_lat,
-                hospital_lon=hospital_lon,
+                specialties[index],
+                distance_km,
+                distance_score,
+                specialty_match[index],
+                _calculate_rating_score(hospital["rating"]),
+                _calculate_emergency_capability_score(hospital),
+                _calculate_doctor_availability_score(doctors_by_hospital.get(hospital["id"], [])),
+                final_score,
             )
         )
-    ranked.sort(key=lambda item: item["score"], reverse=True)
     return ranked
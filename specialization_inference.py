@@ -1,6 +1,9 @@
+import json
 import os
 
-from google import genai
+import cache_store
+from geolocation_service import _SPECIALTY_KEYWORDS
+from llm_gateway import generate_text
 
 
 _ALLOWED_SPECIALTIES = {
@@ -14,39 +17,95 @@ _ALLOWED_SPECIALTIES = {
     "multispecialty",
 }
 
-_specialization_cache = {}
+SPECIALIZATION_CACHE_NAMESPACE = "specialization"
+SPECIALIZATION_TTL_SECONDS = float(os.environ.get("SPECIALIZATION_TTL_SECONDS", str(90 * 86400)))
+# Keyword-heuristic answers stand in for a failed LLM call and are retried sooner.
+SPECIALIZATION_FALLBACK_TTL_SECONDS = float(
+    os.environ.get("SPECIALIZATION_FALLBACK_TTL_SECONDS", "86400")
+)
+# Raw batch responses, so a repeated batch (e.g. several workers classifying the same
+# fresh Overpass results) costs one call; 0 disables.
+SPECIALIZATION_RESPONSE_TTL_SECONDS = float(
+    os.environ.get("SPECIALIZATION_RESPONSE_TTL_SECONDS", "86400")
+)
 
 
-def _get_client():
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        return None
-    return genai.Client(api_key=api_key)
-
-
-def _normalize_specialty(value):
+def _canonical_specialty(value):
     normalized = str(value or "").strip().lower().replace("-", "_").replace(" ", "_")
     aliases = {
         "multi_specialty": "multispecialty",
         "multi_speciality": "multispecialty",
         "orthopaedics": "orthopedics",
     }
-    normalized = aliases.get(normalized, normalized)
-    if normalized not in _ALLOWED_SPECIALTIES:
-        return "general"
-    return normalized
+    return aliases.get(normalized, normalized)
 
 
-def infer_specialization_with_gemini(hospital_name):
-    cache_key = (hospital_name or "").strip().lower()
-    if not cache_key:
+def _normalize_specialty(value):
+    normalized = _canonical_specialty(value)
+    if normalized not in _ALLOWED_SPECIALTIES:
         return "general"
+    return normalized
 
-    if cache_key in _specialization_cache:
-        return _specialization_cache[cache_key]
 
-    prompt = f"""
-Classify the hospital into exactly one specialization from this strict list:
+def _keyword_specialization(hospital_name):
+    name_text = str(hospital_name or "").strip().lower()
+    for canonical, keywords in _SPECIALTY_KEYWORDS.items():
+        if any(keyword in name_text for keyword in keywords):
+            return _normalize_specialty(canonical)
+    return "general"
+
+
+def _parse_batch_response(text):
+    """
+    Parse {"<id>": "<specialization>"} into {id: specialization}, keeping only
+    entries whose value is on the allowed list.
+    """
+    cleaned = (text or "").strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.replace("```json", "").replace("```", "").strip()
+
+    parsed = json.loads(cleaned)
+    if not isinstance(parsed, dict):
+        return {}
+
+    classified = {}
+    for raw_id, raw_value in parsed.items():
+        specialization = _canonical_specialty(raw_value)
+        if specialization not in _ALLOWED_SPECIALTIES:
+            continue
+        try:
+            classified[int(raw_id)] = specialization
+        except (TypeError, ValueError):
+            continue
+    return classified
+
+
+def infer_specializations_with_gemini(hospital_names):
+    """
+    Classify hospitals by name with at most one Gemini call for all uncached names.
+    Names the model leaves out or answers invalidly fall back to keyword heuristics.
+    Returns {hospital_name: specialization}.
+    """
+    specializations = {}
+    pending = {}
+    for hospital_name in hospital_names:
+        cache_key = (hospital_name or "").strip().lower()
+        if not cache_key:
+            specializations[hospital_name] = "general"
+            continue
+        hit, cached = cache_store.lookup(SPECIALIZATION_CACHE_NAMESPACE, cache_key)
+        if hit:
+            specializations[hospital_name] = cached
+        else:
+            pending.setdefault(cache_key, []).append(hospital_name)
+
+    if pending:
+        cache_keys = list(pending)
+        hospitals_json = json.dumps(
+            [{"id": index, "name": pending[key][0]} for index, key in enumerate(cache_keys)]
+        )
+        prompt = f"""
+Classify each hospital into exactly one specialization from this strict list:
 - general
 - cardiology
 - neurology
@@ -56,24 +115,38 @@ Classify the hospital into exactly one specialization from this strict list:
 - pediatrics
 - multispecialty
 
-Hospital name: {hospital_name}
+Hospitals (JSON):
+{hospitals_json}
 
-Return ONLY one word from the list.
+Return ONLY a JSON object mapping each hospital id to one word from the list, for example:
+{{"0": "cardiology", "1": "general"}}
 """
 
-    try:
-        client = _get_client()
-        if not client:
-            raise ValueError("GEMINI_API_KEY not configured")
+        try:
+            text = generate_text(
+                "specialization",
+                prompt,
+                temperature=0.1,
+                response_mime_type="application/json",
+                cache_ttl_seconds=SPECIALIZATION_RESPONSE_TTL_SECONDS,
+            )
+            classified = _parse_batch_response(text)
+        except Exception:
+            classified = {}
+
+        for index, cache_key in enumerate(cache_keys):
+            if index in classified:
+                specialization = classified[index]
+                ttl_seconds = SPECIALIZATION_TTL_SECONDS
+            else:
+                specialization = _keyword_specialization(pending[cache_key][0])
+                ttl_seconds = SPECIALIZATION_FALLBACK_TTL_SECONDS
+            cache_store.store(SPECIALIZATION_CACHE_NAMESPACE, cache_key, specialization, ttl_seconds)
+            for hospital_name in pending[cache_key]:
+                specializations[hospital_name] = specialization
+
+    return specializations
 
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=prompt,
-            config={"temperature": 0.1},
-        )
-        specialization = _normalize_specialty((response.text or "").strip())
-    except Exception:
-        specialization = "general"
 
-    _specialization_cache[cache_key] = specialization
-    return specialization
+def infer_specialization_with_gemini(hospital_name):
+    return infer_specializations_with_gemini([hospital_name])[hospital_name]
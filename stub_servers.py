@@ -0,0 +1,299 @@
+"""
+Local stand-ins for the external HTTP services CareMatch depends on, for benchmarks
+and offline testing.
+
+Usage:
+    python stub_servers.py overpass --port 8181 --latency 0.2 --error-rate 0.1
+    OVERPASS_ENDPOINTS=http://127.0.0.1:8181/api/interpreter python app.py
+
+    python stub_servers.py nominatim --port 8182 --latency 0.5
+    NOMINATIM_URL=http://127.0.0.1:8182/search python app.py
+
+    python stub_servers.py gemini --port 8183 --latency 1.5 --latency-sigma 0.5 --error-rate 0.05
+    LLM_BASE_URL=http://127.0.0.1:8183 GEMINI_API_KEY=stub python app.py
+
+The Gemini stand-in is also available in-process, without HTTP, as LLM_BACKEND=stub
+(see llm_gateway).
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _stub_hospital_elements(lat, lon, radius_m, count):
+    # Deterministic for a given centre so repeated queries return identical payloads.
+    rng = random.Random(f"{lat:.4f},{lon:.4f}")
+    degrees = radius_m / 111000.0
+    elements = []
+    for index in range(count):
+        elements.append(
+            {
+                "type": "node",
+                "id": 1000 + index,
+                "lat": round(lat + rng.uniform(-degrees, degrees) * 0.7, 6),
+                "lon": round(lon + rng.uniform(-degrees, degrees) * 0.7, 6),
+                "tags": {
+                    "amenity": "hospital",
+                    "name": f"Stub {rng.choice(['Heart', 'Neuro', 'General', 'Bone'])} Hospital {index}",
+                    "emergency": "yes" if index % 2 == 0 else "no",
+                    "addr:city": "Stub City",
+                },
+            }
+        )
+    return elements
+
+
+def sample_latency_seconds(rng, median_seconds, sigma=0.0):
+    """Log-normal latency around median_seconds; sigma 0 gives a fixed latency."""
+    if median_seconds <= 0:
+        return 0.0
+    if not sigma:
+        return median_seconds
+    return median_seconds * math.exp(rng.gauss(0.0, sigma))
+
+
+_STUB_QUESTIONS = [
+    "Did your symptoms interrupt any routine activity today?",
+    "Did you feel more tired than usual after light effort today?",
+    "Did you miss or delay any medication dose today?",
+    "Did stress affect your sleep last night?",
+    "Did you notice any new or unusual symptom today?",
+    "Was your energy lower in the afternoon than in the morning?",
+    "Did you feel dizzy or light-headed at any point today?",
+    "Did worry about your condition distract you today?",
+]
+
+_STUB_SPECIALTIES = ["general", "general", "multispecialty", "cardiology", "neurology", "orthopedics"]
+
+
+def _prompt_number(prompt, label, default):
+    match = re.search(rf"{label}[^:\n]*:\s*(-?[\d.]+)", prompt)
+    return float(match.group(1)) if match else default
+
+
+def scripted_llm_response(prompt):
+    """
+    A plausible response for each CareMatch prompt type. Deterministic for a given
+    prompt, so repeated runs see identical answers.
+    """
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+    if "Classify each hospital" in prompt:
+        match = re.search(r"Hospitals \(JSON\):\s*(\[.*?\])\s*$", prompt, re.S | re.M)
+        hospitals = json.loads(match.group(1)) if match else []
+        return json.dumps({str(item["id"]): rng.choice(_STUB_SPECIALTIES) for item in hospitals})
+
+    if '"risk_level"' in prompt:
+        stress = _prompt_number(prompt, "Stress score", 50.0)
+        energy = _prompt_number(prompt, "Energy score", 50.0)
+        probability = int(max(0, min(100, 0.6 * stress + 0.4 * (100 - energy))))
+        level = "HIGH" if probability >= 70 else "MODERATE" if probability >= 40 else "LOW"
+        return json.dumps(
+            {
+                "risk_level": level,
+                "risk_probability": probability,
+                "reason": f"Stub estimate from stress {stress:.0f} and energy {energy:.0f}.",
+                "recommendation": "Continue monitoring and follow clinical guidance.",
+            }
+        )
+
+    if "adaptive questions" in prompt:
+        return "\n".join(rng.sample(_STUB_QUESTIONS, 3))
+
+    if "clinical summary" in prompt:
+        trend = re.search(r"Trend:\s*(\S+)", prompt)
+        trend = trend.group(1) if trend else "stable"
+        return (
+            f"The patient's overall progression is {trend}. "
+            "Stress and energy readings show no abrupt change across recent check-ins. "
+            "Adherence is consistent with the current treatment plan. "
+            "Continue the current plan and review at the next scheduled visit."
+        )
+
+    return "Stub response."
+
+
+class StubLLMBackend:
+    """
+    In-process Gemini stand-in for llm_gateway: scripted responses after a log-normal
+    delay, failing a fraction error_rate of calls. Latency and failures come from a
+    seeded generator so a run is reproducible.
+    """
+
+    def __init__(self, latency_seconds=0.0, latency_sigma=0.0, error_rate=0.0, seed=0):
+        self.latency_seconds = latency_seconds
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, call_site, prompt, config, timeout_seconds):
+        with self._lock:
+            delay = sample_latency_seconds(self._rng, self.latency_seconds, self.latency_sigma)
+            failed = self.error_rate and self._rng.random() < self.error_rate
+        if delay > timeout_seconds:
+            time.sleep(timeout_seconds)
+            raise TimeoutError(f"stub LLM call exceeded {timeout_seconds}s")
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError("stub LLM error")
+        return scripted_llm_response(prompt)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    latency_seconds = 0.0
+    latency_sigma = 0.0
+    error_rate = 0.0
+
+    def _simulate_upstream(self):
+        with self.server.counter_lock:
+            self.server.request_count += 1
+        if self.latency_seconds:
+            time.sleep(sample_latency_seconds(random, self.latency_seconds, self.latency_sigma))
+        if self.error_rate and random.random() < self.error_rate:
+            self.send_error(504, "Stub upstream timeout")
+            return False
+        return True
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OverpassStubHandler(_StubHandler):
+    """Answers Overpass `around:` hospital queries with synthetic nodes."""
+
+    hospital_count = 30
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        query = self.rfile.read(length).decode("utf-8")
+        if not self._simulate_upstream():
+            return
+
+        match = re.search(r"around:(\d+),(-?[\d.]+),(-?[\d.]+)", query)
+        if not match:
+            self._send_json({"elements": []})
+            return
+
+        radius_m, lat, lon = int(match.group(1)), float(match.group(2)), float(match.group(3))
+        self._send_json(
+            {"elements": _stub_hospital_elements(lat, lon, radius_m, self.hospital_count)}
+        )
+
+
+class NominatimStubHandler(_StubHandler):
+    """Answers /search?q=... with a deterministic point derived from the query."""
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+        if not self._simulate_upstream():
+            return
+        if not query.strip():
+            self._send_json([])
+            return
+
+        rng = random.Random(query.strip().lower())
+        self._send_json(
+            [
+                {
+                    "lat": f"{rng.uniform(8.0, 30.0):.6f}",
+                    "lon": f"{rng.uniform(70.0, 90.0):.6f}",
+                    "display_name": query,
+                }
+            ]
+        )
+
+
+class GeminiStubHandler(_StubHandler):
+    """Answers generateContent requests with scripted_llm_response()."""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request_body = json.loads(self.rfile.read(length) or b"{}")
+        if not self._simulate_upstream():
+            return
+
+        prompt = "".join(
+            part.get("text", "")
+            for content in request_body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        self._send_json(
+            {
+                "candidates": [
+                    {
+                        "content": {"role": "model", "parts": [{"text": scripted_llm_response(prompt)}]},
+                        "finishReason": "STOP",
+                    }
+                ]
+            }
+        )
+
+
+def start_stub_server(handler_class, port=0, **settings):
+    """
+    Serve handler_class on 127.0.0.1 from a daemon thread. Keyword settings override the
+    handler's class attributes (latency_seconds, error_rate, ...). Returns the server;
+    server.url is its base URL and server.request_count counts handled requests.
+    """
+    handler = type(handler_class.__name__, (handler_class,), settings)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.request_count = 0
+    server.counter_lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+STUB_HANDLERS = {
+    "gemini": (GeminiStubHandler, ""),
+    "nominatim": (NominatimStubHandler, "/search"),
+    "overpass": (OverpassStubHandler, "/api/interpreter"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stub of an external service.")
+    parser.add_argument("service", choices=sorted(STUB_HANDLERS))
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument(
+        "--latency-sigma", type=float, default=0.0, help="log-normal spread of the latency (0 = fixed)"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    args = parser.parse_args()
+
+    handler_class, path = STUB_HANDLERS[args.service]
+    server = start_stub_server(
+        handler_class,
+        port=args.port,
+        latency_seconds=args.latency,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+    )
+    print(f"{args.service} stub listening on {server.url}{path}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()